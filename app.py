@@ -2,7 +2,6 @@
 from flask import Flask, session, redirect, url_for, g, request, flash, render_template, jsonify
 import os
 import psutil
-import json
 import sys
 import logging
 from datetime import datetime
@@ -46,8 +45,6 @@ print(f"DEBUG: app.py - CSRFProtect initialized.")
 # （确保 USERS_DB 和 USER_FILES_BASE_DIR 已从配置中加载）
 USERS_DB = app.config.get('USERS_DB', {})
 USER_FILES_BASE_DIR = app.config.get('USER_FILES_BASE_DIR')
-HIDDEN_FILES_PATH = app.config.get('HIDDEN_FILES_PATH')
-SHARED_FILES_PATH = app.config.get('SHARED_FILES_PATH') # <--- 新增
 
 if not USER_FILES_BASE_DIR:
     print("CRITICAL ERROR: USER_FILES_BASE_DIR is not configured. Exiting.")
@@ -77,62 +74,36 @@ for username, data in USERS_DB.items():
         app.logger.warning(f"User {username} does not have a 'home_dir' defined in USERS_DB.")
 
 
-# 加载隐藏文件配置
-if HIDDEN_FILES_PATH and os.path.exists(HIDDEN_FILES_PATH):
-    try:
-        with open(HIDDEN_FILES_PATH, 'r') as f:
-            app.config['HIDDEN_FILES_DB'] = json.load(f)
-        print(f"DEBUG: app.py - HIDDEN_FILES_DB loaded from {HIDDEN_FILES_PATH}")
-    except Exception as e:
-        app.config['HIDDEN_FILES_DB'] = {}
-        print(f"ERROR: app.py - Failed to load hidden files DB: {e}. Initializing to empty.")
-else:
-    app.config['HIDDEN_FILES_DB'] = {}
-    print(f"DEBUG: app.py - HIDDEN_FILES_PATH not found or not set. Initializing HIDDEN_FILES_DB to empty.")
-    # Optionally create an empty file if it doesn't exist
-    if HIDDEN_FILES_PATH:
-        try:
-            with open(HIDDEN_FILES_PATH, 'w') as f:
-                json.dump({}, f)
-            print(f"DEBUG: app.py - Created empty HIDDEN_FILES_DB file at {HIDDEN_FILES_PATH}")
-        except Exception as e:
-            print(f"ERROR: app.py - Could not create empty HIDDEN_FILES_DB file: {e}")
-
-
-# 加载共享文件配置 <--- 新增
-if SHARED_FILES_PATH and os.path.exists(SHARED_FILES_PATH):
-    try:
-        with open(SHARED_FILES_PATH, 'r') as f:
-            app.config['SHARED_FILES_DB'] = json.load(f)
-        print(f"DEBUG: app.py - SHARED_FILES_DB loaded from {SHARED_FILES_PATH}")
-    except Exception as e:
-        app.config['SHARED_FILES_DB'] = {}
-        print(f"ERROR: app.py - Failed to load shared files DB: {e}. Initializing to empty.")
-else:
-    app.config['SHARED_FILES_DB'] = {}
-    print(f"DEBUG: app.py - SHARED_FILES_PATH not found or not set. Initializing SHARED_FILES_DB to empty.")
-    if SHARED_FILES_PATH:
-        try:
-            with open(SHARED_FILES_PATH, 'w') as f:
-                json.dump({}, f)
-            print(f"DEBUG: app.py - Created empty SHARED_FILES_DB file at {SHARED_FILES_PATH}")
-        except Exception as e:
-            print(f"ERROR: app.py - Could not create empty SHARED_FILES_DB file: {e}")
+# 隐藏文件和分享设置不再在启动时读入 app.config（那份副本从不刷新，各 worker 之间也不一致）：
+# 隐藏设置由 blueprints/hidden_index 通过 state_snapshot 的快照和代号跨 worker 共享，
+# 分享记录保存在 blueprints/share_store 的 SQLite 库中。
+
 
 print(f"DEBUG: app.py - Directory creation logic finished.")
 
 
 # ---- 蓝图注册 ----
 print(f"DEBUG: app.py - Registering blueprints...")
+from decorators import login_required
 from blueprints.auth import auth_bp
-from blueprints.files import files_bp
+from blueprints.files import files_bp, upload_file_route
 from blueprints.code_runner import code_runner_bp
 from blueprints.admin_panel import admin_panel_bp
+from blueprints.public_links import public_bp, PublicLinkSessionInterface, PUBLIC_LINK_PREFIX
+from blueprints.listing_cache import ensure_listing_cache
+from blueprints.metadata_index import ensure_index_maintainer
+from blueprints.content_index import ensure_content_indexer
+from blueprints.chunked_upload import ensure_upload_collector
+from blueprints.file_types import init_file_types
 
 app.register_blueprint(auth_bp, url_prefix='/auth')
 app.register_blueprint(files_bp, url_prefix='/files')
+csrf.exempt(upload_file_route) # 上传的 CSRF 校验由 files.check_upload_quota 在配额检查之后进行，避免先读完请求体
 app.register_blueprint(code_runner_bp, url_prefix='/code')
 app.register_blueprint(admin_panel_bp, url_prefix='/admin')
+app.register_blueprint(public_bp, url_prefix=PUBLIC_LINK_PREFIX) # 匿名公开链接
+app.session_interface = PublicLinkSessionInterface() # 公开链接的请求不解析、不写回会话 cookie
+init_file_types(app) # 按配置编译一次文件类型表，之后各处只查表
 print(f"DEBUG: app.py - Blueprints registered.")
 
 
@@ -150,55 +121,75 @@ def load_logged_in_user():
         # else:
             # current_app.logger.warning(f"User_id {user_id} in session but not in USERS_DB")
 
+# 后台服务只在拿到维护锁的一个 worker 中运行（其他 worker 每次只是一次 pid 比较）
+@app.before_request
+def start_background_services():
+    ensure_listing_cache(app) # 先订阅 fs_watcher，本进程成为维护进程时站外修改才会发布给各 worker 的列表缓存
+    ensure_index_maintainer(app) # 索引维护线程和 inotify 监视器
+    ensure_content_indexer(app) # 全文索引线程同样只在维护进程中运行
+    ensure_upload_collector(app) # 定期清理过期的分块上传会话
+
+def get_system_stats():
+    try:
+        temp_str = "N/A"
+        # 尝试读取树莓派温度
+        if os.path.exists("/sys/class/thermal/thermal_zone0/temp"):
+            with open("/sys/class/thermal/thermal_zone0/temp", "r") as f:
+                temp = int(f.read().strip()) / 1000.0
+            temp_str = f"{temp:.1f}°C"
+
+        ram = psutil.virtual_memory()
+        ram_total = f"{ram.total / (1024**3):.2f} GB"
+        ram_used = f"{ram.used / (1024**3):.2f} GB ({ram.percent}%)"
+
+        # 根分区磁盘空间
+        disk_root = psutil.disk_usage('/')
+        disk_root_total = f"{disk_root.total / (1024**3):.2f} GB"
+        disk_root_free = f"{disk_root.free / (1024**3):.2f} GB ({disk_root.percent}%)"
+
+        # 用户文件存储分区 (外部硬盘)
+        user_disk_path = app.config.get('USER_FILES_BASE_DIR', '/')
+        user_disk_total_str = "N/A"
+        user_disk_free_str = "N/A"
+        if os.path.exists(os.path.dirname(user_disk_path)): # 检查挂载点的父目录
+            try:
+                user_disk = psutil.disk_usage(user_disk_path)
+                user_disk_total_str = f"{user_disk.total / (1024**3):.2f} GB"
+                user_disk_free_str = f"{user_disk.free / (1024**3):.2f} GB ({user_disk.percent}%)"
+            except FileNotFoundError:
+                app.logger.warning(f"Path for user disk stats not found: {user_disk_path}")
+            except Exception as e:
+                app.logger.error(f"Error getting user disk stats for {user_disk_path}: {e}")
+
+
+        return {
+            "temperature": temp_str,
+            "ram_total": ram_total,
+            "ram_used": ram_used,
+            "disk_root_total": disk_root_total,
+            "disk_root_free": disk_root_free,
+            "user_disk_total": user_disk_total_str,
+            "user_disk_free": user_disk_free_str,
+            "user_disk_path": user_disk_path
+        }
+    except Exception as e:
+        app.logger.error(f"Error getting system stats: {e}")
+        return {} # 返回空字典，模板中需要处理
+
+
 @app.context_processor
-def inject_system_stats():
-    def get_system_stats():
-        try:
-            temp_str = "N/A"
-            # 尝试读取树莓派温度
-            if os.path.exists("/sys/class/thermal/thermal_zone0/temp"):
-                with open("/sys/class/thermal/thermal_zone0/temp", "r") as f:
-                    temp = int(f.read().strip()) / 1000.0
-                temp_str = f"{temp:.1f}°C"
-
-            ram = psutil.virtual_memory()
-            ram_total = f"{ram.total / (1024**3):.2f} GB"
-            ram_used = f"{ram.used / (1024**3):.2f} GB ({ram.percent}%)"
-
-            # 根分区磁盘空间
-            disk_root = psutil.disk_usage('/')
-            disk_root_total = f"{disk_root.total / (1024**3):.2f} GB"
-            disk_root_free = f"{disk_root.free / (1024**3):.2f} GB ({disk_root.percent}%)"
-
-            # 用户文件存储分区 (外部硬盘)
-            user_disk_path = app.config.get('USER_FILES_BASE_DIR', '/')
-            user_disk_total_str = "N/A"
-            user_disk_free_str = "N/A"
-            if os.path.exists(os.path.dirname(user_disk_path)): # 检查挂载点的父目录
-                try:
-                    user_disk = psutil.disk_usage(user_disk_path)
-                    user_disk_total_str = f"{user_disk.total / (1024**3):.2f} GB"
-                    user_disk_free_str = f"{user_disk.free / (1024**3):.2f} GB ({user_disk.percent}%)"
-                except FileNotFoundError:
-                    app.logger.warning(f"Path for user disk stats not found: {user_disk_path}")
-                except Exception as e:
-                    app.logger.error(f"Error getting user disk stats for {user_disk_path}: {e}")
-
-
-            return {
-                "temperature": temp_str,
-                "ram_total": ram_total,
-                "ram_used": ram_used,
-                "disk_root_total": disk_root_total,
-                "disk_root_free": disk_root_free,
-                "user_disk_total": user_disk_total_str,
-                "user_disk_free": user_disk_free_str,
-                "user_disk_path": user_disk_path
-            }
-        except Exception as e:
-            app.logger.error(f"Error getting system stats: {e}")
-            return {} # 返回空字典，模板中需要处理
-    return dict(system_stats=get_system_stats(), current_year=datetime.utcnow().year)
+def inject_template_globals():
+    # 系统状态不再随页面渲染（每次都要调用 psutil，也会让列表页的 ETag 随之变化），由侧栏通过 /api/system-stats 加载
+    return dict(current_year=datetime.utcnow().year)
+
+
+@app.route('/api/system-stats')
+@login_required
+def api_system_stats():
+    """侧栏“服务器状态”卡片的数据；单独请求，不缓存。"""
+    response = jsonify(get_system_stats())
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 
 # ---- 错误处理 ----
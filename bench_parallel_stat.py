@@ -0,0 +1,99 @@
+# /home/pi/my_cloud_app/bench_parallel_stat.py
+"""
+并行 stat 基准测试：分别在 1k / 10k / 50k 个文件的目录上，比较逐个 stat 与线程池并行 stat 的列表耗时。
+
+用法 (在要测试的硬盘上运行；清空页缓存需要 root):
+    sudo python3 bench_parallel_stat.py --dir /mnt/mydisk/my_cloud_storage/.bench --workers 4,8,16
+
+每一轮测量前都会写 /proc/sys/vm/drop_caches 清空 dentry/inode 缓存，模拟冷缓存；
+没有权限时会给出提示，此时测到的是热缓存下的结果，并行几乎没有收益。
+结束后只删除本脚本创建的 entries_<条目数> 子目录 (--keep 保留，下次可直接复用，省去创建文件的时间)；
+--dir 中原有的其他内容不会被动到，--dir 是本脚本新建的话最后把这个空目录也删掉。
+"""
+import argparse
+import os
+import shutil
+import statistics
+import time
+
+from flask import Flask
+
+from blueprints.listing import scan_directory
+
+
+def prepare_dir(base_dir, count):
+    dir_abs = os.path.join(base_dir, f"entries_{count}")
+    os.makedirs(dir_abs, exist_ok=True)
+    existing = len(os.listdir(dir_abs))
+    for i in range(existing, count):
+        with open(os.path.join(dir_abs, f"file_{i:06d}.txt"), 'wb') as f:
+            f.write(b'x' * (i % 4096))
+    return dir_abs
+
+
+def drop_caches():
+    os.sync()
+    try:
+        with open('/proc/sys/vm/drop_caches', 'w') as f:
+            f.write('3\n')
+        return True
+    except OSError:
+        return False
+
+
+def time_listing(app, dir_abs, workers, rounds):
+    app.config['PARALLEL_STAT_MOUNTS'] = {dir_abs: workers}
+    timings = []
+    cold = True
+    with app.app_context():
+        for _ in range(rounds):
+            cold = drop_caches() and cold
+            started_at = time.perf_counter()
+            entries = scan_directory(dir_abs)
+            timings.append(time.perf_counter() - started_at)
+    return statistics.median(timings), len(entries), cold
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较逐个 stat 与并行 stat 的目录列表耗时")
+    parser.add_argument('--dir', required=True, help="测试目录所在位置，应位于要测量的硬盘上")
+    parser.add_argument('--sizes', default='1000,10000,50000', help="目录条目数，逗号分隔")
+    parser.add_argument('--workers', default='4,8,16', help="要比较的线程数，逗号分隔")
+    parser.add_argument('--rounds', type=int, default=3, help="每种配置测量的次数，取中位数")
+    parser.add_argument('--keep', action='store_true', help="结束后保留测试目录")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['PARALLEL_STAT_MIN_ENTRIES'] = 32
+    app.config['PARALLEL_STAT_BATCH_SIZE'] = 512
+    worker_counts = [0] + [int(w) for w in args.workers.split(',') if w]
+
+    print(f"{'条目数':>8} {'线程数':>6} {'耗时(ms)':>10} {'相对逐个':>8}")
+    all_cold = True
+    created_base = not os.path.exists(args.dir)
+    prepared = []
+    try:
+        for count in (int(c) for c in args.sizes.split(',') if c):
+            dir_abs = prepare_dir(args.dir, count)
+            prepared.append(dir_abs)
+            baseline = None
+            for workers in worker_counts:
+                seconds, listed, cold = time_listing(app, dir_abs, workers, args.rounds)
+                all_cold = all_cold and cold
+                baseline = baseline or seconds
+                print(f"{listed:>8} {workers or '逐个':>6} {seconds * 1000:>10.1f} {baseline / seconds:>7.2f}x")
+    finally:
+        if not args.keep:
+            for dir_abs in prepared:
+                shutil.rmtree(dir_abs, ignore_errors=True)
+            if created_base:
+                try:
+                    os.rmdir(args.dir)
+                except OSError:
+                    pass  # 期间有别的内容写进来，保留
+    if not all_cold:
+        print("注意: 无法清空页缓存 (需要 root)，以上为热缓存下的结果。")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,55 +1,119 @@
-from flask import Blueprint, render_template, request, flash, current_app, session, redirect, url_for, g
+from flask import Blueprint, render_template, request, flash, current_app, session, redirect, url_for, g, jsonify
 from decorators import admin_required, login_required # 确保从 decorators.py 导入
 import os
-import json # 用于保存和加载 HIDDEN_FILES.json
+from itertools import islice
 from .utils import get_absolute_path
+from .listing import iter_tree, encode_cursor, decode_cursor
+from .hidden_index import get_hidden_index, update_hidden_paths
+from .share_store import split_share_path
 
 admin_panel_bp = Blueprint('admin_panel', __name__, template_folder='../templates/admin_panel')
 
-def get_all_user_files_recursive(user_home_abs_path, base_path_for_relative=""):
+def iter_user_files(start_abs_path, start_rel_path, max_depth, resume_after=None):
     """
-    递归获取指定绝对路径下的所有文件和文件夹。
-    返回一个列表，每个元素是字典 {'path': '相对于扫描起始点的路径', 'is_dir': True/False}。
-    base_path_for_relative: 内部递归使用，外部调用时为空字符串。
+    逐个生成 start_abs_path 下的文件和文件夹 {'path': 相对用户主目录的路径, 'is_dir', 'depth'}，
+    文件夹在前、按名称排序，最多向下 max_depth 层。遍历由 listing.iter_tree 完成（迭代式 scandir，惰性生成）。
+    resume_after 为上一页最后一条的路径（文件夹以 '/' 结尾）：iter_tree 直接定位到它之后继续，每页的代价与页码无关。
     """
-    items = []
-    try:
-        for item_name in os.listdir(user_home_abs_path):
-            current_item_abs_path = os.path.join(user_home_abs_path, item_name)
-            # 构建相对于最初扫描目录的路径
-            relative_path = os.path.join(base_path_for_relative, item_name).replace(os.sep, '/') # 统一使用 / 作为路径分隔符
-            
-            items.append({"path": relative_path, "is_dir": os.path.isdir(current_item_abs_path)})
-            
-            if os.path.isdir(current_item_abs_path):
-                # 递归进入子目录
-                items.extend(get_all_user_files_recursive(current_item_abs_path, relative_path))
-    except FileNotFoundError:
-        current_app.logger.warning(f"Directory not found during scan: {user_home_abs_path}")
-    except PermissionError:
-        current_app.logger.warning(f"Permission denied while scanning: {user_home_abs_path}")
-    return items
-
-def load_hidden_files_config():
-    """从 JSON 文件加载隐藏文件配置"""
+    if resume_after is not None and start_rel_path:
+        resume_after = resume_after[len(start_rel_path) + 1:] if resume_after.startswith(start_rel_path + '/') else None
+    for rel_path, is_dir, depth in iter_tree(start_abs_path, max_depth=max_depth, resume_after=resume_after):
+        yield {"path": f"{start_rel_path}/{rel_path}" if start_rel_path else rel_path,
+               "is_dir": is_dir, "depth": depth}
+
+def _user_home_or_none(username):
+    """非管理员用户的主目录绝对路径；用户不存在、是管理员或目录无效时返回 None。"""
+    user_data = current_app.config.get('USERS_DB', {}).get(username)
+    user_files_root_dir = current_app.config.get('USER_FILES_ROOT')
+    if not user_data or user_data.get('role') == 'admin' or not user_files_root_dir:
+        return None
+    user_home_abs = os.path.abspath(os.path.join(user_files_root_dir, username))
+    return user_home_abs if os.path.isdir(user_home_abs) else None
+
+
+@admin_panel_bp.route('/api/user-files/<username>')
+@login_required
+@admin_required
+def api_user_files(username):
+    """
+    分页返回某个用户主目录(或其中一个文件夹)下的文件树，供管理面板按文件夹展开时加载。
+    查询参数: path (相对主目录的文件夹，默认主目录), depth (向下展开的层数，默认 1),
+    limit (每页条数), cursor (上一页返回的 next_cursor)。
+    每个条目带 is_hidden (被显式勾选隐藏) 和 hidden_by_parent (某个上级文件夹已被隐藏)。
+    """
+    user_home_abs = _user_home_or_none(username)
+    if user_home_abs is None:
+        return jsonify({"status": "error", "message": "用户不存在或主目录无效。"}), 404
+
+    rel_path = request.args.get('path', '').strip('/')
+    start_abs = get_absolute_path(username, rel_path) if rel_path else user_home_abs
+    if start_abs is None or (start_abs != user_home_abs and not start_abs.startswith(user_home_abs + os.sep)) \
+            or not os.path.isdir(start_abs):
+        return jsonify({"status": "error", "message": "文件夹不存在。"}), 404
+    rel_path = os.path.relpath(start_abs, user_home_abs).replace(os.sep, '/') if start_abs != user_home_abs else ''
+
+    max_depth_limit = current_app.config.get('ADMIN_TREE_MAX_DEPTH', 8)
+    page_size = current_app.config.get('ADMIN_TREE_PAGE_SIZE', 500)
     try:
-        with open(current_app.config['HIDDEN_FILES_PATH'], 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        current_app.logger.info(f"Hidden files config not found or invalid at {current_app.config['HIDDEN_FILES_PATH']}. Returning empty config.")
-        return {} # 如果文件不存在或格式错误，返回空字典
-
-def save_hidden_files_config(config_data):
-    """将隐藏文件配置保存到 JSON 文件"""
+        depth = min(max(request.args.get('depth', 1, type=int), 1), max_depth_limit)
+        limit = min(max(request.args.get('limit', page_size, type=int), 1), page_size)
+        resume_after, offset = None, 0
+        cursor = request.args.get('cursor')
+        if cursor:
+            offset, resume_after, cursor_signature = decode_cursor(cursor)
+            if cursor_signature != [rel_path, depth] or not isinstance(resume_after, str):
+                raise ValueError("cursor does not match this folder")
+            # 游标由客户端回传，resume_after 会被逐层拼进路径，不能含 '..'
+            if split_share_path(resume_after) is None:
+                raise ValueError("invalid cursor path")
+    except (TypeError, ValueError) as e:
+        return jsonify({"status": "error", "message": f"参数无效: {e}"}), 400
+
+    # 多取一条判断是否还有下一页；遍历是惰性的，只读到本页结束为止
+    page = list(islice(iter_user_files(start_abs, rel_path, depth, resume_after), limit + 1))
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        last = page[-1]
+        next_cursor = encode_cursor(offset + limit, last['path'] + ('/' if last['is_dir'] else ''), [rel_path, depth])
+
+    hidden_index = get_hidden_index()
+    explicitly_hidden = hidden_index.hidden_paths(username)
+    parent_hidden = {}
+    for item in page:
+        parent = item['path'].rpartition('/')[0]
+        if parent not in parent_hidden:
+            parent_hidden[parent] = bool(parent) and hidden_index.is_hidden(username, parent)
+        item['name'] = item['path'].rpartition('/')[2]
+        item['is_hidden'] = item['path'] in explicitly_hidden
+        item['hidden_by_parent'] = parent_hidden[parent]
+
+    return jsonify({"status": "success", "path": rel_path, "depth": depth,
+                    "items": page, "next_cursor": next_cursor})
+
+
+@admin_panel_bp.route('/api/hidden-files/<username>', methods=['POST'])
+@login_required
+@admin_required
+def api_update_hidden_files(username):
+    """
+    按增量修改某个用户的隐藏设置。请求体 JSON: {"add": [路径, ...], "remove": [路径, ...]}，
+    路径相对该用户主目录。返回新的版本号和该用户的隐藏条数。
+    """
+    if _user_home_or_none(username) is None:
+        return jsonify({"status": "error", "message": "用户不存在或主目录无效。"}), 404
+    payload = request.get_json(silent=True) or {}
+    add, remove = payload.get('add', []), payload.get('remove', [])
+    if not isinstance(add, list) or not isinstance(remove, list) \
+            or not all(isinstance(p, str) for p in add + remove):
+        return jsonify({"status": "error", "message": "add / remove 必须是路径字符串列表。"}), 400
     try:
-        os.makedirs(os.path.dirname(current_app.config['HIDDEN_FILES_PATH']), exist_ok=True) # 确保目录存在
-        with open(current_app.config['HIDDEN_FILES_PATH'], 'w') as f:
-            json.dump(config_data, f, indent=4)
-        current_app.config['HIDDEN_FILES'] = config_data # 更新内存中的配置 (如果 app.py 中有这个逻辑)
-        return True
-    except IOError as e:
+        version, hidden_count = update_hidden_paths(username, add=add, remove=remove)
+    except OSError as e:
         current_app.logger.error(f"Error saving hidden files config: {e}")
-        return False
+        return jsonify({"status": "error", "message": "保存隐藏文件配置失败！"}), 500
+    return jsonify({"status": "success", "message": "隐藏设置已更新。", "version": version, "hidden_count": hidden_count})
+
 
 @admin_panel_bp.route('/', methods=['GET', 'POST'])
 @login_required
@@ -60,7 +124,7 @@ def panel_home():
 
     if not user_files_root_dir:
         flash("配置错误：USER_FILES_ROOT 未设置！", "danger")
-        return render_template('panel_home.html', non_admin_users={}, selected_user_for_management=None, user_files_to_manage=[])
+        return render_template('panel_home.html', non_admin_users={}, selected_user_for_management=None, hidden_count=0)
 
     # 获取所有非管理员用户
     non_admin_users = {username: data for username, data in users_db.items() if data.get('role') != 'admin'}
@@ -71,8 +135,6 @@ def panel_home():
          selected_user_for_management = request.form.get('target_user')
 
 
-    user_files_to_manage = []
-    hidden_files_config = load_hidden_files_config() # 加载最新的隐藏配置
 
     if request.method == 'POST':
         action = request.form.get('action')
@@ -82,45 +144,30 @@ def panel_home():
             # 获取所有提交的、name 为 "hidden_paths_for_user_USERNAME" 的复选框的值
             # 这些值应该是文件/文件夹相对于该用户家目录的路径
             hidden_paths_submitted = request.form.getlist(f'hidden_paths_for_user_{target_user_for_post}')
-            
-            # 更新该用户的隐藏文件列表
-            hidden_files_config[target_user_for_post] = hidden_paths_submitted
-            
-            if save_hidden_files_config(hidden_files_config):
+            # 文件树按文件夹按需加载，页面上只有已加载的条目 (shown_paths)；
+            # 换算成增量：勾选的加入，已加载但未勾选的移除，未加载部分原有的隐藏设置保持不变
+            shown_paths = set(request.form.getlist('shown_paths'))
+            try:
+                update_hidden_paths(target_user_for_post,
+                                    add=hidden_paths_submitted,
+                                    remove=shown_paths - set(hidden_paths_submitted))
                 flash(f"用户 '{target_user_for_post}' 的文件隐藏设置已更新。", "success")
-            else:
+            except OSError as e:
+                current_app.logger.error(f"Error saving hidden files config: {e}")
                 flash("保存隐藏文件配置失败！", "danger")
             
             # 重定向到同一个用户的管理页面，以显示更新后的状态
             return redirect(url_for('.panel_home', manage_user=target_user_for_post))
 
     # --- 为GET请求或POST后重新加载页面准备数据 ---
+    # 文件树不在这里扫描：页面打开后由 api_user_files 逐个文件夹分页加载
     if selected_user_for_management and selected_user_for_management in non_admin_users:
         user_home_abs = os.path.abspath(os.path.join(user_files_root_dir, selected_user_for_management))
         
         current_app.logger.debug(f"Managing files for user: {selected_user_for_management}")
         current_app.logger.debug(f"Absolute home path for user: {user_home_abs}")
 
-        if os.path.isdir(user_home_abs):
-            all_files_raw = get_all_user_files_recursive(user_home_abs) # 扫描用户家目录
-            
-            # 排序，文件夹在前，文件在后，然后按路径
-            all_files_raw.sort(key=lambda x: (not x['is_dir'], x['path']))
-            
-            current_user_hidden_list = hidden_files_config.get(selected_user_for_management, [])
-            
-            for file_item in all_files_raw:
-                user_files_to_manage.append({
-                    'path': file_item['path'], # 相对于用户家目录的路径
-                    'is_dir': file_item['is_dir'],
-                    'is_hidden': file_item['path'] in current_user_hidden_list
-                })
-            
-            current_app.logger.debug(f"Files found for user {selected_user_for_management}: {len(user_files_to_manage)}")
-            if not user_files_to_manage:
-                 flash(f"用户 '{selected_user_for_management}' 的主目录中没有文件或文件夹。", "info")
-
-        else:
+        if not os.path.isdir(user_home_abs):
             flash(f"用户 '{selected_user_for_management}' 的主目录 '{user_home_abs}' 未找到或不是有效目录。", "warning")
             current_app.logger.warning(f"User home directory not found or invalid: {user_home_abs}")
             selected_user_for_management = None # 清除选择，避免后续逻辑错误
@@ -128,4 +175,5 @@ def panel_home():
     return render_template('panel_home.html',
                            non_admin_users=non_admin_users,
                            selected_user_for_management=selected_user_for_management,
-                           user_files_to_manage=user_files_to_manage)
+                           hidden_count=len(get_hidden_index().hidden_paths(selected_user_for_management))
+                                        if selected_user_for_management else 0)
@@ -0,0 +1,286 @@
+# /home/pi/my_cloud_app/blueprints/chunked_upload.py
+"""
+可续传的分块上传。
+
+协议（路由在 files.py，均需登录；写操作与其他 AJAX 请求一样带 X-CSRFToken 头）：
+  POST   /files/api/uploads                  创建会话，表单字段 path=目标目录, filename, size
+  GET    /files/api/uploads/<id>             查询已接收的字节数（JSON 的 offset 和 Upload-Offset 响应头；HEAD 同样可用）
+  PUT    /files/api/uploads/<id>             请求体为一个分块，Upload-Offset 头 (或 ?offset=) 给出它的起始位置；
+                                             起始位置必须等于已接收的字节数，否则返回 409 和实际的 offset
+  POST   /files/api/uploads/<id>/complete    全部收到后放到目标目录（同名时自动改名，绝不覆盖已有文件）
+  DELETE /files/api/uploads/<id>             放弃上传
+连接中断后客户端查询 offset 并从那里继续 PUT，已经写到磁盘上的部分不用重传。
+
+分块边读边追加到 CHUNKED_UPLOAD_DIR（默认 USER_FILES_BASE_DIR/.uploads，与用户文件在同一块硬盘上）下的 <id>.part，
+不经过 werkzeug 的临时文件，也不在内存中缓存整个分块；完成时用 os.link 把它链接到目标目录再删掉 .part，不再复制一遍。
+与 rename 不同，link 在目标已存在时失败而不是静默覆盖，所以并发写入同名文件时只会换一个 name_N.ext 重试。
+已接收的字节数就是 .part 文件的大小，每个分块写完 fsync 之后才返回，断电重启后查询到的 offset 一定已经落盘。
+会话信息（所有者、目标目录、文件名、总大小）存在旁边的 <id>.json 中，所有 worker 共享。
+.uploads 不属于任何用户主目录，暂存的数据不进入元数据索引，配额按各会话声明的总大小预留（pending_upload_bytes）。
+
+超过 CHUNKED_UPLOAD_EXPIRE_SECONDS 没有收到新分块的会话由 collect_stale_uploads 删除，
+它在元数据索引的维护进程中每 CHUNKED_UPLOAD_GC_INTERVAL 秒运行一次（见 ensure_upload_collector），
+不依赖有没有人创建新会话。
+"""
+import errno
+import fcntl
+import itertools
+import os
+import re
+import secrets
+import shutil
+import threading
+import time
+
+from flask import current_app
+
+from .data_store import atomic_write_json, read_json
+from .metadata_index import is_index_maintainer
+
+
+_UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+_COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class UploadError(Exception):
+    """分块上传请求无法完成。status_code 是返回给客户端的 HTTP 状态码，offset 是当前已接收的字节数（已知时）。"""
+
+    def __init__(self, message, status_code, offset=None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.offset = offset
+
+
+def upload_dir():
+    directory = current_app.config.get('CHUNKED_UPLOAD_DIR') or os.path.join(current_app.config['USER_FILES_BASE_DIR'], '.uploads')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def _paths(upload_id):
+    directory = upload_dir()
+    return os.path.join(directory, upload_id + '.json'), os.path.join(directory, upload_id + '.part')
+
+
+def _received_bytes(part_path):
+    try:
+        return os.stat(part_path).st_size
+    except FileNotFoundError:
+        return None
+
+
+def create_upload(owner, dest_dir_rel, filename, size):
+    """新建上传会话并返回会话信息 (见 get_upload)。"""
+    upload_id = secrets.token_hex(16)
+    meta_path, part_path = _paths(upload_id)
+    with open(part_path, 'xb'):
+        pass
+    upload = {'id': upload_id, 'owner': owner, 'dest_dir': dest_dir_rel, 'filename': filename,
+               'size': size, 'created': time.time()}
+    atomic_write_json(meta_path, upload)
+    current_app.logger.info(f"Chunked upload {upload_id} created by '{owner}': '{filename}' ({size} bytes) -> '{dest_dir_rel}'.")
+    return dict(upload, offset=0)
+
+
+def get_upload(owner, upload_id):
+    """owner 的上传会话 {'id', 'owner', 'dest_dir', 'filename', 'size', 'created', 'offset'}；不存在或不属于 owner 时返回 None。"""
+    if not _UPLOAD_ID_RE.match(upload_id or ''):
+        return None
+    meta_path, part_path = _paths(upload_id)
+    upload = read_json(meta_path, default={})
+    offset = _received_bytes(part_path)
+    if upload.get('owner') != owner or offset is None:
+        return None
+    upload['offset'] = offset
+    return upload
+
+
+def pending_upload_bytes(owner):
+    """owner 尚未完成的上传会话声明的总字节数，创建新会话时计入配额。"""
+    total = 0
+    for name in os.listdir(upload_dir()):
+        if name.endswith('.json'):
+            upload = read_json(os.path.join(upload_dir(), name), default={})
+            if upload.get('owner') == owner and isinstance(upload.get('size'), int):
+                total += upload['size']
+    return total
+
+
+def append_chunk(upload, offset, stream, length):
+    """
+    把 stream 中的 length 字节追加到 offset 处，返回新的 offset。
+    offset 必须等于已接收的字节数；同一会话的另一个分块正在写入时返回 409，客户端稍后查询 offset 再继续。
+    中途出错（例如客户端断开）时已经写入的部分保留并落盘，下次从新的 offset 继续。
+    """
+    meta_path, part_path = _paths(upload['id'])
+    if length is None:
+        raise UploadError("分块请求必须带 Content-Length。", 411)
+    try:
+        part_file = open(part_path, 'r+b')
+    except FileNotFoundError:
+        raise UploadError("上传会话不存在或已过期。", 404)
+    with part_file:
+        try:
+            fcntl.flock(part_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            raise UploadError("该上传会话正在接收另一个分块。", 409, offset=os.fstat(part_file.fileno()).st_size)
+        received = os.fstat(part_file.fileno()).st_size
+        if offset != received:
+            raise UploadError("分块的起始位置与已接收的字节数不一致。", 409, offset=received)
+        if received + length > upload['size']:
+            raise UploadError("分块超出了上传会话声明的文件大小。", 413, offset=received)
+        part_file.seek(received)
+        remaining = length
+        try:
+            while remaining > 0:
+                data = stream.read(min(_COPY_BUFFER_SIZE, remaining))
+                if not data:
+                    break
+                part_file.write(data)
+                remaining -= len(data)
+        finally:
+            part_file.flush()
+            os.fsync(part_file.fileno())
+        received = part_file.tell()
+    if remaining > 0:
+        raise UploadError("分块数据不完整，请查询 offset 后继续。", 400, offset=received)
+    return received
+
+
+def finish_upload(upload, dest_dir_abs):
+    """
+    把已收齐的 .part 放到 dest_dir_abs 下并删除会话，返回保存的路径。
+    同名文件已存在时依次尝试 name_1.ext、name_2.ext ...，不会覆盖任何已有文件。
+    """
+    meta_path, part_path = _paths(upload['id'])
+    try:
+        part_file = open(part_path, 'rb')
+    except FileNotFoundError:
+        raise UploadError("上传会话不存在或已过期。", 404)
+    with part_file:
+        # 与 append_chunk 互斥，同一会话的两个 complete 请求也只有一个能发布文件
+        try:
+            fcntl.flock(part_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            raise UploadError("该上传会话正在接收分块或正在完成。", 409, offset=os.fstat(part_file.fileno()).st_size)
+        if not os.path.exists(part_path):
+            raise UploadError("上传会话不存在或已过期。", 404)
+        received = os.fstat(part_file.fileno()).st_size
+        if received != upload['size']:
+            raise UploadError("文件尚未全部上传。", 409, offset=received)
+        target_abs = _publish(part_path, dest_dir_abs, upload['filename'])
+    _remove_quietly(meta_path)
+    current_app.logger.info(f"Chunked upload {upload['id']} by '{upload['owner']}' finished: '{target_abs}'.")
+    return target_abs
+
+
+def _candidate_paths(dir_abs, filename):
+    name, ext = os.path.splitext(filename)
+    yield os.path.join(dir_abs, filename)
+    for counter in itertools.count(1):
+        yield os.path.join(dir_abs, f"{name}_{counter}{ext}")
+
+
+def _publish(part_path, dest_dir_abs, filename):
+    for target_abs in _candidate_paths(dest_dir_abs, filename):
+        try:
+            os.link(part_path, target_abs)  # 目标已存在时 EEXIST，换下一个名字
+        except FileExistsError:
+            continue
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP):
+                raise
+            return _publish_without_link(part_path, dest_dir_abs, filename)
+        os.remove(part_path)
+        return target_abs
+
+
+def _publish_without_link(part_path, dest_dir_abs, filename):
+    """暂存目录在另一个文件系统上，或文件系统不支持硬链接 (如 exFAT)：先用 O_EXCL 占住文件名，再把内容放进去。"""
+    for target_abs in _candidate_paths(dest_dir_abs, filename):
+        try:
+            reserved = open(target_abs, 'xb')
+        except FileExistsError:
+            continue
+        try:
+            with reserved:
+                try:
+                    os.replace(part_path, target_abs)  # 替换的是自己刚占住的空文件
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    current_app.logger.warning(f"CHUNKED_UPLOAD_DIR is on a different filesystem than '{target_abs}'; copying.")
+                    with open(part_path, 'rb') as part_file:
+                        shutil.copyfileobj(part_file, reserved, _COPY_BUFFER_SIZE)
+                    os.remove(part_path)
+        except BaseException:
+            _remove_quietly(target_abs)
+            raise
+        return target_abs
+
+
+def abort_upload(upload):
+    for path in _paths(upload['id']):
+        _remove_quietly(path)
+    current_app.logger.info(f"Chunked upload {upload['id']} by '{upload['owner']}' aborted.")
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def collect_stale_uploads():
+    """删除超过 CHUNKED_UPLOAD_EXPIRE_SECONDS 没有活动的会话（以及没有会话信息的孤立 .part），返回删除的会话数。"""
+    cutoff = time.time() - current_app.config.get('CHUNKED_UPLOAD_EXPIRE_SECONDS', 24 * 3600)
+    directory = upload_dir()
+    removed = 0
+    for name in os.listdir(directory):
+        upload_id, ext = os.path.splitext(name)
+        if ext not in ('.json', '.part') or not _UPLOAD_ID_RE.match(upload_id):
+            continue
+        mtimes = []
+        for path in _paths(upload_id):
+            try:
+                mtimes.append(os.stat(path).st_mtime)
+            except FileNotFoundError:
+                pass
+        # 同一会话的两个文件都会被遍历到；第二次时已经删掉，mtimes 为空
+        if mtimes and max(mtimes) < cutoff:
+            for path in _paths(upload_id):
+                _remove_quietly(path)
+            removed += 1
+    if removed:
+        current_app.logger.info(f"Removed {removed} stale chunked upload session(s) from {directory}.")
+    return removed
+
+
+_collector_pid = None
+
+
+def ensure_upload_collector(app):
+    """
+    每个请求前调用：在元数据索引的维护进程中启动一次定期清理线程。
+    索引被禁用时没有维护进程，每个 worker 各自清理（删除本身是幂等的）。
+    """
+    global _collector_pid
+    if _collector_pid == os.getpid():
+        return
+    if app.config.get('METADATA_INDEX_ENABLED', True) and not is_index_maintainer():
+        return
+    _collector_pid = os.getpid()
+
+    def run():
+        interval = max(1, app.config.get('CHUNKED_UPLOAD_GC_INTERVAL', 600))
+        with app.app_context():
+            while True:
+                try:
+                    collect_stale_uploads()
+                except Exception as e:
+                    app.logger.error(f"Chunked upload cleanup failed: {e}", exc_info=True)
+                time.sleep(interval)
+
+    threading.Thread(target=run, name='upload-gc', daemon=True).start()
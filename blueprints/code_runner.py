@@ -3,6 +3,7 @@ import subprocess
 import os
 import tempfile
 from decorators import admin_required, login_required # 确保这些装饰器在 decorators.py 中定义正确
+from .file_types import get_file_types
 
 code_runner_bp = Blueprint('code_runner', __name__, template_folder='../templates/code_runner') # 确保模板路径正确
 
@@ -47,13 +48,22 @@ def run_code():
             # (5) 路径安全检查改进
             # if absolute_file_path.startswith(admin_home_abs + os.sep) and os.path.isfile(absolute_file_path): # 更严格
             # 更简洁且通常足够安全的做法是，确认 admin_home_abs 是 absolute_file_path 的前缀
-            if os.path.commonpath([admin_home_abs, absolute_file_path]) == admin_home_abs and os.path.isfile(absolute_file_path):
+            file_types = get_file_types()
+            is_file = os.path.commonpath([admin_home_abs, absolute_file_path]) == admin_home_abs and os.path.isfile(absolute_file_path)
+            # 无扩展名的脚本按文件头(#!)识别；其他文件只认可运行的扩展名
+            is_runnable = is_file and (file_types.is_runnable_code(file_to_load_rel_path) or (
+                not os.path.splitext(file_to_load_rel_path)[1]
+                and file_types.classify(os.path.basename(file_to_load_rel_path), abs_path=absolute_file_path) == "代码文件"))
+            if is_file and not is_runnable:
+                flash(f"文件 '{os.path.basename(file_to_load_rel_path)}' 不是可运行的代码文件。", "warning")
+                code_content = f"# 不支持运行的文件类型: {file_to_load_rel_path}"
+            elif is_file:
                 try:
                     with open(absolute_file_path, 'r', encoding='utf-8') as f:
                         code_content = f.read()
                     flash(f"已加载文件: {os.path.basename(file_to_load_rel_path)}", "info")
                     _, ext = os.path.splitext(file_to_load_rel_path)
-                    if ext == '.py':
+                    if ext == '.py' or (not ext and 'python' in code_content.split('\n', 1)[0]):
                         language = 'python'
                     elif ext in ['.c', '.cpp']:
                         language = 'cpp'
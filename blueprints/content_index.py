@@ -0,0 +1,552 @@
+# /home/pi/my_cloud_app/blueprints/content_index.py
+"""
+文本/代码文件的全文检索（倒排索引，SQLite，位于 DATA_DIR 下，与元数据索引分开存放）。
+
+- 建索引的范围就是 files.is_file_previewable_as_text 认为可以按文本预览的文件。
+- 分词：ASCII 字母数字按单词切分（小写，至少 2 个字符）；中日文连续字符切成相邻两字(bigram)，
+  建索引时另外记录每个单字，这样只有一个字的查询（如“猫”）也能匹配到它出现在词中间的文件。
+- 每个文件一行 docs，记录建索引时的 (inode, mtime_ns, size)；三者都没变的文件不会再读。
+  文件被改名/移动时，按相同的 (inode, mtime_ns, size) 找到旧记录直接改路径，也不用重读。
+- 倒排记录里另存每个词最先出现的几行 (行号:行首字节偏移)。搜索结果的匹配行按偏移直接 seek 读取那几行，
+  不再把整个文件读一遍；文件在建索引之后被改过时不显示匹配行，等后台线程重建。
+- 文档被删除或重建后不再被任何文档引用的检索词随之从 terms 删除，定期全量同步时再整体清理一次。
+- 只在元数据索引的维护进程里运行一个后台线程：线程以 SCHED_IDLE(或 nice 19) 调度，
+  并按 CONTENT_INDEX_CPU_SHARE 在每个文件之后主动休眠，不会把树莓派的 CPU 占满；
+  单个文件最多读取 CONTENT_INDEX_MAX_FILE_BYTES，逐批提交，内存占用有上限。
+"""
+import math
+import os
+import queue
+import re
+import sqlite3
+import stat
+import threading
+import time
+from collections import Counter
+
+from flask import current_app
+
+from . import fs_watcher
+from .metadata_index import get_metadata_index, is_index_maintainer, split_storage_path, user_home_abs, \
+    wait_for_reconciliation
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    rel_path TEXT NOT NULL,
+    inode INTEGER,
+    mtime_ns INTEGER,
+    size INTEGER,
+    encoding TEXT,
+    token_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_docs_owner_path ON docs(owner, rel_path);
+CREATE INDEX IF NOT EXISTS idx_docs_owner_inode ON docs(owner, inode);
+CREATE TABLE IF NOT EXISTS terms (
+    id INTEGER PRIMARY KEY,
+    term TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term_id INTEGER NOT NULL,
+    doc_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    positions TEXT,
+    PRIMARY KEY (term_id, doc_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings(doc_id);
+CREATE TRIGGER IF NOT EXISTS docs_delete_postings AFTER DELETE ON docs BEGIN
+    DELETE FROM postings WHERE doc_id = old.id;
+END;
+"""
+
+# ASCII 单词，或一段连续的中日文字符(含假名)
+_TOKEN_RE = re.compile(r'[0-9a-z_]{2,40}|[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]+')
+_BINARY_PROBE_BYTES = 8192
+_TERM_CACHE_MAX = 100000
+_COMMIT_EVERY_FILES = 50
+_POSITIONS_PER_TERM = 3  # 每个词记录最先出现的几行，够搜索结果显示匹配行用
+_SNIPPET_READ_BYTES = 8192  # 显示匹配行时每行最多读取的字节数
+_SCHEMA_VERSION = 2  # PRAGMA user_version；分词方式变化时加一，旧索引清空重建
+
+
+def tokenize(text, unigrams=False):
+    """
+    逐个生成 text 中的检索词。unigrams=True（建索引时）额外生成中日文连续字符中的每个单字；
+    查询时不需要：多字的查询用 bigram 就能定位，单字的查询本身就是一个单字词。
+    """
+    for match in _TOKEN_RE.finditer(text.lower()):
+        token = match.group()
+        if token[0] < '\u3040':
+            yield token
+        elif len(token) == 1:
+            yield token
+        else:
+            for i in range(len(token) - 1):
+                yield token[i:i + 2]
+            if unigrams:
+                yield from token
+
+
+def read_text_lines(abs_path, max_bytes):
+    """
+    读取文件开头最多 max_bytes 字节，返回 (编码, [(行号, 行首字节偏移, 行文本)])；看起来是二进制文件时返回 None。
+    按 b'\\n' 切行：UTF-8 和 GB18030 的多字节字符中都不会出现 0x0A，所以偏移可以直接用来 seek。
+    """
+    with open(abs_path, 'rb') as f:
+        data = f.read(max_bytes)
+        try:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)  # 建索引不应把页缓存挤占掉
+        except (AttributeError, OSError):
+            pass
+    if b'\x00' in data[:_BINARY_PROBE_BYTES]:
+        return None
+    encoding = 'utf-8'
+    for candidate in ('utf-8', 'gb18030'):
+        try:
+            data.decode(candidate)
+        except UnicodeDecodeError:
+            continue
+        encoding = candidate
+        break
+    lines = []
+    offset = 0
+    for line_no, raw in enumerate(data.split(b'\n'), 1):
+        lines.append((line_no, offset, raw.decode(encoding, errors='replace')))
+        offset += len(raw) + 1
+    return encoding, lines
+
+
+def _default_is_text(name):
+    from .files import is_file_previewable_as_text  # 延迟导入，避免与 files.py 循环导入
+    return is_file_previewable_as_text(name)
+
+
+class ContentIndex:
+    def __init__(self, db_path, logger, max_file_bytes=4 * 1024 * 1024):
+        self.db_path = db_path
+        self.logger = logger
+        self.max_file_bytes = max_file_bytes
+        self._local = threading.local()
+        self._term_ids = {}  # 只在写线程中使用的 term -> id 缓存
+        with self._connect() as conn:
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(docs)")}
+            if columns and conn.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+                # 旧版本建的库没有匹配行的位置或中文单字：全文索引是可以重建的派生数据，清空后由首次同步重建
+                conn.execute("DROP TRIGGER IF EXISTS docs_delete_postings")
+                for table in ('postings', 'terms', 'docs'):
+                    conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.executescript(SCHEMA)
+            conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # --- 写入 ---
+
+    def _term_id(self, conn, term):
+        term_id = self._term_ids.get(term)
+        if term_id is None:
+            conn.execute("INSERT OR IGNORE INTO terms (term) VALUES (?)", (term,))
+            term_id = conn.execute("SELECT id FROM terms WHERE term=?", (term,)).fetchone()[0]
+            if len(self._term_ids) >= _TERM_CACHE_MAX:
+                self._term_ids.clear()
+            self._term_ids[term] = term_id
+        return term_id
+
+    def _delete_orphan_terms(self, conn, term_ids):
+        """
+        删除 term_ids 中已经没有任何倒排记录的检索词（引用它们的文档刚被删除或重建）。
+        先查出再按 id 删除：DELETE ... RETURNING 要求 SQLite 3.35，Raspberry Pi OS Bullseye 自带的是 3.34。
+        写入只在一个线程里进行，查询和删除之间不会有新的倒排记录引用这些词。
+        """
+        for i in range(0, len(term_ids), 500):
+            chunk = term_ids[i:i + 500]
+            orphans = conn.execute(
+                f"SELECT id, term FROM terms WHERE id IN ({','.join('?' * len(chunk))}) "
+                f"AND NOT EXISTS (SELECT 1 FROM postings WHERE term_id = terms.id)", chunk).fetchall()
+            if not orphans:
+                continue
+            conn.execute(f"DELETE FROM terms WHERE id IN ({','.join('?' * len(orphans))})", [row['id'] for row in orphans])
+            for row in orphans:
+                self._term_ids.pop(row['term'], None)
+
+    def collect_orphan_terms(self, conn):
+        """整体清理没有倒排记录的检索词，返回删除的个数。调用方负责提交事务。"""
+        removed = conn.execute("DELETE FROM terms WHERE NOT EXISTS (SELECT 1 FROM postings WHERE term_id = terms.id)").rowcount
+        if removed:
+            self._term_ids.clear()
+        return removed
+
+    def _find_moved_doc(self, conn, owner, home_abs, item_stat):
+        """按 (inode, mtime_ns, size) 找一条路径已失效的旧记录：文件只是被改名/移动了。"""
+        for row in conn.execute("SELECT id, rel_path FROM docs WHERE owner=? AND inode=? AND mtime_ns=? AND size=?",
+                                (owner, item_stat.st_ino, item_stat.st_mtime_ns, item_stat.st_size)):
+            try:
+                if os.lstat(os.path.join(home_abs, row['rel_path'])).st_ino == item_stat.st_ino:
+                    continue  # 硬链接：旧路径仍然有效
+            except OSError:
+                pass
+            return row['id']
+        return None
+
+    def index_file(self, conn, owner, home_abs, rel_path, item_stat):
+        """
+        确保 rel_path 的索引与磁盘一致。返回 'unchanged' / 'moved' / 'indexed'。
+        调用方负责提交事务。
+        """
+        row = conn.execute("SELECT id, inode, mtime_ns, size FROM docs WHERE owner=? AND rel_path=?",
+                           (owner, rel_path)).fetchone()
+        if row is not None and (row['inode'], row['mtime_ns'], row['size']) == \
+                (item_stat.st_ino, item_stat.st_mtime_ns, item_stat.st_size):
+            return 'unchanged'
+        if row is None:
+            moved_id = self._find_moved_doc(conn, owner, home_abs, item_stat)
+            if moved_id is not None:
+                conn.execute("UPDATE docs SET rel_path=? WHERE id=?", (rel_path, moved_id))
+                return 'moved'
+
+        try:
+            text = read_text_lines(os.path.join(home_abs, rel_path), self.max_file_bytes)
+        except OSError as e:
+            self.logger.warning(f"ContentIndex: cannot read {owner}/{rel_path}: {e}")
+            return 'unchanged'
+        encoding, lines = text or (None, ())
+        counts = Counter()
+        positions = {}  # term -> 最先出现的几行 [(行号, 行首偏移)]
+        for line_no, offset, line in lines:
+            for term in tokenize(line, unigrams=True):
+                counts[term] += 1
+                found = positions.setdefault(term, [])
+                if len(found) < _POSITIONS_PER_TERM and (not found or found[-1][0] != line_no):
+                    found.append((line_no, offset))
+
+        old_term_ids = []
+        if row is not None:
+            old_term_ids = [r[0] for r in conn.execute("SELECT term_id FROM postings WHERE doc_id=?", (row['id'],))]
+            conn.execute("DELETE FROM docs WHERE id=?", (row['id'],))  # 触发器同时删除旧的倒排记录
+        doc_id = conn.execute(
+            "INSERT INTO docs (owner, rel_path, inode, mtime_ns, size, encoding, token_count) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (owner, rel_path, item_stat.st_ino, item_stat.st_mtime_ns, item_stat.st_size, encoding,
+             sum(counts.values()))).lastrowid
+        conn.executemany("INSERT INTO postings (term_id, doc_id, tf, positions) VALUES (?, ?, ?, ?)",
+                         [(self._term_id(conn, term), doc_id, tf, ','.join(f"{line_no}:{offset}" for line_no, offset in positions[term]))
+                          for term, tf in counts.items()])
+        self._delete_orphan_terms(conn, old_term_ids)  # 新内容里仍有的词已重新被引用，不会被删
+        return 'indexed'
+
+    def remove_path(self, conn, owner, rel_path):
+        """删除 rel_path 本身以及（若它是目录）其下所有文件的索引，返回删除的记录数。"""
+        where = "owner=? AND (rel_path=? OR (rel_path>=? AND rel_path<?))"
+        params = (owner, rel_path, rel_path + '/', rel_path + '0')
+        term_ids = [row[0] for row in conn.execute(
+            f"SELECT DISTINCT term_id FROM postings WHERE doc_id IN (SELECT id FROM docs WHERE {where})", params)]
+        removed = conn.execute(f"DELETE FROM docs WHERE {where}", params).rowcount
+        self._delete_orphan_terms(conn, term_ids)
+        return removed
+
+    # --- 查询 ---
+
+    def search(self, owner, query, limit=20, is_hidden=None, max_candidates=50000, snippets_per_file=3):
+        """
+        所有检索词都出现的文件按 BM25 排序，返回 (结果列表, 统计信息)。
+        结果带有按建索引时记录的位置从文件中读出的匹配行（每个结果只读那几行）。
+        """
+        started_at = time.monotonic()
+        stats = {'candidates': 0, 'truncated': False}
+        conn = self._connect()
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return [], stats
+
+        # BM25 的 N、平均文档长度和 df 都只统计该用户自己的文档，与候选集属于同一个语料
+        term_rows = []
+        for term in terms:
+            row = conn.execute("SELECT id FROM terms WHERE term=?", (term,)).fetchone()
+            if row is None:
+                return [], stats  # 有一个词从未出现过
+            df = conn.execute("SELECT COUNT(*) FROM postings p JOIN docs d ON d.id = p.doc_id WHERE p.term_id=? AND d.owner=?",
+                              (row['id'], owner)).fetchone()[0]
+            if not df:
+                return [], stats  # 该用户的文件里没有这个词
+            term_rows.append((df, row['id']))
+        term_rows.sort()
+
+        total_docs, avg_len = conn.execute("SELECT COUNT(*), AVG(token_count) FROM docs WHERE owner=? AND token_count > 0",
+                                           (owner,)).fetchone()
+        total_docs, avg_len = total_docs or 1, avg_len or 1.0
+
+        # 从最稀有的词出发得到候选，再逐个词求交集
+        rarest_df, rarest_id = term_rows[0]
+        rows = conn.execute(
+            "SELECT p.doc_id, p.tf, p.positions, d.rel_path, d.token_count, d.size, d.mtime_ns, d.inode, d.encoding FROM postings p "
+            "JOIN docs d ON d.id = p.doc_id WHERE p.term_id=? AND d.owner=? LIMIT ?",
+            (rarest_id, owner, max_candidates + 1)).fetchall()
+        if len(rows) > max_candidates:
+            stats['truncated'] = True
+            rows = rows[:max_candidates]
+        stats['candidates'] = len(rows)
+        docs = {row['doc_id']: row for row in rows}
+        tfs = {doc_id: [row['tf']] for doc_id, row in docs.items()}
+        positions = {doc_id: [row['positions']] for doc_id, row in docs.items()}
+        for _, term_id in term_rows[1:]:
+            found = {}
+            doc_ids = list(tfs)
+            for i in range(0, len(doc_ids), 500):
+                chunk = doc_ids[i:i + 500]
+                found.update((row['doc_id'], row) for row in conn.execute(
+                    f"SELECT doc_id, tf, positions FROM postings WHERE term_id=? AND doc_id IN ({','.join('?' * len(chunk))})",
+                    (term_id, *chunk)))
+            tfs = {doc_id: tf_list + [found[doc_id]['tf']] for doc_id, tf_list in tfs.items() if doc_id in found}
+            for doc_id in tfs:
+                positions[doc_id].append(found[doc_id]['positions'])
+            if not tfs:
+                break
+
+        k1, b = 1.2, 0.75
+        idfs = [math.log(1 + (total_docs - df + 0.5) / (df + 0.5)) for df, _ in term_rows]
+        scored = []
+        for doc_id, tf_list in tfs.items():
+            doc = docs[doc_id]
+            if is_hidden and is_hidden(doc['rel_path']):
+                continue
+            norm = k1 * (1 - b + b * doc['token_count'] / avg_len)
+            score = sum(idf * tf * (k1 + 1) / (tf + norm) for idf, tf in zip(idfs, tf_list))
+            scored.append((score, doc))
+        scored.sort(key=lambda pair: (-pair[0], pair[1]['rel_path']))
+
+        home_abs = user_home_abs(owner)
+        results = []
+        for score, doc in scored[:limit]:
+            results.append({
+                'owner': owner,
+                'rel_path': doc['rel_path'],
+                'name': doc['rel_path'].rsplit('/', 1)[-1],
+                'size': doc['size'],
+                'mtime_ns': doc['mtime_ns'],
+                'score': round(score, 3),
+                'snippets': self._snippets(os.path.join(home_abs, doc['rel_path']), doc, positions[doc['doc_id']],
+                                           query, snippets_per_file),
+            })
+        stats['took_ms'] = round((time.monotonic() - started_at) * 1000, 1)
+        return results, stats
+
+    def _snippets(self, abs_path, doc, position_lists, query, max_snippets, width=160):
+        """按倒排记录中的 (行号, 偏移) 只读取最先匹配的几行；文件已不是建索引时的版本则不显示。"""
+        lines = sorted({tuple(map(int, pair.split(':'))) for positions in position_lists if positions
+                        for pair in positions.split(',')})[:max_snippets]
+        if not lines:
+            return []
+        needles = [m.group() for m in _TOKEN_RE.finditer(query.lower())] + list(tokenize(query))
+        snippets = []
+        try:
+            with open(abs_path, 'rb') as f:
+                file_stat = os.fstat(f.fileno())
+                if (file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size) != (doc['inode'], doc['mtime_ns'], doc['size']):
+                    return []
+                for line_no, offset in lines:
+                    f.seek(offset)
+                    line = f.read(_SNIPPET_READ_BYTES).split(b'\n', 1)[0].decode(doc['encoding'] or 'utf-8', errors='replace')
+                    lowered = line.lower()
+                    found = [lowered.find(needle) for needle in needles if needle in lowered]
+                    start = max(0, min(found) - width // 4) if found else 0
+                    snippets.append({'line': line_no, 'text': ('…' if start else '') + line[start:start + width].strip()})
+        except OSError:
+            return []
+        return snippets
+
+
+_content_index = None
+_content_index_lock = threading.Lock()
+
+
+def get_content_index():
+    """返回本进程的 ContentIndex（按 app.config 中的 CONTENT_INDEX_PATH 打开）。"""
+    global _content_index
+    if _content_index is None:
+        with _content_index_lock:
+            if _content_index is None:
+                _content_index = ContentIndex(
+                    current_app.config['CONTENT_INDEX_PATH'], current_app.logger,
+                    max_file_bytes=current_app.config.get('CONTENT_INDEX_MAX_FILE_BYTES', 4 * 1024 * 1024))
+    return _content_index
+
+
+# --- 后台建索引 ---
+
+def _lower_thread_priority():
+    """把当前线程(Linux 下是一个独立调度实体)降到最低优先级，不影响同进程的请求线程。"""
+    tid = threading.get_native_id()
+    try:
+        os.sched_setscheduler(tid, os.SCHED_IDLE, os.sched_param(0))
+        return
+    except (AttributeError, OSError):
+        pass
+    try:
+        os.setpriority(os.PRIO_PROCESS, tid, 19)
+    except (AttributeError, OSError):
+        pass
+
+
+class _ContentIndexer:
+    """在元数据索引的维护进程中运行：首次/定期与元数据索引做合并比对，平时只处理 fs_watcher 报告的路径。"""
+
+    def __init__(self, app):
+        self.app = app
+        self.pid = os.getpid()
+        self.events = queue.Queue()
+        self.cpu_share = min(1.0, max(0.05, app.config.get('CONTENT_INDEX_CPU_SHARE', 0.25)))
+        self.thread = threading.Thread(target=self._run, name='content-index', daemon=True)
+        self._pending_commit = 0
+
+    def on_fs_changes(self, events):
+        self.events.put(events)
+
+    def _throttle(self, cpu_started_at):
+        """按本线程刚消耗的 CPU 时间休眠，使长期占用不超过 cpu_share。"""
+        busy = time.thread_time() - cpu_started_at
+        if busy > 0:
+            time.sleep(busy * (1 - self.cpu_share) / self.cpu_share)
+
+    def _commit(self, conn, force=False):
+        self._pending_commit += 1
+        if force or self._pending_commit >= _COMMIT_EVERY_FILES:
+            conn.commit()
+            self._pending_commit = 0
+
+    def _sync_file(self, index, conn, owner, rel_path, stats):
+        home_abs = user_home_abs(owner)
+        cpu_started_at = time.thread_time()
+        try:
+            item_stat = os.stat(os.path.join(home_abs, rel_path))
+        except OSError:
+            item_stat = None
+        if item_stat is None or not stat.S_ISREG(item_stat.st_mode) or not _default_is_text(rel_path.rsplit('/', 1)[-1]):
+            if index.remove_path(conn, owner, rel_path):
+                stats['removed'] += 1
+                self._commit(conn)
+            return
+        outcome = index.index_file(conn, owner, home_abs, rel_path, item_stat)
+        stats[outcome] += 1
+        if outcome != 'unchanged':
+            self._commit(conn)
+            self._throttle(cpu_started_at)
+
+    def _full_sync(self):
+        """
+        按 rel_path 顺序分块合并比对元数据索引(entries)和 docs：
+        元数据里有、docs 里没有或已过期的文件重建索引，docs 里多出来的删除。内存只与块大小有关。
+        """
+        index = get_content_index()
+        meta = get_metadata_index()
+        conn = index._connect()
+        started_at = time.monotonic()
+        for owner in self.app.config.get('USERS_DB', {}):
+            stats = Counter()
+            last = ''
+            while last is not None:
+                rows = meta.query("SELECT rel_path, name FROM entries WHERE owner=? AND is_dir=0 AND rel_path>? "
+                                  "ORDER BY rel_path LIMIT 1000", (owner, last))
+                upper = rows[-1]['rel_path'] if rows else None  # 最后一块一直比对到 docs 的末尾
+                if upper is None:
+                    stale = conn.execute("SELECT rel_path FROM docs WHERE owner=? AND rel_path>?", (owner, last)).fetchall()
+                else:
+                    stale = conn.execute("SELECT rel_path FROM docs WHERE owner=? AND rel_path>? AND rel_path<=?",
+                                         (owner, last, upper)).fetchall()
+                stale = {row['rel_path'] for row in stale}
+                for row in rows:
+                    stale.discard(row['rel_path'])
+                    if _default_is_text(row['name']):
+                        self._sync_file(index, conn, owner, row['rel_path'], stats)
+                for rel_path in stale:  # 元数据索引里已经没有的文件
+                    self._sync_file(index, conn, owner, rel_path, stats)
+                last = upper
+            conn.commit()
+            self.app.logger.info(f"ContentIndex: synced '{owner}': {dict(stats)}")
+        orphans = index.collect_orphan_terms(conn)
+        conn.commit()
+        if orphans:
+            self.app.logger.info(f"ContentIndex: removed {orphans} orphaned terms.")
+        self.app.logger.info(f"ContentIndex: full sync finished in {time.monotonic() - started_at:.1f}s.")
+
+    def _apply(self, events):
+        index = get_content_index()
+        conn = index._connect()
+        stats = Counter()
+        present, missing = [], []
+        for event in events:
+            if event.kind == 'overflow':
+                self._full_sync()
+                return
+            located = split_storage_path(event.path)
+            if located is None:
+                continue
+            if event.is_dir and event.kind in ('moved_to', 'rescan'):
+                owner, rel_path = located
+                for root, _, names in os.walk(event.path):
+                    for name in names:
+                        present.append((owner, os.path.relpath(os.path.join(root, name), user_home_abs(owner)).replace("\\", "/")))
+                missing.append(located)  # 子树中已不存在的旧记录
+            elif event.is_dir and event.kind in ('deleted', 'moved_from'):
+                missing.append(located)
+            elif not event.is_dir:
+                (missing if event.kind in ('deleted', 'moved_from') else present).append(located)
+        # 先处理仍存在的路径，这样改名可以直接沿用旧记录
+        for owner, rel_path in dict.fromkeys(present):
+            self._sync_file(index, conn, owner, rel_path, stats)
+        for owner, rel_path in dict.fromkeys(missing):
+            subtree = conn.execute("SELECT rel_path FROM docs WHERE owner=? AND (rel_path=? OR (rel_path>=? AND rel_path<?))",
+                                   (owner, rel_path, rel_path + '/', rel_path + '0')).fetchall()
+            for row in subtree:
+                self._sync_file(index, conn, owner, row['rel_path'], stats)
+        conn.commit()
+
+    def _run(self):
+        _lower_thread_priority()
+        interval = self.app.config.get('CONTENT_INDEX_SYNC_INTERVAL', 6 * 3600)
+        with self.app.app_context():
+            wait_for_reconciliation()
+            try:
+                self._full_sync()
+            except Exception as e:
+                self.app.logger.error(f"ContentIndex: initial sync failed: {e}", exc_info=True)
+            next_sync = time.monotonic() + interval
+            while True:
+                timeout = max(1.0, next_sync - time.monotonic())
+                try:
+                    events = self.events.get(timeout=timeout)
+                except queue.Empty:
+                    events = None
+                try:
+                    if events is not None:
+                        self._apply(events)
+                    if time.monotonic() >= next_sync:
+                        self._full_sync()
+                        next_sync = time.monotonic() + interval
+                except Exception as e:
+                    self.app.logger.error(f"ContentIndex: indexing error: {e}", exc_info=True)
+
+
+_indexer = None
+
+
+def ensure_content_indexer(app):
+    """每个请求前调用：只在元数据索引的维护进程里启动一次全文索引线程。"""
+    global _indexer
+    if not app.config.get('CONTENT_INDEX_ENABLED', True) or not is_index_maintainer():
+        return
+    if _indexer is not None and _indexer.pid == os.getpid():
+        return
+    indexer = _ContentIndexer(app)
+    fs_watcher.subscribe(indexer.on_fs_changes)
+    indexer.thread.start()
+    _indexer = indexer
+    app.logger.info(f"ContentIndex: indexer thread started in process {indexer.pid}.")
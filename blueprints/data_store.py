@@ -0,0 +1,206 @@
+# /home/pi/my_cloud_app/blueprints/data_store.py
+"""
+DATA_DIR 下数据文件的统一读写层。
+
+- atomic_write: 写同目录下的临时文件、fsync、rename 替换、再 fsync 目录。崩溃时目标文件要么是旧内容要么是新内容，
+  不会出现写了一半或被截断的文件；读者不需要加锁。
+- JsonStore.transaction: 在 fcntl 文件锁 (<文件名>.lock) 内读出 JSON、由调用方修改、原子写回，
+  多个 gunicorn worker 同时修改不会丢失更新。每次提交把顶层的 "_version" 计数器加一；
+  generation() 是文件的 (inode, mtime_ns, size)，rename 必然改变 inode，一次 stat 即可判断缓存是否过期。
+- GroupCommitter: 组提交。同一进程内并发到达的多次小修改合并成一次加锁 + 一次写入 (+ 一次 fsync)：
+  第一个到达的线程成为 leader，等待 DATA_STORE_GROUP_COMMIT_MS 毫秒 (0 表示不等待，只合并
+  leader 提交期间排队的请求) 后把队列中的修改一起提交，其余线程等待结果。分享库 (share_store) 和
+  JsonStore.update 都通过它提交。
+"""
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app
+
+
+VERSION_KEY = '_version'  # JsonStore 在顶层维护的提交计数器；值不是列表/字典，读者可直接忽略
+
+
+def _fsync_dir(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass  # 部分文件系统不支持对目录 fsync
+    finally:
+        os.close(fd)
+
+
+def data_file_version(path):
+    """
+    数据文件(JSON 库)的版本号：以 st_ino、st_mtime_ns 和大小近似；文件不存在时为 0。
+    写临时文件再 rename 替换时 inode 必然改变，同一时钟刻度内的两次写入也能区分开。
+    """
+    if not path:
+        return 0
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 0
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def atomic_write(path, write, binary=False):
+    """
+    用 write(f) 生成 path 的新内容：临时文件 + fsync + rename，最后 fsync 目录使 rename 本身落盘。
+    失败时删除临时文件并抛出异常，原文件保持不变。
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb' if binary else 'w', **({} if binary else {'encoding': 'utf-8'})) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_dir(directory)
+
+
+def atomic_write_json(path, data):
+    atomic_write(path, lambda f: json.dump(data, f, ensure_ascii=False, separators=(',', ':')))
+
+
+def read_json(path, default=None):
+    """读取 JSON 文件；不存在、为空或格式错误时返回 default (None 时为 {})。"""
+    default = {} if default is None else default
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        return json.loads(content) if content.strip() else default
+    except FileNotFoundError:
+        return default
+    except (OSError, ValueError) as e:
+        current_app.logger.error(f"Failed to load data file {path}: {e}")
+        return default
+
+
+@contextmanager
+def file_lock(path):
+    """<path>.lock 上的 fcntl 排他锁；同一进程的不同线程之间也互斥（每次打开新的文件描述）。"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+class _PendingOp:
+    __slots__ = ('op', 'done', 'result', 'error')
+
+    def __init__(self, op):
+        self.op = op
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class GroupCommitter:
+    """
+    把并发提交的操作合并成批。commit_batch(ops) 在一次提交中依次执行这些操作，
+    返回与 ops 一一对应的 (结果, 异常或 None)；commit_batch 本身抛出异常时整批都以该异常失败。
+    """
+
+    def __init__(self, commit_batch, window_seconds=0.0):
+        self._commit_batch = commit_batch
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._pending = []
+        self._leader_active = False
+
+    def submit(self, op):
+        pending = _PendingOp(op)
+        with self._lock:
+            self._pending.append(pending)
+            is_leader = not self._leader_active
+            self._leader_active = True
+        if not is_leader:
+            pending.done.wait()
+        else:
+            if self.window_seconds > 0:
+                time.sleep(self.window_seconds)
+            self._drain()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                if not batch:
+                    self._leader_active = False
+                    return
+            try:
+                outcomes = self._commit_batch([pending.op for pending in batch])
+            except BaseException as e:
+                outcomes = [(None, e)] * len(batch)
+            for pending, (result, error) in zip(batch, outcomes):
+                pending.result, pending.error = result, error
+                pending.done.set()
+
+
+class JsonStore:
+    """DATA_DIR 下的一个 JSON 字典文件。"""
+
+    def __init__(self, path, on_commit=None, group_commit_seconds=0.0):
+        self.path = path
+        self.on_commit = on_commit
+        self._committer = GroupCommitter(self._commit_batch, group_commit_seconds)
+
+    def read(self):
+        data = read_json(self.path)
+        return data if isinstance(data, dict) else {}
+
+    def generation(self):
+        return data_file_version(self.path)
+
+    @contextmanager
+    def transaction(self):
+        """
+        加锁读出当前内容交给调用方修改，正常退出时原子写回并把 _version 加一。
+        构造时给出的 on_commit(data) 在写回之后、释放锁之前调用（例如发布派生的快照）。with 块内抛出异常时不写入。
+        """
+        with file_lock(self.path):
+            data = self.read()
+            yield data
+            counter = data.get(VERSION_KEY, 0)
+            data[VERSION_KEY] = (counter if isinstance(counter, int) else 0) + 1
+            atomic_write_json(self.path, data)
+            if self.on_commit is not None:
+                self.on_commit(data)
+
+    def update(self, mutate):
+        """
+        以组提交方式执行 mutate(data)，返回其结果。并发的多次 update 合并成一次加锁和写入；
+        mutate 应先校验再修改，抛出异常时只有它自己失败，同批的其他修改照常提交。
+        """
+        return self._committer.submit(mutate)
+
+    def _commit_batch(self, ops):
+        outcomes = []
+        with self.transaction() as data:
+            for mutate in ops:
+                try:
+                    outcomes.append((mutate(data), None))
+                except Exception as e:
+                    outcomes.append((None, e))
+        return outcomes
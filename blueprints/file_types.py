@@ -0,0 +1,205 @@
+# /home/pi/my_cloud_app/blueprints/file_types.py
+"""
+文件类型分类。
+
+启动时根据 config 一次性编译出只读的 扩展名 -> 类型显示名 表（包括从 mimetypes 推导的兜底项），
+之后 files.get_display_file_type / is_file_previewable_as_* / is_code_file_for_runner
+都只是查表，不再每次拼接扩展名列表或调用 mimetypes.guess_type。
+
+没有扩展名的文件可选地读取文件头(magic bytes)识别，结果按 (inode, size, mtime_ns) 缓存，
+文件不变就不会再读第二次。
+"""
+import codecs
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+
+from flask import current_app
+
+
+# 类型显示名 -> API 过滤用的类别标识
+DISPLAY_TYPE_CATEGORIES = {
+    "文件夹": "folder", "图片": "image", "视频": "video", "音频": "audio", "PDF文档": "pdf",
+    "压缩包": "archive", "文本文件": "text", "文本/代码": "text", "代码文件": "code", "Office文档": "office",
+}
+
+_IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp', '.svg', '.tiff', '.tif')
+_VIDEO_EXTS = ('.mp4', '.mov', '.avi', '.mkv', '.webm', '.flv', '.wmv')
+_AUDIO_EXTS = ('.mp3', '.wav', '.ogg', '.flac', '.aac', '.m4a')
+_ARCHIVE_EXTS = ('.zip', '.rar', '.tar', '.gz', '.7z', '.bz2')
+_TEXT_EXTS = ('.txt', '.md', '.log', '.csv', '.json', '.xml', '.yaml', '.yml', '.ini', '.conf', '.cfg', '.srt', '.vtt')
+_CODE_EXTS = ('.html', '.css', '.js', '.py', '.c', '.cpp', '.h', '.hpp', '.java', '.sh', '.rb', '.php', '.pl', '.bat',
+              '.cs', '.go', '.rs', '.swift', '.kt')
+_OFFICE_EXTS = ('.doc', '.docx', '.rtf', '.odt', '.xls', '.xlsx', '.ods', '.csv', '.ppt', '.pptx', '.odp')
+
+# 可以在浏览器中预览的扩展名（代码部分比 _CODE_EXTS 少几种，与原有预览行为保持一致）
+_IMAGE_PREVIEW_EXTS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp', '.svg')
+_CODE_PREVIEW_EXTS = ('.html', '.css', '.js', '.py', '.c', '.cpp', '.h', '.hpp', '.java', '.sh', '.rb', '.php', '.pl',
+                      '.cs', '.go', '.rs')
+_DEFAULT_RUNNER_EXTS = ('.py', '.js', '.sh', '.c', '.cpp', '.java')
+
+_TEXT_DISPLAY_TYPES = ("文本文件", "代码文件", "文本/代码")
+
+# (偏移, 文件头, 类型显示名)。按顺序匹配，第一个命中的生效。
+_MAGIC_SIGNATURES = (
+    (0, b'\x89PNG\r\n\x1a\n', "图片"),
+    (0, b'\xff\xd8\xff', "图片"),
+    (0, b'GIF87a', "图片"),
+    (0, b'GIF89a', "图片"),
+    (0, b'II*\x00', "图片"),
+    (0, b'MM\x00*', "图片"),
+    (0, b'%PDF-', "PDF文档"),
+    (0, b'PK\x03\x04', "压缩包"),
+    (0, b'Rar!\x1a\x07', "压缩包"),
+    (0, b"7z\xbc\xaf'\x1c", "压缩包"),
+    (0, b'\x1f\x8b', "压缩包"),
+    (0, b'BZh', "压缩包"),
+    (0, b'\xfd7zXZ\x00', "压缩包"),
+    (257, b'ustar', "压缩包"),
+    (0, b'ID3', "音频"),
+    (0, b'fLaC', "音频"),
+    (0, b'OggS', "音频"),
+    (0, b'\xff\xfb', "音频"),
+    (0, b'\xff\xf3', "音频"),
+    (0, b'\x1aE\xdf\xa3', "视频"),  # Matroska / WebM
+)
+_RIFF_FORMATS = {b'WEBP': "图片", b'WAVE': "音频", b'AVI ': "视频"}
+_SNIFF_BYTES = 512
+
+
+def _display_for_mime(mime_type):
+    """与原来 mimetypes 兜底逻辑相同的 MIME -> 显示名映射。"""
+    if mime_type.startswith('image/'): return "图片"
+    if mime_type.startswith('text/'): return "文本/代码"
+    if mime_type.startswith('video/'): return "视频"
+    if mime_type.startswith('audio/'): return "音频"
+    if mime_type == 'application/pdf': return "PDF文档"
+    if mime_type in ('application/zip', 'application/x-rar-compressed', 'application/x-7z-compressed',
+                     'application/gzip', 'application/x-tar'):
+        return "压缩包"
+    return None
+
+
+def sniff_bytes(head):
+    """根据文件开头的字节判断类型显示名；无法判断时返回 None。"""
+    for offset, signature, display in _MAGIC_SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            return display
+    if head[:4] == b'RIFF' and head[8:12] in _RIFF_FORMATS:
+        return _RIFF_FORMATS[head[8:12]]
+    if head[4:8] == b'ftyp':
+        return "音频" if head[8:12] in (b'M4A ', b'M4B ') else "视频"
+    if not head or b'\x00' in head:
+        return None
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)  # 末尾被截断的多字节字符不算错
+    except UnicodeDecodeError:
+        return None
+    return "代码文件" if head.startswith(b'#!') else "文本文件"
+
+
+class FileTypeTable:
+    """由 config 编译出的只读分类表，外加无扩展名文件的文件头识别缓存。"""
+
+    def __init__(self, config):
+        text_exts = list(config.get('TEXT_PREVIEW_EXTENSIONS', [])) + list(_TEXT_EXTS)
+        code_exts = list(config.get('CODE_EXECUTION_EXTENSIONS', [])) + list(_CODE_EXTS)
+        display_by_ext = {}
+        # 与原 if 链的优先级一致：先出现的类型优先（例如 .csv 属于文本而不是 Office）
+        for display, exts in (("图片", _IMAGE_EXTS), ("视频", _VIDEO_EXTS), ("音频", _AUDIO_EXTS),
+                              ("PDF文档", ('.pdf',)), ("压缩包", _ARCHIVE_EXTS), ("文本文件", text_exts),
+                              ("代码文件", code_exts), ("Office文档", _OFFICE_EXTS)):
+            for ext in exts:
+                display_by_ext.setdefault(ext.lower(), display)
+        self.display_by_ext = MappingProxyType(display_by_ext)
+        if not mimetypes.inited:
+            mimetypes.init()  # 读取系统的 /etc/mime.types，与 guess_type 使用同一份映射
+        mime_display_by_ext = {}
+        for ext in {ext.lower() for ext in (*mimetypes.types_map, *mimetypes.suffix_map, *mimetypes.encodings_map)}:
+            mime_type, _ = mimetypes.guess_type('file' + ext)  # 经过 suffix_map，例如 .tgz -> .tar.gz
+            display = _display_for_mime(mime_type) if mime_type else None
+            if display and ext not in display_by_ext:
+                mime_display_by_ext[ext] = display
+        self.mime_display_by_ext = MappingProxyType(mime_display_by_ext)
+
+        self.text_preview_exts = frozenset(
+            ext.lower() for ext in text_exts + list(config.get('CODE_EXECUTION_EXTENSIONS', [])) + list(_CODE_PREVIEW_EXTS))
+        self.image_preview_exts = frozenset(_IMAGE_PREVIEW_EXTS)
+        self.runner_exts = frozenset(
+            ext.lower() for ext in config.get('CODE_EXECUTION_EXTENSIONS', _DEFAULT_RUNNER_EXTS))
+
+        self.sniff_enabled = config.get('FILE_TYPE_SNIFF_EXTENSIONLESS', True)
+        self.sniff_cache_size = config.get('FILE_TYPE_SNIFF_CACHE_SIZE', 20000)
+        self._sniff_cache = OrderedDict()  # (inode, size, mtime_ns) -> 显示名或 None
+        self._sniff_lock = threading.Lock()
+
+    def classify(self, name, is_dir=False, abs_path=None, inode=None, size=None, mtime_ns=None):
+        """
+        返回类型显示名。abs_path 为 None 表示文件已不存在，只按名称判断。
+        inode/size/mtime_ns 由 scandir 引擎给出时可省去文件头识别前的 stat。
+        """
+        if is_dir:
+            return "文件夹"
+        ext = os.path.splitext(name)[1].lower()
+        display = self.display_by_ext.get(ext)
+        if display:
+            return display
+        if abs_path:
+            display = self.mime_display_by_ext.get(ext) if ext else self._sniff(abs_path, inode, size, mtime_ns)
+            if display:
+                return display
+        return f"{ext[1:].upper()} 文件" if ext else "文件"
+
+    def _sniff(self, abs_path, inode, size, mtime_ns):
+        if not self.sniff_enabled:
+            return None
+        if inode is None or size is None or mtime_ns is None:
+            try:
+                st = os.stat(abs_path)
+            except OSError:
+                return None
+            inode, size, mtime_ns = st.st_ino, st.st_size, st.st_mtime_ns
+        key = (inode, size, mtime_ns)
+        with self._sniff_lock:
+            if key in self._sniff_cache:
+                self._sniff_cache.move_to_end(key)
+                return self._sniff_cache[key]
+        try:
+            with open(abs_path, 'rb') as f:
+                display = sniff_bytes(f.read(_SNIFF_BYTES))
+        except OSError as e:
+            current_app.logger.debug(f"Could not sniff file type of '{abs_path}': {e}")
+            return None  # 读取失败不缓存，下次再试
+        with self._sniff_lock:
+            self._sniff_cache[key] = display
+            while len(self._sniff_cache) > self.sniff_cache_size:
+                self._sniff_cache.popitem(last=False)
+        return display
+
+    def is_text_previewable(self, name, display=None):
+        """扩展名在文本预览列表中，或无扩展名但文件头识别为文本(需传入 classify 的结果)。"""
+        ext = os.path.splitext(name)[1].lower()
+        if ext:
+            return ext in self.text_preview_exts
+        return display in _TEXT_DISPLAY_TYPES
+
+    def is_image_previewable(self, name):
+        return os.path.splitext(name)[1].lower() in self.image_preview_exts
+
+    def is_runnable_code(self, name):
+        return os.path.splitext(name)[1].lower() in self.runner_exts
+
+
+def init_file_types(app):
+    """应用启动时编译分类表；修改相关配置后需要重启应用。"""
+    app.extensions['file_types'] = FileTypeTable(app.config)
+
+
+def get_file_types():
+    table = current_app.extensions.get('file_types')
+    if table is None:
+        init_file_types(current_app._get_current_object())
+        table = current_app.extensions['file_types']
+    return table
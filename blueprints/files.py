@@ -2,18 +2,33 @@
 
 from flask import (
     Blueprint, render_template, request, redirect, url_for, session,
-    send_from_directory, flash, current_app, g, send_file, jsonify
+    send_from_directory, flash, current_app, g, send_file, jsonify, Response, stream_with_context, make_response
 )
 from werkzeug.utils import secure_filename
+from flask_wtf.csrf import generate_csrf
 import os
+import stat
 import shutil
 # from PIL import Image, UnidentifiedImageError # 保留，以防未来用于生成缩略图等
-import mimetypes
-import json
+import hashlib
 import math
+import time
+import sqlite3
 from datetime import datetime
+from functools import lru_cache
 # from .utils import get_user_home_dir # 看起来你的 get_user_home_dir_abs 已经内联了
 from decorators import login_required, admin_required # 假设你的 decorators.py 在 my_cloud_app 包的根目录下
+from .listing import ScannedEntry, iter_directory, scan_directory, list_child_dirs, stat_path, stat_paths, sort_listing_items, paginate_view, LISTING_SORT_FIELDS
+from .listing_cache import files_generation, get_listing_cache
+from .metadata_index import get_metadata_index, note_path_changed, note_path_removed
+from .search import search_user_files, match_name
+from .content_index import get_content_index
+from .file_types import DISPLAY_TYPE_CATEGORIES, get_file_types
+from .quota import get_quota_status, is_over_quota, upload_exceeds_quota
+from .chunked_upload import UploadError, abort_upload, append_chunk, create_upload, finish_upload, get_upload, pending_upload_bytes
+from .hidden_index import get_hidden_index
+from .share_store import check_share_access, get_share_store
+from .state_snapshot import SLOT_SHARES, get_generation_counters
 
 files_bp = Blueprint('files', __name__, template_folder='../templates/files')
 
@@ -116,164 +131,290 @@ def get_human_readable_size(size_bytes):
     s = round(size_bytes / p, 2)
     return f"{s} {size_name[i]}"
 
-def get_display_file_type(item_abs_path, item_name): # item_abs_path might be None if file deleted
-    _, ext = os.path.splitext(item_name)
-    ext = ext.lower()
+def get_display_file_type(item_abs_path, item_name, is_dir=None): # item_abs_path might be None if file deleted
+    """类型显示名：查 file_types 中预先编译好的扩展名表；无扩展名的文件按文件头识别(结果有缓存)。"""
+    inode = size = mtime_ns = None
+    # is_dir 由调用方(scandir 引擎)给出时，说明条目确实存在，不再做额外的 stat
+    if is_dir is None and item_abs_path:
+        scanned = stat_path(item_abs_path)
+        if scanned is None:
+            item_abs_path = None
+        else:
+            is_dir, inode, size, mtime_ns = scanned.is_dir, scanned.inode, scanned.size, scanned.mtime_ns
+    return get_file_types().classify(item_name, is_dir=bool(is_dir), abs_path=item_abs_path,
+                                     inode=inode, size=size, mtime_ns=mtime_ns)
 
-    if item_abs_path and os.path.isdir(item_abs_path): return "文件夹"
 
-    # Prioritize specific known extensions for common web/cloud types
-    if ext in ['.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp', '.svg', '.tiff', '.tif']: return "图片"
-    if ext in ['.mp4', '.mov', '.avi', '.mkv', '.webm', '.flv', '.wmv']: return "视频"
-    if ext in ['.mp3', '.wav', '.ogg', '.flac', '.aac', '.m4a']: return "音频"
-    if ext == '.pdf': return "PDF文档"
-    if ext in ['.zip', '.rar', '.tar', '.gz', '.7z', '.bz2']: return "压缩包"
-    
-    text_like_exts = current_app.config.get('TEXT_PREVIEW_EXTENSIONS', []) + \
-                     ['.txt', '.md', '.log', '.csv', '.json', '.xml', '.yaml', '.yml', '.ini', '.conf', '.cfg', '.srt', '.vtt']
-    if ext in text_like_exts: return "文本文件"
+# type= 过滤参数允许的类别；其他值直接丢弃，列表缓存的视图键因此只有有限的几种
+LISTING_FILTER_CATEGORIES = frozenset(DISPLAY_TYPE_CATEGORIES.values()) | {"other"}
 
-    code_like_exts = current_app.config.get('CODE_EXECUTION_EXTENSIONS', []) + \
-                     ['.html', '.css', '.js', '.py', '.c', '.cpp', '.h', '.hpp', '.java', '.sh', '.rb', '.php', '.pl', '.bat', '.cs', '.go', '.rs', '.swift', '.kt']
-    if ext in code_like_exts: return "代码文件"
 
+def get_file_category(type_display):
+    return DISPLAY_TYPE_CATEGORIES.get(type_display, "other")
 
-    office_exts = ['.doc', '.docx', '.rtf', '.odt', 
-                   '.xls', '.xlsx', '.ods', '.csv', # csv also text
-                   '.ppt', '.pptx', '.odp']
-    if ext in office_exts: return "Office文档"
 
+def is_file_previewable_as_image(filename):
+    return get_file_types().is_image_previewable(filename)
 
-    # Fallback to MIME type if available and path exists
-    if item_abs_path and os.path.exists(item_abs_path):
-        mime_type, _ = mimetypes.guess_type(item_abs_path)
-        if mime_type:
-            if mime_type.startswith('image/'): return "图片"
-            if mime_type.startswith('text/'): return "文本/代码" # Generic for text/*
-            if mime_type.startswith('video/'): return "视频"
-            if mime_type.startswith('audio/'): return "音频"
-            if mime_type == 'application/pdf': return "PDF文档"
-            if mime_type in ['application/zip', 'application/x-rar-compressed', 'application/x-7z-compressed', 'application/gzip', 'application/x-tar']: return "压缩包"
+def is_file_previewable_as_text(filename, type_display=None):
+    # 没有扩展名的文件需要传入 get_display_file_type 的结果(文件头识别为文本时才允许预览)
+    return get_file_types().is_text_previewable(filename, type_display)
 
-    return f"{ext[1:].upper() if ext else '未知'} 文件" if ext else "文件"
+def is_code_file_for_runner(filename):
+    return get_file_types().is_runnable_code(filename)
 
 
-def is_file_previewable_as_image(filename):
-    ext = os.path.splitext(filename)[1].lower()
-    return ext in ['.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp', '.svg']
+def _format_mtime(mtime_ns):
+    if mtime_ns is None: return '-'
+    return datetime.fromtimestamp(mtime_ns / 1e9).strftime('%Y-%m-%d %H:%M')
 
-def is_file_previewable_as_text(filename):
-    ext = os.path.splitext(filename)[1].lower()
-    text_exts = current_app.config.get('TEXT_PREVIEW_EXTENSIONS', []) + \
-                ['.txt', '.md', '.log', '.csv', '.json', '.xml', '.yaml', '.yml', '.ini', '.conf', '.cfg', '.srt', '.vtt']
-    code_exts = current_app.config.get('CODE_EXECUTION_EXTENSIONS', []) + \
-                ['.html', '.css', '.js', '.py', '.c', '.cpp', '.h', '.hpp', '.java', '.sh', '.rb', '.php', '.pl', '.cs', '.go', '.rs'] # Add more as needed
-    return ext in text_exts + code_exts
 
-def is_code_file_for_runner(filename):
-    ext = os.path.splitext(filename)[1].lower()
-    # Ensure CODE_EXECUTION_EXTENSIONS is loaded from config, provide default if not
-    code_runner_exts = current_app.config.get('CODE_EXECUTION_EXTENSIONS', ['.py', '.js', '.sh', '.c', '.cpp', '.java']) # Example default
-    return ext in code_runner_exts
+def _build_listing_item(entry, item_rel_to_owner_home, owner_username, owner_shares_info, folder_total=None):
+    """由 scandir 引擎的 ScannedEntry 生成 home.html 需要的全部字段；除无扩展名文件首次识别文件头外不再产生系统调用。"""
+    is_dir = entry.is_dir
 
+    is_shared_by_me = False
+    shared_with_whom_list = []
+    if item_rel_to_owner_home in owner_shares_info:
+        is_shared_by_me = True
+        shared_with_whom_list = owner_shares_info[item_rel_to_owner_home].get('shared_with', [])
 
-def _load_hidden_files_db():
-    path = current_app.config.get('HIDDEN_FILES_PATH') # e.g., data/hidden_files.json
-    if path and os.path.exists(path):
-        try:
-            with open(path, 'r', encoding='utf-8') as f: return json.load(f) # Added encoding
-        except Exception as e: 
-            current_app.logger.error(f"Failed to load hidden files DB from {path}: {e}")
-    return {}
+    type_display = get_file_types().classify(entry.name, is_dir=is_dir, abs_path=entry.abs_path,
+                                             inode=entry.inode, size=entry.size, mtime_ns=entry.mtime_ns)
+    # 文件夹的大小取元数据索引中维护的子树汇总 (总大小, 文件数)；索引里还没有时仍显示 "-"
+    if is_dir:
+        size_bytes, file_count = folder_total if folder_total is not None else (None, None)
+    else:
+        size_bytes, file_count = entry.size, None
+    return {
+        'name': entry.name,
+        'path_for_url': item_rel_to_owner_home, 
+        'is_dir': is_dir,
+        'type_display': type_display,
+        'category': get_file_category(type_display),
+        'size_readable': get_human_readable_size(size_bytes) if size_bytes is not None else "-",
+        'file_count': file_count,
+        'last_modified': _format_mtime(entry.mtime_ns),
+        'is_image': is_file_previewable_as_image(entry.name) and not is_dir,
+        'is_text': is_file_previewable_as_text(entry.name, type_display) and not is_dir,
+        'is_code': is_code_file_for_runner(entry.name) and not is_dir,
+        'is_shared_by_owner': is_shared_by_me, 
+        'shared_with_users': shared_with_whom_list, 
+        'item_path_relative_to_owner_home_for_sharing': item_rel_to_owner_home,
+        'owner_username': owner_username,
+        # 预先计算好的排序键，排序/分页时直接使用
+        'sort_name': entry.name.lower(),
+        'size_bytes': size_bytes,
+        'mtime_ns': entry.mtime_ns,
+    }
+
+
+def _hidden_db_version():
+    return get_hidden_index().version
+
+
+def _shares_db_version():
+    # 分享库每次提交后都会把这个代号加一 (见 share_store)，读取它只是一次 mmap 整数读取
+    return get_generation_counters().read(SLOT_SHARES)
 
-def _is_file_hidden_for_user(username_of_viewer, item_abs_path, hidden_files_db):
-    # The key in hidden_files_db should be relative to USER_FILES_BASE_DIR
-    user_files_base = current_app.config.get('USER_FILES_BASE_DIR')
-    if not user_files_base or not item_abs_path.startswith(os.path.abspath(user_files_base)):
-        return False # Cannot determine if outside base
 
-    path_relative_to_base = os.path.relpath(item_abs_path, os.path.abspath(user_files_base)).replace("\\", "/")
-    user_specific_hidden_list = hidden_files_db.get(username_of_viewer, [])
-    return path_relative_to_base in user_specific_hidden_list
+# --- Routes ---
+
+@files_bp.route('/')
+@login_required
+def list_files_root():
+    current_app.logger.debug(f"[ROUTE] list_files_root called by {g.user['username']}")
+    # Redirect to the list_files_with_path with an empty subpath
+    return redirect(url_for('.list_files_with_path', subpath=''))
 
 
-# --- Consolidated Share DB Functions ---
-def load_shares_db():
-    # current_app.logger.debug("--- DEBUG TRACE: load_shares_db CALLED ---")
-    db_path = current_app.config.get('SHARES_DB_PATH')
-    if not db_path:
-        current_app.logger.error("--- FATAL ERROR: SHARES_DB_PATH is not configured!")
+def _folder_totals(current_user_username, current_path_relative_to_home):
+    """当前目录下各子文件夹的 {名称: (子树总大小, 文件数)}，来自元数据索引；索引不可用时返回 {}。"""
+    if not current_app.config.get('METADATA_INDEX_ENABLED', True):
+        return {}
+    try:
+        return get_metadata_index().child_folder_totals(current_user_username, current_path_relative_to_home)
+    except sqlite3.Error as e:
+        current_app.logger.warning(f"Could not read folder totals for '{current_user_username}/{current_path_relative_to_home}': {e}")
         return {}
 
-    data_dir = os.path.dirname(db_path)
-    # current_app.logger.debug(f"--- DEBUG TRACE: SHARES_DB_PATH resolved to: {db_path}")
-    # current_app.logger.debug(f"--- DEBUG TRACE: Data directory derived as: {data_dir}")
-
-    if not os.path.exists(data_dir):
-        # current_app.logger.info(f"--- DEBUG TRACE: Data directory {data_dir} DOES NOT EXIST. Attempting to create.")
-        try:
-            os.makedirs(data_dir, exist_ok=True)
-            # current_app.logger.info(f"--- DEBUG TRACE: Data directory {data_dir} CREATED or already existed.")
-        except OSError as e:
-            current_app.logger.error(f"--- FATAL ERROR: FAILED to create data directory {data_dir}: {e}", exc_info=True)
-            return {}
 
-    if not os.path.exists(db_path):
-        # current_app.logger.info(f"--- DEBUG TRACE: Shares DB file {db_path} DOES NOT EXIST. Creating empty DB.")
-        try:
-            with open(db_path, 'w', encoding='utf-8') as f: json.dump({}, f) # Added encoding
-            return {}
-        except IOError as e:
-            current_app.logger.error(f"--- FATAL ERROR: FAILED to create empty shares DB file {db_path}: {e}", exc_info=True)
-            return {}
-    
+def _iter_listing_items(current_user_username, current_path_abs, current_path_relative_to_home, entries, folder_totals=None):
+    """列表生成管线：ScannedEntry 流 -> 过滤隐藏项 -> 模板所需的条目字典（逐个生成）。"""
     try:
-        with open(db_path, 'r', encoding='utf-8') as f: # Added encoding
-            content = f.read().strip()
-            if not content: # Handle empty file
-                # current_app.logger.info(f"--- DEBUG TRACE: Shares DB file {db_path} is empty. Returning empty DB.")
-                return {}
-            shared_items = json.loads(content)
-        # current_app.logger.debug(f"--- DEBUG TRACE: Shares DB loaded successfully from {db_path}.")
-        return shared_items
-    except (IOError, json.JSONDecodeError, OSError) as e:
-        current_app.logger.error(f"--- FATAL ERROR: FAILED to load or parse shares DB {db_path}: {e}. Returning empty data.", exc_info=True)
-        return {}
+        user_own_shares_info = get_share_store().shares_in_dir(current_user_username, current_path_relative_to_home)
+    except sqlite3.Error as e:
+        current_app.logger.error(f"Could not read shares of '{current_user_username}/{current_path_relative_to_home}': {e}")
+        user_own_shares_info = {}
 
+    # 当前目录下被隐藏的子项名称只算一次，之后每个条目是一次集合查找
+    hidden_names = get_hidden_index().hidden_children(current_user_username, current_path_relative_to_home)
+    if hidden_names is None:
+        return  # 目录本身在被隐藏的子树中（_resolve_listing_dir 通常已拦下）
 
-def save_shares_db(shared_items):
-    # current_app.logger.debug("--- DEBUG TRACE: save_shares_db CALLED ---")
-    db_path = current_app.config.get('SHARES_DB_PATH')
-    if not db_path:
-        current_app.logger.error("--- FATAL ERROR (SAVE): SHARES_DB_PATH is not configured!")
-        return False
-    
-    # current_app.logger.debug(f"--- DEBUG TRACE (SAVE): Attempting to save shares to {db_path}")
-    # current_app.logger.debug(f"--- DEBUG TRACE (SAVE): Data to be saved (snippet): {str(shared_items)[:500]}")
+    for entry in entries:
+        if entry.name in hidden_names:
+            continue
+
+        item_rel_to_current_home = f"{current_path_relative_to_home}/{entry.name}" if current_path_relative_to_home else entry.name
+        yield _build_listing_item(entry, item_rel_to_current_home, current_user_username, user_own_shares_info,
+                                  folder_totals.get(entry.name) if folder_totals and entry.is_dir else None)
 
+
+def _scan_listing_items(current_user_username, current_path_abs, current_path_relative_to_home, folder_totals=None):
+    """扫描目录并生成列表数据；目录无法读取时返回 None（不写入缓存）。"""
     try:
-        data_dir = os.path.dirname(db_path)
-        if not os.path.exists(data_dir): 
-            os.makedirs(data_dir, exist_ok=True)
-            # current_app.logger.info(f"--- DEBUG TRACE (SAVE): Ensured data directory {data_dir} exists.")
+        entries = scan_directory(current_path_abs)
+    except OSError as e:
+        current_app.logger.error(f"Error listing files in {current_path_abs} for {current_user_username}: {e}", exc_info=True)
+        flash(f"无法列出目录内容: {e}", "danger")
+        return None
+    return list(_iter_listing_items(current_user_username, current_path_abs, current_path_relative_to_home, entries, folder_totals))
+
 
-        with open(db_path, 'w', encoding='utf-8') as f: # Added encoding
-            json.dump(shared_items, f, indent=4, ensure_ascii=False) # ensure_ascii=False for Unicode
-        # current_app.logger.info(f"--- DEBUG TRACE (SAVE): Shares successfully saved to {db_path}.")
-        return True
-    except (IOError, OSError, PermissionError) as e:
-        current_app.logger.error(f"--- FATAL ERROR (SAVE): FAILED to write shares DB to {db_path}: {e}", exc_info=True)
-        return False
+def _stream_listing_items(current_user_username, current_path_abs, current_path_relative_to_home, folder_totals=None):
+    """流式模式的数据源：边读目录边产出条目；中途出错只能记录日志并结束列表。"""
+    if folder_totals is None:
+        folder_totals = _folder_totals(current_user_username, current_path_relative_to_home)
+    try:
+        yield from _iter_listing_items(current_user_username, current_path_abs, current_path_relative_to_home,
+                                       iter_directory(current_path_abs), folder_totals)
+    except OSError as e:
+        current_app.logger.error(f"Error streaming listing of {current_path_abs} for {current_user_username}: {e}", exc_info=True)
+
+
+def _should_stream_listing(current_dir_stat):
+    """
+    ?mode=stream 显式开启；未指定排序方式且目录文件本身很大(条目很多)时自动开启。
+    流式模式按磁盘顺序输出，不排序、不分页、不经过列表缓存。
+    """
+    mode = request.args.get('mode')
+    if mode in ('stream', 'paged'):
+        return mode == 'stream'
+    threshold = current_app.config.get('LISTING_STREAM_DIR_BYTES', 0)
+    return bool(threshold) and 'sort' not in request.args and 'type' not in request.args \
+        and current_dir_stat.st_size >= threshold
+
+
+def _render_template_streamed(template_name, **context):
+    """与 render_template 相同的上下文处理，但以带缓冲的生成器输出，首字节不必等待整页渲染完成。"""
+    app = current_app._get_current_object()
+    template = app.jinja_env.get_or_select_template(template_name)
+    app.update_template_context(context)
+    stream = template.stream(context)
+    stream.enable_buffering(current_app.config.get('LISTING_STREAM_BUFFER_SIZE', 500))
+    return Response(stream_with_context(stream), mimetype='text/html')
+
+
+def _resolve_listing_dir(current_user_username, subpath):
+    """校验并定位要列出的目录，返回 (目录绝对路径, 目录 stat, 相对主目录路径)；无效时返回 None。"""
+    user_home_abs = get_user_home_dir_abs(current_user_username)
+    if not user_home_abs:
+        return None
+    current_path_abs = get_validated_absolute_path(user_home_abs, subpath)
 
+    current_dir_stat = None
+    if current_path_abs:
+        try: current_dir_stat = os.stat(current_path_abs) # 唯一一次 stat：既校验目录，又作为缓存校验值
+        except OSError: pass
 
-# --- Routes ---
+    if not current_dir_stat or not stat.S_ISDIR(current_dir_stat.st_mode):
+        current_app.logger.warning(f"Invalid path access attempt: User '{current_user_username}', Subpath: '{subpath}', Resolved Abs: '{current_path_abs}'")
+        return None
 
-@files_bp.route('/')
-@login_required
-def list_files_root():
-    current_app.logger.debug(f"[ROUTE] list_files_root called by {g.user['username']}")
-    # Redirect to the list_files_with_path with an empty subpath
-    return redirect(url_for('.list_files_with_path', subpath=''))
+    current_path_relative_to_home = get_relative_path_to_home(current_user_username, current_path_abs)
+    if current_path_relative_to_home is None:
+        return None
+    if get_hidden_index().is_hidden(current_user_username, current_path_relative_to_home):
+        current_app.logger.warning(f"Hidden folder access attempt: User '{current_user_username}', Subpath: '{subpath}'")
+        return None
+    return current_path_abs, current_dir_stat, current_path_relative_to_home
+
+
+def _listing_validators(current_user_username, current_dir_stat, current_path_relative_to_home):
+    """
+    目录列表的校验值，返回 (validators, folder_totals)。列表缓存和 ETag 共用这组值。
+    子文件夹里深层的变化不会改变本目录 mtime，所以把文件夹汇总值也纳入校验（一次索引查询，无磁盘遍历）。
+    """
+    folder_totals = _folder_totals(current_user_username, current_path_relative_to_home)
+    listing_validators = (current_dir_stat.st_mtime_ns, _hidden_db_version(), _shares_db_version(),
+                          files_generation(current_user_username), hash(frozenset(folder_totals.items())))
+    return listing_validators, folder_totals
+
+
+def _listing_etag(current_user_username, listing_validators, *extra):
+    """
+    由校验值导出的弱 ETag。用户名和角色参与计算，不同用户（以及管理员看到的“运行”按钮）不会共用缓存。
+    hash() 在各 worker 进程中的随机种子不同，所以汇总值部分用 repr 而不是 listing_validators[4]。
+    """
+    role = (g.user or {}).get('role')
+    raw = repr((current_user_username, role, listing_validators[:4], *extra))
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=12).hexdigest()
+
+
+def _html_listing_etag_extra(folder_totals):
+    """
+    HTML 页面除列表外还包含 CSRF token 和配额，这些也要体现在 ETag 里（token 按会话区分）。
+    系统状态不在页面里（侧栏通过 /api/system-stats 单独加载），所以 ETag 只随列表状态、token 和配额变化。
+    页面要显示 flash 消息时返回 None，表示不做条件响应。
+    """
+    if session.get('_flashes'):
+        return None
+    generate_csrf()  # 确保会话里已有 token，否则首个页面的 ETag 与之后的都不同
+    return (sorted(folder_totals.items()), session.get('csrf_token'), get_quota_status(g.user['username'])['used'])
+
+
+def _not_modified_or_none(etag):
+    """If-None-Match 命中时返回 304 响应，否则返回 None。"""
+    if etag and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        _set_listing_etag(response, etag)
+        return response
+    return None
+
+
+def _set_listing_etag(response, etag):
+    if etag:
+        response.set_etag(etag, weak=True)
+        # 每次都向服务器确认，但内容未变时只需一个 304；响应因登录会话而异
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.vary.add('Cookie')
+    return response
+
+
+def _get_listing_view(current_user_username, current_path_abs, current_dir_stat, current_path_relative_to_home,
+                      sort_by='name', descending=False, categories=None, validated=None):
+    """
+    从缓存取出(或扫描生成)目录列表，并返回按 sort_by / categories 排序过滤后的视图。
+    validated 为调用方已算好的 _listing_validators 结果，避免重复查询。
+    """
+    listing_cache = get_listing_cache()
+    listing_validators, folder_totals = validated or _listing_validators(
+        current_user_username, current_dir_stat, current_path_relative_to_home)
+    items_data = listing_cache.get(current_user_username, current_path_abs, listing_validators)
+    if items_data is None:
+        items_data = _scan_listing_items(current_user_username, current_path_abs, current_path_relative_to_home, folder_totals)
+        if items_data is None:
+            return []
+        listing_cache.put(current_user_username, current_path_abs, listing_validators, items_data)
+
+    view_key = (sort_by, descending, tuple(sorted(categories)) if categories else ())
+    view = listing_cache.get_view(current_user_username, current_path_abs, listing_validators, view_key)
+    if view is None:
+        view = sort_listing_items(items_data, sort_by, descending, categories)
+        listing_cache.put_view(current_user_username, current_path_abs, listing_validators, view_key, view)
+    return view
+
+
+def _parse_listing_query_args():
+    """解析 sort / order / type 查询参数，返回 (sort_by, descending, categories, view_signature)。"""
+    sort_by = request.args.get('sort', 'name')
+    if sort_by not in LISTING_SORT_FIELDS:
+        sort_by = 'name'
+    descending = request.args.get('order', 'asc') == 'desc'
+    categories = frozenset(c for c in request.args.get('type', '').split(',') if c in LISTING_FILTER_CATEGORIES)
+    view_signature = f"{sort_by}:{'desc' if descending else 'asc'}:{','.join(sorted(categories))}"
+    return sort_by, descending, categories, view_signature
 
 
 @files_bp.route('/list/', defaults={'subpath': ''}) # For /list/
@@ -283,74 +424,34 @@ def list_files_with_path(subpath):
     current_user_username = g.user['username']
     current_app.logger.debug(f"[ROUTE] list_files_with_path: User '{current_user_username}', Subpath: '{subpath}'")
 
-    user_home_abs = get_user_home_dir_abs(current_user_username) # Get user's home first
-    if not user_home_abs:
+    if not get_user_home_dir_abs(current_user_username):
         flash("无法确定用户主目录。", "danger")
         return redirect(url_for('auth.login')) # Or some other appropriate error/redirect
 
-    current_path_abs = get_validated_absolute_path(user_home_abs, subpath)
-
-    if not current_path_abs or not os.path.exists(current_path_abs) or not os.path.isdir(current_path_abs):
+    resolved = _resolve_listing_dir(current_user_username, subpath)
+    if not resolved:
         flash(f"路径 '{subpath if subpath else '/'}' 无效或不存在。", "danger")
-        current_app.logger.warning(f"Invalid path access attempt: User '{current_user_username}', Subpath: '{subpath}', Resolved Abs: '{current_path_abs}'")
         return redirect(url_for('.list_files_root')) 
-
-    current_path_relative_to_home = get_relative_path_to_home(current_user_username, current_path_abs)
-    if current_path_relative_to_home is None: 
-        flash("无法确定当前相对路径。", "danger") 
-        return redirect(url_for('.list_files_root'))
-
-    items_data = []
-    hidden_files_db_global = _load_hidden_files_db() 
-    shares_db = load_shares_db() 
-    user_own_shares_info = shares_db.get(current_user_username, {})
-
-    try:
-        for item_name in sorted(os.listdir(current_path_abs), key=lambda s: s.lower()):
-            item_abs_path = os.path.join(current_path_abs, item_name)
-            
-            if _is_file_hidden_for_user(current_user_username, item_abs_path, hidden_files_db_global):
-                continue
-
-            item_rel_to_current_home = get_relative_path_to_home(current_user_username, item_abs_path)
-            if item_rel_to_current_home is None: 
-                current_app.logger.error(f"Could not get relative path for item '{item_name}' in '{current_path_abs}'. Skipping.")
-                continue
-            
-            is_dir = os.path.isdir(item_abs_path)
-            
-            is_shared_by_me = False
-            shared_with_whom_list = []
-            if not is_dir and item_rel_to_current_home in user_own_shares_info:
-                is_shared_by_me = True
-                shared_with_whom_list = user_own_shares_info[item_rel_to_current_home].get('shared_with', [])
-
-            item_stat = None
-            try:
-                item_stat = os.stat(item_abs_path)
-            except OSError:
-                if not os.path.exists(item_abs_path): continue
-
-            item_data = {
-                'name': item_name,
-                'path_for_url': item_rel_to_current_home, 
-                'is_dir': is_dir,
-                'type_display': get_display_file_type(item_abs_path, item_name),
-                'size_readable': get_human_readable_size(item_stat.st_size) if item_stat and not is_dir else "-",
-                'last_modified': datetime.fromtimestamp(item_stat.st_mtime).strftime('%Y-%m-%d %H:%M') if item_stat else '-',
-                'is_image': is_file_previewable_as_image(item_name) and not is_dir,
-                'is_text': is_file_previewable_as_text(item_name) and not is_dir,
-                'is_code': is_code_file_for_runner(item_name) and not is_dir,
-                'is_shared_by_owner': is_shared_by_me, 
-                'shared_with_users': shared_with_whom_list, 
-                'item_path_relative_to_owner_home_for_sharing': item_rel_to_current_home,
-                'owner_username': current_user_username 
-            }
-            items_data.append(item_data)
-            
-    except OSError as e:
-        current_app.logger.error(f"Error listing files in {current_path_abs} for {current_user_username}: {e}", exc_info=True)
-        flash(f"无法列出目录内容: {e}", "danger")
+    current_path_abs, current_dir_stat, current_path_relative_to_home = resolved
+
+    # 条件请求在逐项 stat/渲染之前处理：内容未变时只花一次 stat 和一次索引查询
+    validated = _listing_validators(current_user_username, current_dir_stat, current_path_relative_to_home)
+    etag_extra = _html_listing_etag_extra(validated[1])
+    etag = _listing_etag(current_user_username, validated[0], etag_extra) if etag_extra is not None else None
+    not_modified = _not_modified_or_none(etag)
+    if not_modified is not None:
+        return not_modified
+
+    sort_by, descending, categories, view_signature = _parse_listing_query_args()
+    streaming = _should_stream_listing(current_dir_stat)
+    if streaming:
+        items_data, next_cursor, total_count = _stream_listing_items(current_user_username, current_path_abs, current_path_relative_to_home, validated[1]), None, None
+    else:
+        view = _get_listing_view(current_user_username, current_path_abs, current_dir_stat, current_path_relative_to_home,
+                                 sort_by, descending, categories, validated)
+        # 只渲染第一页，其余由页面滚动时通过 /files/api/list 按需加载
+        items_data, next_cursor = paginate_view(view, None, current_app.config.get('LISTING_PAGE_SIZE', 200), view_signature)
+        total_count = len(view)
 
     is_admin_template_context = g.user.get('role') == 'admin'
     all_users_db = current_app.config.get('USERS_DB', {})
@@ -362,14 +463,284 @@ def list_files_with_path(subpath):
         if parent_dir_rel == ".": parent_dir_rel = "" 
         parent_dir_rel = parent_dir_rel.replace("\\", "/")
 
-    return render_template(
+    render = _render_template_streamed if streaming else render_template
+    response = make_response(render(
         'files/home.html',
         files=items_data,  
         current_path_relative=current_path_relative_to_home, 
         parent_dir_relative_to_home=parent_dir_rel, 
         users_for_sharing=shareable_users, 
-        is_admin_tpl=is_admin_template_context 
+        is_admin_tpl=is_admin_template_context,
+        total_count=total_count,
+        next_cursor=next_cursor,
+        sort_by=sort_by,
+        sort_order='desc' if descending else 'asc',
+        type_filter=','.join(sorted(categories)),
+        streaming=streaming,
+        quota_status=get_quota_status(current_user_username),
+    ))
+    return _set_listing_etag(response, etag)
+
+
+def _listing_item_to_json(item, is_admin):
+    """列表条目 -> API 输出（附带前端渲染行所需的 URL）。"""
+    path_for_url = item['path_for_url']
+    data = {
+        'name': item['name'],
+        'path': path_for_url,
+        'is_dir': item['is_dir'],
+        'type_display': item['type_display'],
+        'category': item['category'],
+        'size': item['size_bytes'],
+        'size_readable': item['size_readable'],
+        'file_count': item['file_count'],
+        'mtime': item['mtime_ns'] // 1000000000 if item['mtime_ns'] is not None else None,
+        'last_modified': item['last_modified'],
+        'is_image': item['is_image'],
+        'is_text': item['is_text'],
+        'is_code': item['is_code'],
+        'is_shared_by_owner': item['is_shared_by_owner'],
+        'shared_with_users': item['shared_with_users'],
+    }
+    if item['is_dir']:
+        data['url'] = url_for('.list_files_with_path', subpath=path_for_url)
+    else:
+        data['download_url'] = url_for('.download_file_route', path_from_url=path_for_url)
+        if item['is_image']:
+            data['preview_url'] = url_for('.preview_image_file_route', path_from_url=path_for_url)
+        elif item['is_text'] or item['is_code']:
+            data['preview_url'] = url_for('.preview_text_file_route', path_from_url=path_for_url)
+        if item['is_code'] and is_admin:
+            data['run_url'] = url_for('code_runner.run_code', file_path=path_for_url)
+    return data
+
+
+@files_bp.route('/api/list/', defaults={'subpath': ''})
+@files_bp.route('/api/list/<path:subpath>')
+@login_required
+def api_list_files(subpath):
+    """
+    分页的 JSON 目录列表。
+    查询参数: sort=name|size|mtime|type, order=asc|desc, type=image,video,...(按类别过滤),
+              limit=每页条数, cursor=上一页返回的 next_cursor。
+    """
+    current_user_username = g.user['username']
+    resolved = _resolve_listing_dir(current_user_username, subpath)
+    if not resolved:
+        return jsonify_status("error", f"路径 '{subpath if subpath else '/'}' 无效或不存在。", 404)
+    current_path_abs, current_dir_stat, current_path_relative_to_home = resolved
+
+    # ETag 对每个 URL(含 sort/cursor 等查询参数)分别生效，这里只需覆盖目录内容和用户
+    validated = _listing_validators(current_user_username, current_dir_stat, current_path_relative_to_home)
+    etag = _listing_etag(current_user_username, validated[0], sorted(validated[1].items()))
+    not_modified = _not_modified_or_none(etag)
+    if not_modified is not None:
+        return not_modified
+
+    sort_by, descending, categories, view_signature = _parse_listing_query_args()
+    try:
+        limit = int(request.args.get('limit', current_app.config.get('LISTING_PAGE_SIZE', 200)))
+    except ValueError:
+        return jsonify_status("error", "limit 参数无效。", 400)
+    limit = max(1, min(limit, current_app.config.get('LISTING_API_MAX_PAGE_SIZE', 1000)))
+
+    view = _get_listing_view(current_user_username, current_path_abs, current_dir_stat, current_path_relative_to_home,
+                             sort_by, descending, categories, validated)
+    try:
+        page, next_cursor = paginate_view(view, request.args.get('cursor'), limit, view_signature)
+    except ValueError as e:
+        current_app.logger.warning(f"[ROUTE] api_list_files: bad cursor from '{current_user_username}': {e}")
+        return jsonify_status("error", "分页游标无效，请重新加载列表。", 400)
+
+    is_admin = g.user.get('role') == 'admin'
+    response, status_code = jsonify_status(
+        "success", "OK",
+        path=current_path_relative_to_home,
+        total=len(view),
+        sort=sort_by,
+        order='desc' if descending else 'asc',
+        items=[_listing_item_to_json(item, is_admin) for item in page],
+        next_cursor=next_cursor,
     )
+    return _set_listing_etag(response, etag), status_code
+
+
+@files_bp.route('/api/tree/', defaults={'subpath': ''})
+@files_bp.route('/api/tree/<path:subpath>')
+@login_required
+def api_folder_tree(subpath):
+    """
+    侧边栏文件夹树：只返回 subpath 下的子文件夹（不列出、也不 stat 文件），由前端逐级展开。
+    子文件夹的增删改名都会改变本目录 mtime，所以 ETag 只需目录 mtime 和隐藏列表版本。
+    """
+    current_user_username = g.user['username']
+    resolved = _resolve_listing_dir(current_user_username, subpath)
+    if not resolved:
+        return jsonify_status("error", f"路径 '{subpath if subpath else '/'}' 无效或不存在。", 404)
+    current_path_abs, current_dir_stat, current_path_relative_to_home = resolved
+
+    etag = _listing_etag(current_user_username, (current_dir_stat.st_mtime_ns, _hidden_db_version(), None), 'tree')
+    not_modified = _not_modified_or_none(etag)
+    if not_modified is not None:
+        return not_modified
+
+    try:
+        children = list_child_dirs(current_path_abs)
+    except OSError as e:
+        current_app.logger.error(f"Error reading folder tree of {current_path_abs} for {current_user_username}: {e}")
+        return jsonify_status("error", f"无法读取文件夹: {e}", 500)
+
+    is_hidden = _hidden_path_checker(current_user_username)
+    folders = []
+    for name, has_children in children:
+        child_rel = f"{current_path_relative_to_home}/{name}" if current_path_relative_to_home else name
+        if is_hidden and is_hidden(child_rel):
+            continue
+        folders.append({
+            'name': name,
+            'path': child_rel,
+            'has_children': has_children,
+            'url': url_for('.list_files_with_path', subpath=child_rel),
+        })
+    response, status_code = jsonify_status("success", "OK", path=current_path_relative_to_home, folders=folders)
+    return _set_listing_etag(response, etag), status_code
+
+
+def _hidden_path_checker(username):
+    """返回 is_hidden(rel_path)：rel_path 相对 username 主目录，自身或任一上级被隐藏都算隐藏；没有隐藏项时返回 None。"""
+    return get_hidden_index().checker(username)
+
+
+def _search_result_to_json(result):
+    name = result['name']
+    path_for_url = result['rel_path']
+    data = {
+        'name': name,
+        'path': path_for_url,
+        'folder': path_for_url.rpartition('/')[0],
+        'is_dir': result['is_dir'],
+        'category': result['category'],
+        'size_readable': get_human_readable_size(result['size']) if not result['is_dir'] and result['size'] is not None else '-',
+        'last_modified': _format_mtime(result['mtime_ns']),
+        'match': result['match'],
+        'owner': result['owner'],
+        'is_shared_item': result.get('is_shared_item', False),
+    }
+    if 'snippets' in result:
+        data['snippets'] = result['snippets']
+    if result['is_dir'] and result.get('is_shared_item'):
+        data['url'] = url_for('.shared_folder_route', owner_username=result['owner'], subpath=result['owner_rel_path'])
+    elif result['is_dir']:
+        data['url'] = url_for('.list_files_with_path', subpath=path_for_url)
+    else:
+        data['download_url'] = url_for('.download_file_route', path_from_url=path_for_url)
+        if is_file_previewable_as_image(name):
+            data['preview_url'] = url_for('.preview_image_file_route', path_from_url=path_for_url)
+        elif is_file_previewable_as_text(name):
+            data['preview_url'] = url_for('.preview_text_file_route', path_from_url=path_for_url)
+    if not result.get('is_shared_item'):
+        data['folder_url'] = url_for('.list_files_with_path', subpath=data['folder'])
+    return data
+
+
+def _search_shared_with_me(username, query):
+    """别人分享给我的条目不在我的索引里，数量很少，直接逐个按名称匹配。"""
+    results = []
+    for owner_username, item_path_rel_to_owner_home, share_info in get_share_store().shared_with(username):
+        display_name = share_info.get('display_name', os.path.basename(item_path_rel_to_owner_home))
+        matched = match_name(query, display_name)
+        if matched is None:
+            continue
+        is_dir = share_info.get('is_dir', False)  # 文件夹分享在分享记录里已有标记，不需要 stat
+        results.append({
+            'owner': owner_username,
+            'rel_path': f"shared/{owner_username}/{item_path_rel_to_owner_home}".replace("\\", "/"),
+            'owner_rel_path': item_path_rel_to_owner_home.replace("\\", "/"),
+            'name': display_name,
+            'is_dir': is_dir,
+            'size': None,
+            'mtime_ns': None,
+            'category': get_file_category("文件夹" if is_dir else get_display_file_type(None, display_name)),
+            'match': matched[0],
+            'score': matched[1],
+            'is_shared_item': True,
+        })
+    return results
+
+
+@files_bp.route('/search')
+@login_required
+def search_files_route():
+    """
+    按文件名搜索自己主目录（不含被隐藏的条目）以及别人分享给我的文件；
+    scope=content 时改为在自己的文本/代码文件内容中检索，结果附带匹配行。
+    查询参数: q=关键字, scope=name|content, limit=最多返回条数, format=json 时返回 JSON。
+    """
+    current_user_username = g.user['username']
+    query = request.args.get('q', '').strip()
+    scope = 'content' if request.args.get('scope') == 'content' else 'name'
+    wants_json = request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json'
+    try:
+        default_limit = current_app.config.get('CONTENT_SEARCH_RESULT_LIMIT' if scope == 'content' else 'SEARCH_RESULT_LIMIT', 100)
+        limit = int(request.args.get('limit', default_limit))
+    except ValueError:
+        return jsonify_status("error", "limit 参数无效。", 400)
+    limit = max(1, min(limit, current_app.config.get('SEARCH_MAX_RESULT_LIMIT', 500)))
+
+    results, stats, index_building = [], {}, False
+    if query and scope == 'content' and current_app.config.get('CONTENT_INDEX_ENABLED', True):
+        try:
+            results, stats = get_content_index().search(
+                current_user_username, query, limit=limit, is_hidden=_hidden_path_checker(current_user_username))
+            for result in results:
+                result.update(is_dir=False, match='content',
+                              category=get_file_category(get_display_file_type(None, result['name'])))
+        except sqlite3.Error as e:
+            current_app.logger.error(f"[ROUTE] search_files_route: content index query failed for '{current_user_username}': {e}")
+            if wants_json:
+                return jsonify_status("error", "搜索索引暂时不可用，请稍后再试。", 503)
+            flash("搜索索引暂时不可用，请稍后再试。", "danger")
+    elif query and current_app.config.get('METADATA_INDEX_ENABLED', True):
+        try:
+            index_building = not get_metadata_index().has_entries(current_user_username)
+            results, stats = search_user_files(
+                current_user_username, query, limit=limit,
+                is_hidden=_hidden_path_checker(current_user_username),
+                max_candidates=current_app.config.get('SEARCH_MAX_CANDIDATES', 20000))
+        except sqlite3.Error as e:
+            current_app.logger.error(f"[ROUTE] search_files_route: index query failed for '{current_user_username}': {e}")
+            if wants_json:
+                return jsonify_status("error", "搜索索引暂时不可用，请稍后再试。", 503)
+            flash("搜索索引暂时不可用，请稍后再试。", "danger")
+    if query and scope == 'name':
+        shared = _search_shared_with_me(current_user_username, query)
+        results = sorted(results + shared, key=lambda r: (r['match'] != 'substring', -r['score'], r['name'].lower()))[:limit]
+    current_app.logger.debug(f"[ROUTE] search_files_route: '{current_user_username}' q='{query}' -> {len(results)} hits, {stats}")
+
+    items = [_search_result_to_json(result) for result in results]
+    if wants_json:
+        return jsonify_status(
+            "success", "OK",
+            query=query,
+            scope=scope,
+            items=items,
+            truncated=stats.get('truncated', False),
+            index_building=index_building,
+            took_ms=stats.get('took_ms'),
+        )
+    return render_template(
+        'search.html',
+        title=f"搜索: {query}" if query else "搜索文件",
+        query=query,
+        scope=scope,
+        items=items,
+        truncated=stats.get('truncated', False),
+        index_building=index_building,
+        took_ms=stats.get('took_ms'),
+        is_admin_tpl=(g.user.get('role') == 'admin'),
+        username_context=current_user_username,
+    )
+
 
 def jsonify_status(status, message, status_code=200, **extra_data):
     response_data = {"status": status, "message": message}
@@ -377,6 +748,46 @@ def jsonify_status(status, message, status_code=200, **extra_data):
     return jsonify(response_data), status_code
 
 
+@files_bp.before_request
+def check_upload_quota():
+    """
+    上传前按 Content-Length 检查配额。必须在访问 request.form / request.files 之前进行，
+    否则 werkzeug 会先把整个请求体读完写进临时文件，超额的大文件要传完才会被拒绝。
+    CSRFProtect 的全局钩子会读取表单里的 csrf_token，所以上传路由在 app.py 中被 csrf.exempt，
+    CSRF 校验改在这里、配额检查通过之后进行。
+    """
+    if request.endpoint != 'files.upload_file_route':
+        return None
+    username = session.get('username')  # login_required 还没运行，g.user 尚未设置
+    exceeded, status = False, None
+    if username in current_app.config.get('USERS_DB', {}):
+        exceeded, status = upload_exceeds_quota(username, request.content_length)
+    if not exceeded:
+        if current_app.config.get('WTF_CSRF_ENABLED', True) and current_app.config.get('WTF_CSRF_CHECK_DEFAULT', True):
+            current_app.extensions['csrf'].protect()  # 校验失败时抛出 CSRFError，由 app 的错误处理返回
+        return None
+    current_app.logger.warning(f"Upload of {request.content_length} bytes by '{username}' rejected: "
+                               f"quota {status['quota']}, used {status['used']}.")
+    message = (f"上传被拒绝：文件大小 ({get_human_readable_size(request.content_length)}) 超出剩余配额 "
+               f"({get_human_readable_size(status['remaining'])})。")
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify_status("error", message, 413, quota=status['quota'], used=status['used'])
+    flash(message, "danger")
+    # 表单字段在请求体里，不读取请求体就拿不到当前目录，所以由上传表单把目录也放在查询参数中
+    return redirect_to_current_path(request.args.get('path', ''))
+
+
+def _unique_target_path(dir_abs, filename):
+    """dir_abs 下保存 filename 的路径；同名文件已存在时依次尝试 name_1.ext、name_2.ext ..."""
+    target_path = os.path.join(dir_abs, filename)
+    name, ext = os.path.splitext(filename)
+    counter = 1
+    while os.path.exists(target_path):
+        target_path = os.path.join(dir_abs, f"{name}_{counter}{ext}")
+        counter += 1
+    return target_path
+
+
 @files_bp.route('/upload', methods=['POST'], endpoint='upload_file_route')
 @login_required
 def upload_file_route():
@@ -411,20 +822,24 @@ def upload_file_route():
             flash(f"处理后的文件名为空或无效 (原始文件名: '{original_filename}')。", "danger")
             return redirect_to_current_path(current_path_relative)
 
-        target_path = os.path.join(current_dir_abs, filename_to_save)
-
-        if os.path.exists(target_path):
-            name, ext = os.path.splitext(filename_to_save)
-            counter = 1
-            while os.path.exists(target_path):
-                new_filename = f"{name}_{counter}{ext}"
-                target_path = os.path.join(current_dir_abs, new_filename)
-                counter += 1
-            filename_to_save = new_filename 
+        target_path = _unique_target_path(current_dir_abs, filename_to_save)
+        if os.path.basename(target_path) != filename_to_save:
+            filename_to_save = os.path.basename(target_path)
             flash(f"文件已存在，已重命名为 '{filename_to_save}' 并保存。", "info")
 
         try:
             file.save(target_path)
+            get_listing_cache().invalidate_path(target_path)
+            note_path_changed(target_path)
+            status = get_quota_status(g.user['username'])
+            if is_over_quota(status):
+                # Content-Length 检查无法覆盖并发上传和分块传输的请求，保存后按实际用量复核
+                os.remove(target_path)
+                get_listing_cache().invalidate_path(target_path)
+                note_path_removed(target_path)
+                flash(f"上传文件 '{original_filename}' 失败: 超出存储配额 ({get_human_readable_size(status['quota'])})。", "danger")
+                current_app.logger.warning(f"Upload '{target_path}' by '{g.user['username']}' removed: quota exceeded after save.")
+                return redirect_to_current_path(current_path_relative)
             flash(f"文件 '{filename_to_save}' 上传成功。", "success")
             current_app.logger.info(f"File '{target_path}' uploaded by user '{g.user['username']}'.")
         except Exception as e:
@@ -434,6 +849,139 @@ def upload_file_route():
     return redirect_to_current_path(current_path_relative)
 
 
+def _upload_session_json(upload, status="success", message="OK", status_code=200):
+    response, status_code = jsonify_status(
+        status, message, status_code,
+        upload_id=upload['id'], filename=upload['filename'], size=upload['size'], offset=upload['offset'],
+        upload_url=url_for('.chunked_upload_route', upload_id=upload['id']),
+        complete_url=url_for('.complete_chunked_upload', upload_id=upload['id']),
+        chunk_size=current_app.config.get('CHUNKED_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024),
+    )
+    response.headers['Upload-Offset'] = str(upload['offset'])
+    response.headers['Cache-Control'] = 'no-store'
+    return response, status_code
+
+
+def _upload_error_json(error):
+    response, status_code = jsonify_status("error", error.message, error.status_code, offset=error.offset)
+    if error.offset is not None:
+        response.headers['Upload-Offset'] = str(error.offset)
+    return response, status_code
+
+
+@files_bp.route('/api/uploads', methods=['POST'])
+@login_required
+def create_chunked_upload():
+    """
+    创建可续传的分块上传会话（协议见 chunked_upload.py）。
+    表单字段: path=目标目录 (相对主目录), filename, size=文件总字节数。
+    """
+    current_user_username = g.user['username']
+    resolved = _resolve_listing_dir(current_user_username, request.form.get('path', ''))
+    if not resolved:
+        return jsonify_status("error", "无效的上传路径。", 404)
+    _, _, dest_dir_rel = resolved
+
+    original_filename = request.form.get('filename', '').strip()
+    filename_to_save = secure_filename(original_filename)
+    if not filename_to_save:
+        return jsonify_status("error", f"处理后的文件名为空或无效 (原始文件名: '{original_filename}')。", 400)
+    try:
+        size = int(request.form.get('size', ''))
+    except ValueError:
+        return jsonify_status("error", "文件大小无效。", 400)
+    if size < 0:
+        return jsonify_status("error", "文件大小无效。", 400)
+
+    # 暂存区不在主目录中，索引里的用量不包含它：未完成的会话按声明的大小预留配额
+    status = get_quota_status(current_user_username)
+    if status['remaining'] is not None and size + pending_upload_bytes(current_user_username) > status['remaining']:
+        current_app.logger.warning(f"Chunked upload of {size} bytes by '{current_user_username}' rejected: "
+                                   f"quota {status['quota']}, used {status['used']}.")
+        return jsonify_status("error", f"上传被拒绝：文件大小 ({get_human_readable_size(size)}) 超出剩余配额 "
+                                       f"({get_human_readable_size(status['remaining'])})。", 413)
+
+    try:
+        upload = create_upload(current_user_username, dest_dir_rel, filename_to_save, size)
+    except OSError as e:
+        current_app.logger.error(f"Could not create chunked upload for '{current_user_username}': {e}", exc_info=True)
+        return jsonify_status("error", f"无法创建上传会话: {e}", 500)
+    return _upload_session_json(upload, message="上传会话已创建。", status_code=201)
+
+
+@files_bp.route('/api/uploads/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+@login_required
+def chunked_upload_route(upload_id):
+    """GET/HEAD 查询已接收的字节数，PUT 追加一个分块 (Upload-Offset 头或 ?offset=)，DELETE 放弃上传。"""
+    current_user_username = g.user['username']
+    upload = get_upload(current_user_username, upload_id)
+    if upload is None:
+        return jsonify_status("error", "上传会话不存在或已过期。", 404)
+
+    if request.method == 'DELETE':
+        abort_upload(upload)
+        return jsonify_status("success", "上传已取消。")
+    if request.method != 'PUT':
+        return _upload_session_json(upload)
+
+    try:
+        offset = int(request.headers.get('Upload-Offset', request.args.get('offset', '')))
+    except ValueError:
+        return jsonify_status("error", "缺少或无效的 Upload-Offset。", 400, offset=upload['offset'])
+    try:
+        # 直接读原始请求体，不让 werkzeug 先把整个分块缓存到临时文件
+        upload['offset'] = append_chunk(upload, offset, request.stream, request.content_length)
+    except UploadError as e:
+        current_app.logger.info(f"Chunk for upload {upload_id} by '{current_user_username}' rejected: {e.message}")
+        return _upload_error_json(e)
+    except OSError as e:
+        current_app.logger.error(f"Error writing chunk for upload {upload_id} by '{current_user_username}': {e}", exc_info=True)
+        return jsonify_status("error", f"写入分块失败: {e}", 500)
+    return _upload_session_json(upload)
+
+
+@files_bp.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete_chunked_upload(upload_id):
+    """全部分块收齐后把文件移动到目标目录；成功后返回保存的文件名。"""
+    current_user_username = g.user['username']
+    upload = get_upload(current_user_username, upload_id)
+    if upload is None:
+        return jsonify_status("error", "上传会话不存在或已过期。", 404)
+    resolved = _resolve_listing_dir(current_user_username, upload['dest_dir'])
+    if not resolved:
+        abort_upload(upload)
+        return jsonify_status("error", "目标文件夹已不存在，上传已取消。", 409)
+    dest_dir_abs = resolved[0]
+
+    try:
+        target_path = finish_upload(upload, dest_dir_abs)
+    except UploadError as e:
+        return _upload_error_json(e)
+    except OSError as e:
+        current_app.logger.error(f"Error finishing upload {upload_id} by '{current_user_username}': {e}", exc_info=True)
+        return jsonify_status("error", f"保存文件失败: {e}", 500)
+
+    get_listing_cache().invalidate_path(target_path)
+    note_path_changed(target_path)
+    status = get_quota_status(current_user_username)
+    if is_over_quota(status):
+        # 与普通上传相同：并发上传可能让实际用量超出配额，保存后按实际用量复核
+        os.remove(target_path)
+        get_listing_cache().invalidate_path(target_path)
+        note_path_removed(target_path)
+        current_app.logger.warning(f"Upload '{target_path}' by '{current_user_username}' removed: quota exceeded after save.")
+        return jsonify_status("error", f"上传文件 '{upload['filename']}' 失败: 超出存储配额 ({get_human_readable_size(status['quota'])})。", 413)
+
+    saved_name = os.path.basename(target_path)
+    if saved_name != upload['filename']:
+        flash(f"文件已存在，已重命名为 '{saved_name}' 并保存。", "info")
+    flash(f"文件 '{saved_name}' 上传成功。", "success")
+    current_app.logger.info(f"File '{target_path}' uploaded (chunked) by user '{current_user_username}'.")
+    return jsonify_status("success", f"文件 '{saved_name}' 上传成功。", filename=saved_name,
+                          path=f"{upload['dest_dir']}/{saved_name}" if upload['dest_dir'] else saved_name)
+
+
 @files_bp.route('/create_folder', methods=['POST'], endpoint='create_folder_route')
 @login_required
 def create_folder_route():
@@ -479,6 +1027,8 @@ def create_folder_route():
     else:
         try:
             os.makedirs(new_folder_path_abs)
+            get_listing_cache().invalidate_path(new_folder_path_abs)
+            note_path_changed(new_folder_path_abs)
             flash(f"文件夹 '{folder_name_to_create}' 创建成功。", "success")
             current_app.logger.info(f"Folder '{new_folder_path_abs}' created by user '{g.user['username']}'.")
         except OSError as e:
@@ -532,19 +1082,16 @@ def delete_item_route():
         else:
             os.remove(item_to_delete_abs)
             flash(f"文件 '{item_name}' 删除成功。", "success")
+        get_listing_cache().invalidate_path(item_to_delete_abs)
+        note_path_removed(item_to_delete_abs)
         current_app.logger.info(f"{'Folder' if is_dir else 'File'} '{item_name}' at '{item_to_delete_abs}' deleted by '{current_user_username}'.")
         
-        if not is_dir:
-            shares_db = load_shares_db()
-            if current_user_username in shares_db and item_path_relative_to_home in shares_db[current_user_username]:
-                del shares_db[current_user_username][item_path_relative_to_home]
-                current_app.logger.debug(f"Removed share entry for deleted file: Owner '{current_user_username}', FileRelPath '{item_path_relative_to_home}'.")
-                if not shares_db[current_user_username]: 
-                    del shares_db[current_user_username]
-                    current_app.logger.debug(f"Removed owner entry for '{current_user_username}' as no shares left.")
-                
-                if not save_shares_db(shares_db):
-                     current_app.logger.error(f"Failed to save shares_db after removing share entry for deleted file.")
+        try:
+            removed_shares = get_share_store().remove_path(current_user_username, item_path_relative_to_home)
+            if removed_shares:
+                current_app.logger.debug(f"Removed {removed_shares} share entries for deleted item: Owner '{current_user_username}', RelPath '{item_path_relative_to_home}'.")
+        except sqlite3.Error as e:
+            current_app.logger.error(f"Failed to remove share entries for deleted item '{item_path_relative_to_home}': {e}")
 
     except OSError as e:
         current_app.logger.error(f"Delete failed for {current_user_username} on {item_to_delete_abs}: {e}", exc_info=True)
@@ -563,15 +1110,11 @@ def _resolve_file_path_for_action(path_from_url, requesting_user_username):
             original_file_path_rel_to_owner_home = parts[2]
             current_app.logger.debug(f"  Shared item: Owner='{shared_item_owner_username}', RelPath='{original_file_path_rel_to_owner_home}'")
 
-            shares_db = load_shares_db()
-            owner_shares = shares_db.get(shared_item_owner_username, {})
-            share_info = owner_shares.get(original_file_path_rel_to_owner_home, {})
-            
-            allowed_to_access_share = False
-            if requesting_user_username == shared_item_owner_username: 
-                allowed_to_access_share = True
-            elif requesting_user_username in share_info.get('shared_with', []):
-                allowed_to_access_share = True
+            # 权限判断结果按分享代号缓存，图库中连续预览很多共享图片时不会每次都查询分享库；
+            # 文件本身没有分享记录时按最长匹配的上级文件夹分享判断
+            allowed_to_access_share, display_name, _ = check_share_access(
+                requesting_user_username, shared_item_owner_username, original_file_path_rel_to_owner_home)
+            display_name = display_name or os.path.basename(original_file_path_rel_to_owner_home)
 
             if not allowed_to_access_share:
                 current_app.logger.warning(f"  Access DENIED: User '{requesting_user_username}' not in shared_with list for '{path_from_url}'.")
@@ -585,9 +1128,13 @@ def _resolve_file_path_for_action(path_from_url, requesting_user_username):
             
             if not file_abs or not os.path.exists(file_abs): 
                  current_app.logger.warning(f"  Shared file NOT FOUND: Original file for '{path_from_url}' at '{file_abs}' does not exist.")
-                 return None, f"共享文件 '{share_info.get('display_name', os.path.basename(original_file_path_rel_to_owner_home))}' 不存在或已被所有者删除。", None
+                 return None, f"共享文件 '{display_name}' 不存在或已被所有者删除。", None
+            # 共享文件夹中被管理员隐藏的内容对接收者同样不可见
+            if get_hidden_index().is_hidden(shared_item_owner_username, get_relative_path_to_home(shared_item_owner_username, file_abs) or ''):
+                 current_app.logger.warning(f"  Shared file HIDDEN: '{path_from_url}' requested by '{requesting_user_username}'.")
+                 return None, f"共享文件 '{display_name}' 不存在或已被所有者删除。", None
             
-            filename_for_action = share_info.get('display_name', os.path.basename(original_file_path_rel_to_owner_home))
+            filename_for_action = display_name
             current_app.logger.debug(f"  Shared item RESOLVED: AbsPath='{file_abs}', DisplayName='{filename_for_action}'")
             return file_abs, None, filename_for_action
         else:
@@ -604,6 +1151,10 @@ def _resolve_file_path_for_action(path_from_url, requesting_user_username):
         if not file_abs or not os.path.exists(file_abs): 
             current_app.logger.warning(f"  Own file NOT FOUND: Path '{path_from_url}' for user '{requesting_user_username}' at '{file_abs}' does not exist.")
             return None, "文件路径无效或文件不存在。", None
+        # 被管理员隐藏的文件(或位于被隐藏文件夹中)按不存在处理，不能通过直接构造 URL 访问
+        if get_hidden_index().is_hidden(requesting_user_username, get_relative_path_to_home(requesting_user_username, file_abs) or ''):
+            current_app.logger.warning(f"  Own file HIDDEN: Path '{path_from_url}' for user '{requesting_user_username}'.")
+            return None, "文件路径无效或文件不存在。", None
         
         filename_for_action = os.path.basename(file_abs) # Use basename of absolute path to be safe
         current_app.logger.debug(f"  Own item RESOLVED: AbsPath='{file_abs}', DisplayName='{filename_for_action}'")
@@ -654,7 +1205,7 @@ def preview_text_file_route(path_from_url):
         if path_from_url.startswith('shared/'): return redirect(url_for('.shared_with_me_route'))
         else: return redirect(url_for('.list_files_with_path', subpath=os.path.dirname(path_from_url) or ''))
 
-    if not is_file_previewable_as_text(filename_for_preview):
+    if not is_file_previewable_as_text(filename_for_preview, get_display_file_type(file_to_preview_abs, filename_for_preview, is_dir=False)):
         flash(f"文件 '{filename_for_preview}' 类型不支持文本预览。", "info")
         if path_from_url.startswith('shared/'): return redirect(url_for('.shared_with_me_route'))
         else: return redirect(url_for('.list_files_with_path', subpath=os.path.dirname(path_from_url) or ''))
@@ -747,46 +1298,31 @@ def share_file_action():
         flash("无法确定所有者主目录。", "danger")
         return redirect(url_for('.list_files_with_path', subpath=owner_current_view_path))
     file_to_share_abs = get_validated_absolute_path(owner_home_abs, file_path_rel_to_owner_home)
+    # 分享记录统一用规范化的相对路径作键，文件夹分享的前缀匹配依赖这一点
+    file_key_for_db = get_relative_path_to_home(owner_username, file_to_share_abs) if file_to_share_abs else None
 
-    if not file_to_share_abs or not os.path.exists(file_to_share_abs) or os.path.isdir(file_to_share_abs): 
-        flash("要分享的项目无效、不存在或是文件夹（目前仅支持文件分享）。", "danger")
-        current_app.logger.warning(f"Share attempt failed: Item '{file_path_rel_to_owner_home}' for owner '{owner_username}' not found or is a directory.")
+    if not file_key_for_db or not os.path.exists(file_to_share_abs): 
+        flash("要分享的项目无效或不存在。", "danger")
+        current_app.logger.warning(f"Share attempt failed: Item '{file_path_rel_to_owner_home}' for owner '{owner_username}' not found.")
         return redirect(url_for('.list_files_with_path', subpath=owner_current_view_path))
-    
-    file_key_for_db = file_path_rel_to_owner_home 
-    shares_db = load_shares_db()
-    if owner_username not in shares_db:
-        shares_db[owner_username] = {}
-    
-    owner_specific_shares = shares_db[owner_username]
-    current_file_share_info = owner_specific_shares.get(file_key_for_db)
-    if not current_file_share_info:
-        current_file_share_info = {
-            'shared_with': [], 
-            'display_name': os.path.basename(file_key_for_db), 
-            'shared_on': datetime.utcnow().isoformat() 
-        }
-        current_app.logger.debug(f"  New share entry created for '{file_key_for_db}' by '{owner_username}'.")
-    
-    action_msg = "" # Initialize action_msg
-    if share_with_user not in current_file_share_info['shared_with']:
-        current_file_share_info['shared_with'].append(share_with_user)
-        current_file_share_info['last_modified_share'] = datetime.utcnow().isoformat() 
-        action_msg = "已成功分享给用户"
-        current_app.logger.info(f"  User '{share_with_user}' added to share list for '{file_key_for_db}'.")
-    else:
-        flash(f"文件 '{current_file_share_info['display_name']}' 已分享给用户 '{share_with_user}'。", "info")
-        current_app.logger.info(f"  File '{file_key_for_db}' already shared with '{share_with_user}'. No change.")
+    is_dir_share = os.path.isdir(file_to_share_abs)
+    item_label = "文件夹" if is_dir_share else "文件"
+
+    try:
+        added, current_file_share_info = get_share_store().add_recipient(owner_username, file_key_for_db, share_with_user,
+                                                                         is_dir=is_dir_share)
+    except sqlite3.Error as e:
+        flash("保存分享设置失败。", "danger")
+        current_app.logger.error(f"Failed to save share: Owner '{owner_username}', File '{file_key_for_db}': {e}")
         return redirect(url_for('.list_files_with_path', subpath=owner_current_view_path))
 
-    owner_specific_shares[file_key_for_db] = current_file_share_info
-    
-    current_app.logger.debug(f"  Preparing to save shares_db. Owner: '{owner_username}', File: '{file_key_for_db}', NewInfo: {current_file_share_info}")
-    if save_shares_db(shares_db):
-        flash(f"文件 '{current_file_share_info['display_name']}' {action_msg} '{share_with_user}'。", "success")
+    if added:
+        get_listing_cache().invalidate_user(owner_username)
+        current_app.logger.info(f"  User '{share_with_user}' added to share list for '{file_key_for_db}'.")
+        flash(f"{item_label} '{current_file_share_info['display_name']}' 已成功分享给用户 '{share_with_user}'。", "success")
     else:
-        flash("保存分享设置失败。", "danger")
-        current_app.logger.error(f"Failed to save shares_db for share operation: Owner '{owner_username}', File '{file_key_for_db}'.")
+        flash(f"{item_label} '{current_file_share_info['display_name']}' 已分享给用户 '{share_with_user}'。", "info")
+        current_app.logger.info(f"  File '{file_key_for_db}' already shared with '{share_with_user}'. No change.")
     
     return redirect(url_for('.list_files_with_path', subpath=owner_current_view_path))
 
@@ -803,35 +1339,158 @@ def unshare_file_action():
     if not file_path_rel_to_owner_home or not unshare_for_user:
         return jsonify_status("error", "缺少必要参数 (文件路径或用户名)。", 400)
 
-    shares_db = load_shares_db()
-    if owner_username not in shares_db or \
-       file_path_rel_to_owner_home not in shares_db[owner_username]:
+    share_info = get_share_store().get_share(owner_username, file_path_rel_to_owner_home)
+    display_name = (share_info or {}).get('display_name', os.path.basename(file_path_rel_to_owner_home))
+    try:
+        outcome = get_share_store().remove_recipient(owner_username, file_path_rel_to_owner_home, unshare_for_user)
+    except sqlite3.Error as e:
+        current_app.logger.error(f"Failed to save unshare operation for '{file_path_rel_to_owner_home}': {e}")
+        return jsonify_status("error", "保存分享设置失败，请检查服务器日志。", 500)
+
+    if outcome == 'no_share':
         current_app.logger.warning(f"  Unshare failed: File '{file_path_rel_to_owner_home}' not found in shares for owner '{owner_username}'.")
         return jsonify_status("error", "文件分享记录不存在。", 404)
-
-    file_share_info = shares_db[owner_username][file_path_rel_to_owner_home]
-    
-    if unshare_for_user not in file_share_info.get('shared_with', []):
+    if outcome == 'not_shared':
         current_app.logger.info(f"  Unshare info: User '{unshare_for_user}' was not in shared_with list for '{file_path_rel_to_owner_home}'. No action taken.")
         return jsonify_status("info", f"用户 '{unshare_for_user}' 未曾被分享此文件。", 200) 
 
-    file_share_info['shared_with'].remove(unshare_for_user)
-    file_share_info['last_modified_share'] = datetime.utcnow().isoformat()
     current_app.logger.info(f"  User '{unshare_for_user}' removed from shared_with list for '{file_path_rel_to_owner_home}'.")
+    get_listing_cache().invalidate_user(owner_username)
+    return jsonify_status("success", f"已取消文件 '{display_name}' 对用户 '{unshare_for_user}' 的分享。")
 
-    if not file_share_info['shared_with']:
-        del shares_db[owner_username][file_path_rel_to_owner_home]
-        current_app.logger.info(f"  Share entry for '{file_path_rel_to_owner_home}' removed as shared_with list is empty.")
-        if not shares_db[owner_username]:
-            del shares_db[owner_username]
-            current_app.logger.info(f"  Owner entry for '{owner_username}' removed as no shares left.")
-    
-    if save_shares_db(shares_db):
-        display_name = file_share_info.get('display_name', os.path.basename(file_path_rel_to_owner_home))
-        return jsonify_status("success", f"已取消文件 '{display_name}' 对用户 '{unshare_for_user}' 的分享。")
-    else:
-        current_app.logger.error(f"Failed to save shares_db after unshare operation for '{file_path_rel_to_owner_home}'.")
-        return jsonify_status("error", "保存分享设置失败，请检查服务器日志。", 500)
+
+def _resolve_own_shareable_item(owner_username, item_path):
+    """所有者要分享的条目 -> (规范化的相对路径, 是否文件夹)；无效、不存在、被隐藏或是主目录本身时返回 (None, None)。"""
+    owner_home_abs = get_user_home_dir_abs(owner_username)
+    item_abs = get_validated_absolute_path(owner_home_abs, item_path) if owner_home_abs and item_path else None
+    item_rel = get_relative_path_to_home(owner_username, item_abs) if item_abs else None
+    if not item_rel or not os.path.exists(item_abs) or get_hidden_index().is_hidden(owner_username, item_rel):
+        return None, None
+    return item_rel, os.path.isdir(item_abs)
+
+
+def _public_link_to_json(link):
+    expires_at = link['expires_at']
+    return {
+        'token': link['token'],
+        'url': url_for('public.public_link', token=link['token'], _external=True),
+        'created_on': _format_share_time(link['created_on']),
+        'expires_at': datetime.fromtimestamp(expires_at).strftime('%Y-%m-%d %H:%M') if expires_at is not None else None,
+        'expired': expires_at is not None and time.time() >= expires_at,
+        'max_downloads': link['max_downloads'],
+        'download_count': link['download_count'],
+    }
+
+
+@files_bp.route('/share-actions/public-links')
+@login_required
+def list_public_links_action():
+    """某个条目的所有公开链接 (JSON)。查询参数: path=相对主目录的路径。"""
+    owner_username = g.user['username']
+    item_rel, _ = _resolve_own_shareable_item(owner_username, request.args.get('path', ''))
+    if item_rel is None:
+        return jsonify_status("error", "项目无效或不存在。", 404)
+    links = get_share_store().public_links_for(owner_username, item_rel)
+    return jsonify_status("success", "OK", links=[_public_link_to_json(link) for link in links])
+
+
+@files_bp.route('/share-actions/create-public-link', methods=['POST'])
+@login_required
+def create_public_link_action():
+    """
+    为自己的文件或文件夹创建公开链接。表单字段: item_path, expires_in_days (可选，天数，可以是小数),
+    max_downloads (可选，正整数)。返回新链接的 JSON。
+    """
+    owner_username = g.user['username']
+    item_path = request.form.get('item_path', '')
+    item_rel, is_dir = _resolve_own_shareable_item(owner_username, item_path)
+    if item_rel is None:
+        return jsonify_status("error", "要分享的项目无效或不存在。", 404)
+
+    try:
+        expires_in_days = float(request.form['expires_in_days']) if request.form.get('expires_in_days') else None
+        max_downloads = int(request.form['max_downloads']) if request.form.get('max_downloads') else None
+    except ValueError:
+        return jsonify_status("error", "有效期或下载次数格式无效。", 400)
+    if (expires_in_days is not None and not 0 < expires_in_days <= 3650) or (max_downloads is not None and max_downloads <= 0):
+        return jsonify_status("error", "有效期或下载次数超出范围。", 400)
+
+    expires_at = time.time() + expires_in_days * 86400 if expires_in_days is not None else None
+    try:
+        link = get_share_store().create_public_link(owner_username, item_rel, is_dir=is_dir,
+                                                    expires_at=expires_at, max_downloads=max_downloads)
+    except sqlite3.Error as e:
+        current_app.logger.error(f"Failed to create public link: Owner '{owner_username}', Item '{item_rel}': {e}")
+        return jsonify_status("error", "创建公开链接失败，请检查服务器日志。", 500)
+
+    current_app.logger.info(f"Public link created: Owner '{owner_username}', Item '{item_rel}', "
+                            f"expires_at={expires_at}, max_downloads={max_downloads}.")
+    return jsonify_status("success", "公开链接已创建。", link=_public_link_to_json(link))
+
+
+@files_bp.route('/share-actions/revoke-public-link', methods=['POST'])
+@login_required
+def revoke_public_link_action():
+    owner_username = g.user['username']
+    token = request.form.get('token', '')
+    if not token:
+        return jsonify_status("error", "缺少链接令牌。", 400)
+    try:
+        revoked = get_share_store().revoke_public_link(owner_username, token)
+    except sqlite3.Error as e:
+        current_app.logger.error(f"Failed to revoke public link for '{owner_username}': {e}")
+        return jsonify_status("error", "撤销公开链接失败，请检查服务器日志。", 500)
+    if not revoked:
+        return jsonify_status("error", "链接不存在或已被撤销。", 404)
+    current_app.logger.info(f"Public link revoked by '{owner_username}'.")
+    return jsonify_status("success", "公开链接已撤销。")
+
+
+@lru_cache(maxsize=4096)
+def _format_share_time(shared_on_str):
+    """分享时间(ISO 字符串) -> 页面显示格式；同一条分享的时间不会变，解析结果按字符串缓存。"""
+    if not shared_on_str:
+        return '-'
+    try:
+        return datetime.fromisoformat(shared_on_str.replace("Z", "+00:00")).strftime('%Y-%m-%d %H:%M')
+    except ValueError:
+        current_app.logger.warning(f"Could not parse shared_on date: {shared_on_str}")
+        return '-'
+
+
+def _stat_shared_items(matches):
+    """
+    分享条目的 [ScannedEntry 或 None(已不存在)]，与 matches 一一对应。
+    优先取元数据索引中记录的 大小/修改时间/inode（按所有者批量查询，相当于缓存的 stat 结果），
+    索引中没有的条目才真正 stat，并由线程池并发完成。
+    """
+    results = [None] * len(matches)
+    indexed = {}
+    if current_app.config.get('METADATA_INDEX_ENABLED', True):
+        by_owner = {}
+        for owner_username, item_path_rel_to_owner_home, _, abs_path, _ in matches:
+            if abs_path:
+                by_owner.setdefault(owner_username, []).append(item_path_rel_to_owner_home)
+        try:
+            index = get_metadata_index()
+            for owner_username, rel_paths in by_owner.items():
+                for rel_path, row in index.get_entries(owner_username, rel_paths).items():
+                    indexed[(owner_username, rel_path)] = row
+        except sqlite3.Error as e:
+            current_app.logger.warning(f"Could not read shared items from metadata index: {e}")
+
+    to_stat = []
+    for i, (owner_username, item_path_rel_to_owner_home, _, abs_path, display_name) in enumerate(matches):
+        if not abs_path:
+            continue
+        row = indexed.get((owner_username, item_path_rel_to_owner_home))
+        if row is not None:
+            results[i] = ScannedEntry(display_name, abs_path, bool(row['is_dir']), row['size'], row['mtime_ns'], row['inode'])
+        else:
+            to_stat.append((i, abs_path, display_name))
+    for (i, _, _), item_stat in zip(to_stat, stat_paths([(abs_path, name) for _, abs_path, name in to_stat])):
+        results[i] = item_stat
+    return results
 
 
 @files_bp.route('/shared-with-me')
@@ -839,52 +1498,49 @@ def unshare_file_action():
 def shared_with_me_route(): 
     requesting_user_username = g.user['username']
     shared_items_for_template = []
-    shares_db = load_shares_db()
 
     current_app.logger.debug(f"[ROUTE] shared_with_me_route: User: {requesting_user_username}")
 
-    for owner_username, owner_files_shared_out in shares_db.items():
-        for item_path_rel_to_owner_home, share_info in owner_files_shared_out.items():
-            if requesting_user_username in share_info.get('shared_with', []):
-                current_app.logger.debug(f"  Match: Item '{owner_username}/{item_path_rel_to_owner_home}' is shared with '{requesting_user_username}'.")
-                
-                owner_home_abs = get_user_home_dir_abs(owner_username) # Get owner's home
-                original_file_abs_path = None
-                if owner_home_abs:
-                    original_file_abs_path = get_validated_absolute_path(owner_home_abs, item_path_rel_to_owner_home)
-                
-                file_exists = original_file_abs_path and os.path.exists(original_file_abs_path)
-                is_dir_shared = file_exists and os.path.isdir(original_file_abs_path)
-                display_name = share_info.get('display_name', os.path.basename(item_path_rel_to_owner_home))
-                shared_item_path_for_url = f"shared/{owner_username}/{item_path_rel_to_owner_home}".replace("\\","/")
-
-                item_stat = None
-                if file_exists:
-                    try: item_stat = os.stat(original_file_abs_path)
-                    except OSError: pass 
-
-                shared_on_str = share_info.get('shared_on')
-                shared_on_display = '-'
-                if shared_on_str:
-                    try: shared_on_display = datetime.fromisoformat(shared_on_str.replace("Z", "+00:00")).strftime('%Y-%m-%d %H:%M') 
-                    except ValueError: current_app.logger.warning(f"Could not parse shared_on date: {shared_on_str}")
-
-                item_entry = {
-                    'name': display_name, 
-                    'path_for_url': shared_item_path_for_url, 
-                    'is_dir': is_dir_shared,
-                    'type_display': get_display_file_type(original_file_abs_path if file_exists else None, display_name),
-                    'size_readable': get_human_readable_size(item_stat.st_size) if file_exists and item_stat and not is_dir_shared else ("-" if file_exists else "N/A (已删除)"),
-                    'last_modified': datetime.fromtimestamp(item_stat.st_mtime).strftime('%Y-%m-%d %H:%M') if file_exists and item_stat else ('-' if file_exists else "N/A"),
-                    'shared_on_display': shared_on_display,
-                    'is_image': is_file_previewable_as_image(display_name) and not is_dir_shared and file_exists,
-                    'is_text': is_file_previewable_as_text(display_name) and not is_dir_shared and file_exists,
-                    'is_code': False, 
-                    'owner_username': owner_username, 
-                    'is_shared_item': True, 
-                    'file_exists_for_recipient': file_exists 
-                }
-                shared_items_for_template.append(item_entry)
+    matches = []
+    for owner_username, item_path_rel_to_owner_home, share_info in get_share_store().shared_with(requesting_user_username):
+        current_app.logger.debug(f"  Match: Item '{owner_username}/{item_path_rel_to_owner_home}' is shared with '{requesting_user_username}'.")
+        
+        owner_home_abs = get_user_home_dir_abs(owner_username) # Get owner's home
+        original_file_abs_path = None
+        if owner_home_abs:
+            original_file_abs_path = get_validated_absolute_path(owner_home_abs, item_path_rel_to_owner_home)
+        display_name = share_info.get('display_name', os.path.basename(item_path_rel_to_owner_home))
+        matches.append((owner_username, item_path_rel_to_owner_home, share_info, original_file_abs_path, display_name))
+
+    # 存在性 / 是否目录 / 大小 / 修改时间 来自元数据索引，索引中没有的才 stat
+    for match, item_stat in zip(matches, _stat_shared_items(matches)):
+        owner_username, item_path_rel_to_owner_home, share_info, original_file_abs_path, display_name = match
+        file_exists = item_stat is not None
+        is_dir_shared = file_exists and item_stat.is_dir
+        shared_item_path_for_url = f"shared/{owner_username}/{item_path_rel_to_owner_home}".replace("\\","/")
+
+        shared_on_display = _format_share_time(share_info.get('shared_on'))
+
+        item_entry = {
+            'name': display_name, 
+            'path_for_url': shared_item_path_for_url, 
+            'is_dir': is_dir_shared,
+            'type_display': get_file_types().classify(display_name, is_dir=is_dir_shared, abs_path=original_file_abs_path,
+                                                      inode=item_stat.inode, size=item_stat.size, mtime_ns=item_stat.mtime_ns)
+                            if file_exists else get_display_file_type(None, display_name),
+            'size_readable': get_human_readable_size(item_stat.size) if file_exists and not is_dir_shared else ("-" if file_exists else "N/A (已删除)"),
+            'last_modified': _format_mtime(item_stat.mtime_ns) if file_exists else "N/A",
+            'shared_on_display': shared_on_display,
+            'is_image': is_file_previewable_as_image(display_name) and not is_dir_shared and file_exists,
+            'is_text': is_file_previewable_as_text(display_name) and not is_dir_shared and file_exists,
+            'is_code': False, 
+            'owner_username': owner_username, 
+            'is_shared_item': True, 
+            'file_exists_for_recipient': file_exists 
+        }
+        if is_dir_shared:
+            item_entry['browse_url'] = url_for('.shared_folder_route', owner_username=owner_username, subpath=item_path_rel_to_owner_home)
+        shared_items_for_template.append(item_entry)
 
     shared_items_for_template.sort(key=lambda x: (x['owner_username'], x['name'].lower()))
 
@@ -895,3 +1551,77 @@ def shared_with_me_route():
         is_admin_tpl=(g.user.get('role') == 'admin'),
         username_context=g.user['username']
     )
+
+
+@files_bp.route('/shared-folder/<owner_username>/<path:subpath>')
+@login_required
+def shared_folder_route(owner_username, subpath):
+    """
+    浏览别人分享给我的文件夹及其子文件夹。权限按最长匹配的上级文件夹分享判断 (check_share_access)；
+    列表直接复用所有者的目录列表（同一份列表缓存、排序和隐藏过滤），只把路径改写成 shared/<所有者>/<路径>，
+    下载和预览因此走已有的共享文件路由。
+    """
+    requesting_user_username = g.user['username']
+    current_app.logger.debug(f"[ROUTE] shared_folder_route: User '{requesting_user_username}', Owner '{owner_username}', Subpath '{subpath}'")
+
+    allowed, _, share_root = check_share_access(requesting_user_username, owner_username, subpath)
+    if not allowed:
+        current_app.logger.warning(f"Shared folder access DENIED: User '{requesting_user_username}', Owner '{owner_username}', Subpath '{subpath}'")
+        flash("您无权访问此共享文件夹。", "danger")
+        return redirect(url_for('.shared_with_me_route'))
+
+    resolved = _resolve_listing_dir(owner_username, subpath)
+    if not resolved:
+        flash("共享文件夹不存在或已被所有者删除。", "danger")
+        return redirect(url_for('.shared_with_me_route'))
+    current_path_abs, current_dir_stat, current_path_relative_to_home = resolved
+
+    sort_by, descending, categories, view_signature = _parse_listing_query_args()
+    validated = _listing_validators(owner_username, current_dir_stat, current_path_relative_to_home)
+    view = _get_listing_view(owner_username, current_path_abs, current_dir_stat, current_path_relative_to_home,
+                             sort_by, descending, categories, validated)
+    try:
+        page, next_cursor = paginate_view(view, request.args.get('cursor'), current_app.config.get('LISTING_PAGE_SIZE', 200), view_signature)
+    except ValueError:
+        page, next_cursor = paginate_view(view, None, current_app.config.get('LISTING_PAGE_SIZE', 200), view_signature)
+
+    items = []
+    for item in page:
+        item_rel = item['path_for_url']
+        item_entry = {
+            'name': item['name'],
+            'path_for_url': f"shared/{owner_username}/{item_rel}",
+            'is_dir': item['is_dir'],
+            'type_display': item['type_display'],
+            'size_readable': item['size_readable'],
+            'last_modified': item['last_modified'],
+            'is_image': item['is_image'],
+            'is_text': item['is_text'] or item['is_code'],
+            'is_code': False,
+            'owner_username': owner_username,
+            'is_shared_item': True,
+            'file_exists_for_recipient': True,
+        }
+        if item['is_dir']:
+            item_entry['browse_url'] = url_for('.shared_folder_route', owner_username=owner_username, subpath=item_rel)
+        items.append(item_entry)
+
+    # 面包屑从分享根目录开始，不暴露所有者目录中分享范围以外的部分
+    root_depth = len(share_root.split('/')) if share_root else 0
+    path_parts = current_path_relative_to_home.split('/') if current_path_relative_to_home else []
+    breadcrumbs = [(path_parts[i - 1], url_for('.shared_folder_route', owner_username=owner_username, subpath='/'.join(path_parts[:i])))
+                   for i in range(max(root_depth, 1), len(path_parts) + 1)]
+    parent_url = breadcrumbs[-2][1] if len(breadcrumbs) > 1 else url_for('.shared_with_me_route')
+
+    return render_template(
+        'shared_list.html',
+        items=items,
+        title=f"{owner_username} 共享的文件夹: {path_parts[-1] if path_parts else owner_username}",
+        breadcrumbs=breadcrumbs,
+        parent_url=parent_url,
+        total_count=len(view),
+        next_page_url=url_for('.shared_folder_route', owner_username=owner_username, subpath=current_path_relative_to_home,
+                              cursor=next_cursor, **{k: v for k, v in request.args.items() if k != 'cursor'}) if next_cursor else None,
+        is_admin_tpl=(g.user.get('role') == 'admin'),
+        username_context=g.user['username']
+    )
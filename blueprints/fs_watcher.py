@@ -0,0 +1,379 @@
+# /home/pi/my_cloud_app/blueprints/fs_watcher.py
+"""
+基于 inotify (通过 ctypes 调用 libc) 的 USER_FILES_BASE_DIR 实时监视服务。
+
+文件变化既可能来自网页路由，也可能来自 Samba 或直接在树莓派上跑的 rsync。
+监视线程为整个存储树递归建立 watch，把内核事件整理成变更日志 (journal)，
+并推送给订阅者（缓存、索引等），这样它们不必再靠全量遍历来发现变化。
+
+- 新建/移入的目录会自动补上 watch，并补发建 watch 之前已出现的子项。
+- 内核事件队列溢出 (IN_Q_OVERFLOW) 时，只对 mtime 变化了的目录做定向重扫。
+- 订阅回调在监视线程中以批为单位调用：callback(list[ChangeEvent])。
+- 整个服务只在元数据索引的维护进程（持有维护锁的那个 worker）中运行一个监视器，
+  各 worker 不会重复为同一棵树建立 watch、分摊同一个 fs.inotify.max_user_watches 上限；
+  递归建立 watch 也在监视线程中进行，不阻塞请求。
+"""
+import ctypes
+import ctypes.util
+import errno
+import itertools
+import os
+import select
+import struct
+import threading
+import time
+from collections import deque, namedtuple
+
+
+# --- inotify 常量 (见 <sys/inotify.h>) ---
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+# 不监听 IN_MODIFY：大文件上传时每次 write 都会产生一个事件，等 IN_CLOSE_WRITE 即可
+WATCH_MASK = (IN_CREATE | IN_DELETE | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_ATTRIB |
+              IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+
+_EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+# kind: 'created' / 'deleted' / 'modified' / 'attrib' / 'moved_from' / 'moved_to'
+#       'rescan'   (溢出后发现 mtime 变化的目录，子项需重新读取)
+#       'overflow' (内核丢失了事件，path 为监视根目录；需要精确结果的订阅者应自行对账)
+ChangeEvent = namedtuple('ChangeEvent', ['seq', 'kind', 'path', 'is_dir', 'timestamp'])
+
+
+class InotifyUnavailable(OSError):
+    pass
+
+
+def _load_libc():
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise InotifyUnavailable("libc does not provide inotify_init1")
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_init1.restype = ctypes.c_int
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_add_watch.restype = ctypes.c_int
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    libc.inotify_rm_watch.restype = ctypes.c_int
+    return libc
+
+
+# --- 订阅者注册表（与具体的监视器实例无关，监视器重启后订阅依然有效） ---
+_subscribers = []
+_subscribers_lock = threading.Lock()
+
+
+def subscribe(callback):
+    """注册变更回调 callback(list[ChangeEvent])。回调在监视线程中执行，应尽量轻量。"""
+    with _subscribers_lock:
+        if callback not in _subscribers:
+            _subscribers.append(callback)
+
+
+def unsubscribe(callback):
+    with _subscribers_lock:
+        if callback in _subscribers:
+            _subscribers.remove(callback)
+
+
+class FsWatcher:
+    def __init__(self, root_abs, logger, journal_size=20000, ignored_dirs=()):
+        self.root_abs = os.path.abspath(root_abs)
+        self.logger = logger
+        self.ignored_dirs = {os.path.abspath(d) for d in ignored_dirs if d}  # 不为这些子树建立 watch（如分块上传的临时目录）
+        self.pid = os.getpid()
+        self.degraded = False  # 因 watch 数量上限等原因有子树未被监视
+        self._libc = _load_libc()
+        self._fd = None
+        self._wd_to_path = {}
+        self._path_to_wd = {}
+        self._dir_mtimes = {}  # 已监视目录 -> 建 watch 时的 st_mtime_ns，用于溢出后的定向重扫
+        self._journal = deque(maxlen=journal_size)
+        self._journal_lock = threading.Lock()
+        self._seq = itertools.count(1)
+        self._latest_seq = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    # --- 生命周期 ---
+
+    def start(self):
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise InotifyUnavailable(err, f"inotify_init1 failed: {os.strerror(err)}")
+        self._fd = fd
+        self._thread = threading.Thread(target=self._run, name='fs-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    # --- 变更日志 ---
+
+    @property
+    def latest_seq(self):
+        return self._latest_seq
+
+    def changes_since(self, seq):
+        """
+        返回序号大于 seq 的全部事件。
+        如果 seq 之后的事件已被挤出日志（消费者落后太多），返回 None，调用方需要全量对账。
+        """
+        with self._journal_lock:
+            if seq >= self._latest_seq:
+                return []
+            if not self._journal or self._journal[0].seq > seq + 1:
+                return None
+            return [event for event in self._journal if event.seq > seq]
+
+    # --- watch 管理 ---
+
+    def _add_watch(self, dir_abs):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dir_abs), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC and not self.degraded:
+                self.logger.warning("FsWatcher: inotify watch limit reached (fs.inotify.max_user_watches); "
+                                    "part of the tree is not watched.")
+                self.degraded = True
+            elif err not in (errno.ENOENT, errno.ENOTDIR, errno.ENOSPC):
+                self.logger.warning(f"FsWatcher: cannot watch {dir_abs}: {os.strerror(err)}")
+            return False
+        self._wd_to_path[wd] = dir_abs
+        self._path_to_wd[dir_abs] = wd
+        try:
+            self._dir_mtimes[dir_abs] = os.stat(dir_abs).st_mtime_ns
+        except OSError:
+            pass
+        return True
+
+    def _watch_tree(self, top_abs, report_children):
+        """
+        为 top_abs 及其所有子目录建立 watch（迭代式 scandir）。
+        report_children=True 时（目录是运行期间新出现的），为其中已有的子项补发 created 事件，
+        因为它们可能在 watch 建立之前就已写入，内核不会再通知。
+        """
+        events = []
+        pending = [top_abs]
+        while pending:
+            dir_abs = pending.pop()
+            if dir_abs in self._path_to_wd or dir_abs in self.ignored_dirs or not self._add_watch(dir_abs):
+                continue
+            try:
+                with os.scandir(dir_abs) as it:
+                    for entry in it:
+                        try:
+                            is_dir = entry.is_dir(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        if report_children:
+                            events.append(('created', entry.path, is_dir))
+                        if is_dir:
+                            pending.append(entry.path)
+            except OSError:
+                continue
+        return events
+
+    def _forget_tree(self, top_abs):
+        prefix = top_abs.rstrip(os.sep) + os.sep
+        for path in [p for p in self._path_to_wd if p == top_abs or p.startswith(prefix)]:
+            wd = self._path_to_wd.pop(path)
+            self._wd_to_path.pop(wd, None)
+            self._dir_mtimes.pop(path, None)
+            self._libc.inotify_rm_watch(self._fd, wd)  # 已失效的 wd 返回 EINVAL，忽略即可
+
+    def _rescan_after_overflow(self):
+        """事件丢失后：只 stat 已监视的目录，对 mtime 有变化的目录发 rescan 事件并补齐新子目录的 watch。"""
+        events = [('overflow', self.root_abs, True)]
+        for dir_abs, old_mtime in list(self._dir_mtimes.items()):
+            try:
+                current_mtime = os.stat(dir_abs).st_mtime_ns
+            except OSError:
+                events.append(('deleted', dir_abs, True))
+                self._forget_tree(dir_abs)
+                continue
+            if current_mtime == old_mtime:
+                continue
+            self._dir_mtimes[dir_abs] = current_mtime
+            events.append(('rescan', dir_abs, True))
+            try:
+                with os.scandir(dir_abs) as it:
+                    new_dirs = [e.path for e in it if e.is_dir(follow_symlinks=False) and e.path not in self._path_to_wd]
+            except OSError:
+                continue
+            for new_dir in new_dirs:
+                events.append(('created', new_dir, True))
+                events.extend(self._watch_tree(new_dir, report_children=True))
+        self.logger.warning(f"FsWatcher: event queue overflowed; targeted rescan found {len(events) - 1} changes.")
+        return events
+
+    # --- 事件循环 ---
+
+    def _run(self):
+        # 先在本线程中递归建立 watch；期间发生的变化已排在 inotify 队列里，建完后照常处理
+        started_at = time.monotonic()
+        self._watch_tree(self.root_abs, report_children=False)
+        self.logger.info(f"FsWatcher: watching {len(self._wd_to_path)} directories under {self.root_abs} "
+                         f"(setup took {time.monotonic() - started_at:.2f}s).")
+        poller = select.poll()
+        poller.register(self._fd, select.POLLIN)
+        while not self._stop.is_set():
+            try:
+                if not poller.poll(1000):
+                    continue
+                raw_events = self._read_events()
+                if raw_events:
+                    self._publish(raw_events)
+            except Exception as e:
+                self.logger.error(f"FsWatcher: error in event loop: {e}", exc_info=True)
+                time.sleep(1)
+
+    def _read_events(self):
+        events = []
+        while True:
+            try:
+                buf = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            if not buf:
+                break
+            events.extend(self._parse_events(buf))
+        return events
+
+    def _parse_events(self, buf):
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(buf):
+            wd, mask, _cookie, name_len = _EVENT_HEADER.unpack_from(buf, offset)
+            name = buf[offset + _EVENT_HEADER.size: offset + _EVENT_HEADER.size + name_len].rstrip(b'\0')
+            offset += _EVENT_HEADER.size + name_len
+
+            if mask & IN_Q_OVERFLOW:
+                events.extend(self._rescan_after_overflow())
+                continue
+
+            dir_abs = self._wd_to_path.get(wd)
+            if dir_abs is None:
+                continue
+            if mask & IN_IGNORED:
+                # watch 已被内核移除（目录被删除或所在文件系统卸载）
+                self._wd_to_path.pop(wd, None)
+                if self._path_to_wd.get(dir_abs) == wd:
+                    del self._path_to_wd[dir_abs]
+                    self._dir_mtimes.pop(dir_abs, None)
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                continue  # 父目录会收到对应的 IN_DELETE / IN_MOVED_FROM
+
+            path = os.path.join(dir_abs, os.fsdecode(name)) if name else dir_abs
+            is_dir = bool(mask & IN_ISDIR)
+
+            if mask & IN_CREATE:
+                events.append(('created', path, is_dir))
+                if is_dir:
+                    events.extend(self._watch_tree(path, report_children=True))
+            elif mask & IN_MOVED_TO:
+                events.append(('moved_to', path, is_dir))
+                if is_dir:
+                    events.extend(self._watch_tree(path, report_children=False))
+            elif mask & IN_DELETE:
+                events.append(('deleted', path, is_dir))
+                if is_dir:
+                    self._forget_tree(path)
+            elif mask & IN_MOVED_FROM:
+                events.append(('moved_from', path, is_dir))
+                if is_dir:
+                    self._forget_tree(path)
+            elif mask & IN_CLOSE_WRITE:
+                events.append(('modified', path, is_dir))
+            elif mask & IN_ATTRIB:
+                events.append(('attrib', path, is_dir))
+
+            if name and dir_abs in self._dir_mtimes and mask & (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO):
+                try:
+                    self._dir_mtimes[dir_abs] = os.stat(dir_abs).st_mtime_ns
+                except OSError:
+                    pass
+        return events
+
+    def _publish(self, raw_events):
+        now = time.time()
+        with self._journal_lock:
+            batch = [ChangeEvent(next(self._seq), kind, path, is_dir, now) for kind, path, is_dir in raw_events]
+            self._journal.extend(batch)
+            self._latest_seq = batch[-1].seq
+        with _subscribers_lock:
+            callbacks = list(_subscribers)
+        for callback in callbacks:
+            try:
+                callback(batch)
+            except Exception as e:
+                self.logger.error(f"FsWatcher: subscriber {callback!r} failed: {e}", exc_info=True)
+
+
+_fs_watcher = None
+_fs_watcher_lock = threading.Lock()
+_fs_watcher_unavailable = False
+
+
+def get_fs_watcher():
+    """返回本进程中正在运行的监视器，未启用或不可用时返回 None。"""
+    watcher = _fs_watcher
+    if watcher is not None and watcher.pid == os.getpid():
+        return watcher
+    return None
+
+
+def ensure_fs_watcher_started(app):
+    """
+    在当前进程中启动监视器。只由 metadata_index.ensure_index_maintainer 在拿到维护锁之后调用，
+    所以所有 worker 加起来只有一个监视器；其他 worker 通过共享的索引和代号得知变化。
+    用 pid 判断，避免 --preload 模式下 fork 前启动的线程在 worker 中失效。
+    """
+    global _fs_watcher, _fs_watcher_unavailable
+    watcher = get_fs_watcher()
+    if watcher is not None or _fs_watcher_unavailable:
+        return watcher
+    if not app.config.get('FS_WATCHER_ENABLED', True):
+        _fs_watcher_unavailable = True
+        return None
+    with _fs_watcher_lock:
+        if get_fs_watcher() is not None:
+            return _fs_watcher
+        root_abs = app.config.get('USER_FILES_BASE_DIR')
+        try:
+            # 分块上传的临时目录默认位于存储树内，每个分块落盘都会产生事件，且不属于任何用户的文件
+            watcher = FsWatcher(root_abs, app.logger, journal_size=app.config.get('FS_WATCHER_JOURNAL_SIZE', 20000),
+                                ignored_dirs=[app.config.get('CHUNKED_UPLOAD_DIR')])
+            watcher.start()
+        except (OSError, AttributeError) as e:
+            app.logger.warning(f"FsWatcher: inotify unavailable, live change tracking disabled: {e}")
+            _fs_watcher_unavailable = True
+            return None
+        _fs_watcher = watcher
+        return watcher
@@ -0,0 +1,229 @@
+# /home/pi/my_cloud_app/blueprints/hidden_index.py
+"""
+隐藏文件索引。
+
+hidden_files.json 的格式是 {用户名: [路径, ...]}。历史上存在两种路径写法：
+列表页按 "用户名/相对主目录路径"(相对 USER_FILES_BASE_DIR) 比较，而管理面板保存的是相对主目录的路径，
+两者对不上，管理员勾选的项目在列表里并没有被隐藏。这里两种写法都接受：以 "用户名/" 开头的按前者去掉前缀，
+其余按相对主目录处理；管理面板保存时统一写成前者 (canonical_hidden_path)，以后不再有歧义。
+
+规范化后的设置编译成每个用户一棵按路径分量组织的前缀树，进程内共享。
+隐藏一个文件夹等于隐藏其下所有内容，判断 "路径自身或任一上级被隐藏" 只需沿树走 depth 步。
+
+修改通过 update_hidden_paths 按增量进行，经 data_store.JsonStore 在文件锁内读出当前内容、只改动一个用户的集合，
+原子写回并把顶层的 "_version" 计数器加一。多个管理员同时保存不会互相覆盖，读者也不会读到写了一半的文件。
+
+hidden_files.json 只是持久化的数据源，各 worker 不在请求中读它：写入后由 state_snapshot 发布一份 marshal 快照和新代号，
+其他 worker 每个请求只比较一次 mmap 中的代号，变化时才加载快照重新编译。
+手工编辑 hidden_files.json 的情况每隔 HIDDEN_FILES_RECHECK_SECONDS 秒 stat 一次来发现，并重新发布快照。
+"""
+import threading
+import time
+
+from flask import current_app
+
+from .data_store import VERSION_KEY, JsonStore, data_file_version, file_lock
+from .state_snapshot import SLOT_HIDDEN_FILES, get_generation_counters, read_snapshot, write_snapshot
+
+
+_HIDDEN = None  # 前缀树节点中标记“此路径被隐藏”的键；路径分量都是非空字符串，不会与之冲突
+
+
+def _split(rel_path):
+    return [part for part in rel_path.replace("\\", "/").split('/') if part and part != '.']
+
+
+def normalize_hidden_path(username, path):
+    """配置中的一条路径 -> 相对用户主目录的路径(以 '/' 分隔)；无效时返回 None。"""
+    parts = _split(path or '')
+    if parts and parts[0] == username:
+        parts = parts[1:]
+    if not parts or '..' in parts:
+        return None
+    return '/'.join(parts)
+
+
+def canonical_hidden_path(username, rel_path):
+    """相对主目录的路径 -> 写入 hidden_files.json 的形式 "用户名/相对主目录路径"；无效时返回 None。"""
+    parts = _split(rel_path or '')
+    if not parts or '..' in parts:
+        return None
+    return f"{username}/{'/'.join(parts)}"
+
+
+class HiddenPathIndex:
+    """
+    某一版本隐藏设置编译出的只读索引。version 是发布时的代号 (state_snapshot 槽位的值)，
+    source_version 是当时 hidden_files.json 的 data_file_version，用来发现手工修改。
+    """
+
+    def __init__(self, hidden_db, version, source_version=None):
+        self.version = version
+        self.source_version = source_version
+        self._tries = {}
+        self._paths = {}
+        for username, paths in (hidden_db or {}).items():
+            if not isinstance(paths, list):
+                continue
+            root = {}
+            normalized = set()
+            for path in paths:
+                rel_path = normalize_hidden_path(username, path) if isinstance(path, str) else None
+                if rel_path is None:
+                    continue
+                normalized.add(rel_path)
+                node = root
+                for part in rel_path.split('/'):
+                    node = node.setdefault(part, {})
+                node[_HIDDEN] = True
+            if normalized:
+                self._tries[username] = root
+                self._paths[username] = frozenset(normalized)
+
+    def hidden_paths(self, username):
+        """显式隐藏的路径集合(相对主目录)，不含因上级被隐藏而隐藏的后代。"""
+        return self._paths.get(username, frozenset())
+
+    def is_hidden(self, username, rel_path):
+        """rel_path(相对主目录) 自身或任一上级是否被隐藏，O(路径深度)。"""
+        node = self._tries.get(username)
+        if node is None:
+            return False
+        for part in _split(rel_path):
+            node = node.get(part)
+            if node is None:
+                return False
+            if _HIDDEN in node:
+                return True
+        return False
+
+    def checker(self, username):
+        """返回 is_hidden(rel_path) 函数；该用户没有任何隐藏项时返回 None，调用方可直接跳过过滤。"""
+        if username not in self._tries:
+            return None
+        return lambda rel_path: self.is_hidden(username, rel_path)
+
+    def hidden_children(self, username, dir_rel):
+        """
+        dir_rel 下被直接隐藏的子项名称集合，供目录列表逐项 O(1) 过滤。
+        dir_rel 自身(或其上级)被隐藏时返回 None，表示整个目录都不可见。
+        """
+        node = self._tries.get(username)
+        if node is None:
+            return frozenset()
+        for part in _split(dir_rel):
+            node = node.get(part)
+            if node is None:
+                return frozenset()
+            if _HIDDEN in node:
+                return None
+        return frozenset(name for name, child in node.items() if name is not _HIDDEN and _HIDDEN in child)
+
+
+_index = None
+_index_lock = threading.Lock()
+_next_source_check = 0.0
+
+
+_stores = {}  # HIDDEN_FILES_PATH -> JsonStore
+
+
+def _hidden_store(path):
+    store = _stores.get(path)
+    if store is None:
+        group_commit_seconds = current_app.config.get('DATA_STORE_GROUP_COMMIT_MS', 0) / 1000
+        store = _stores.setdefault(path, JsonStore(path, on_commit=_on_commit, group_commit_seconds=group_commit_seconds))
+    return store
+
+
+def _on_commit(hidden_db):
+    """JsonStore 写回 hidden_files.json 之后 (仍持有文件锁) 发布快照，本进程直接换上新索引。"""
+    global _index
+    _index = _publish(hidden_db, current_app.config['HIDDEN_FILES_PATH'])
+
+
+def _snapshot_path():
+    return current_app.config['HIDDEN_FILES_PATH'] + '.snapshot'
+
+
+def _publish(hidden_db, path):
+    """把 hidden_db 规范化后发布为新一代快照（调用方持有 hidden_files.json 的文件锁），返回编译好的索引。"""
+    canonical_db = {}
+    for username, paths in hidden_db.items():
+        if username == VERSION_KEY or not isinstance(paths, list):
+            continue
+        canonical = {canonical_hidden_path(username, normalize_hidden_path(username, p))
+                     for p in paths if isinstance(p, str)} - {None}
+        if canonical:
+            canonical_db[username] = sorted(canonical)
+    source_version = data_file_version(path)
+    payload = {'source_version': source_version, 'hidden': canonical_db}
+    generation = get_generation_counters().bump(
+        SLOT_HIDDEN_FILES, lambda new_generation: write_snapshot(_snapshot_path(), new_generation, payload))
+    current_app.logger.debug(f"Hidden files snapshot published (generation {generation}).")
+    return HiddenPathIndex(canonical_db, generation, source_version)
+
+
+def _load_snapshot():
+    """加载当前快照编译成索引；快照不存在或已损坏时返回 None。"""
+    generation, payload = read_snapshot(_snapshot_path())
+    if generation is None or not isinstance(payload, dict):
+        return None
+    return HiddenPathIndex(payload.get('hidden'), generation, payload.get('source_version'))
+
+
+def _republish_from_json(path):
+    with file_lock(path):
+        return _publish(_hidden_store(path).read(), path)
+
+
+def get_hidden_index():
+    """
+    返回当前代号的索引。通常只是一次 mmap 整数读取和比较；
+    代号变化时加载快照 (marshal，不解析 JSON)，每隔 HIDDEN_FILES_RECHECK_SECONDS 秒 stat 一次 hidden_files.json。
+    """
+    global _index, _next_source_check
+    generation = get_generation_counters().read(SLOT_HIDDEN_FILES)
+    index = _index
+    if index is not None and index.version == generation and time.monotonic() < _next_source_check:
+        return index
+    path = current_app.config['HIDDEN_FILES_PATH']
+    with _index_lock:
+        if _index is None or _index.version != get_generation_counters().read(SLOT_HIDDEN_FILES):
+            _index = _load_snapshot() or _republish_from_json(path)
+        now = time.monotonic()
+        if now >= _next_source_check:
+            _next_source_check = now + current_app.config.get('HIDDEN_FILES_RECHECK_SECONDS', 5)
+            if _index.source_version != data_file_version(path):
+                current_app.logger.info(f"Hidden files DB {path} changed on disk; republishing snapshot.")
+                _index = _republish_from_json(path)
+        return _index
+
+
+def update_hidden_paths(username, add=(), remove=()):
+    """
+    对 username 的隐藏集合应用增量：先去掉 remove，再加入 add (都是相对主目录的路径)。
+    其他用户的设置原样保留。返回 (新的 _version, 该用户现有的隐藏条数)；写入失败时抛出 OSError。
+    同一 worker 中并发的多次修改由 JsonStore 组提交合并成一次写入。
+    """
+    add_canonical = {canonical_hidden_path(username, p) for p in add} - {None}
+    remove_canonical = {canonical_hidden_path(username, p) for p in remove} - {None}
+
+    def mutate(hidden_db):
+        current = hidden_db.get(username)
+        current = current if isinstance(current, list) else []
+        # 旧文件中两种写法都有，先统一成规范形式再做集合运算
+        canonical = {canonical_hidden_path(username, normalize_hidden_path(username, p))
+                     for p in current if isinstance(p, str)} - {None}
+        updated = (canonical - remove_canonical) | add_canonical
+        if updated:
+            hidden_db[username] = sorted(updated)
+        else:
+            hidden_db.pop(username, None)
+        return hidden_db, len(updated)
+
+    # 提交后 _version 才加一，所以返回 hidden_db 本身，在提交完成后再读取
+    hidden_db, hidden_count = _hidden_store(current_app.config['HIDDEN_FILES_PATH']).update(mutate)
+    current_app.logger.info(f"Hidden files for '{username}' updated: +{len(add_canonical)} -{len(remove_canonical)}, "
+                            f"version {hidden_db[VERSION_KEY]}.")
+    return hidden_db[VERSION_KEY], hidden_count
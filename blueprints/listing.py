@@ -0,0 +1,385 @@
+# /home/pi/my_cloud_app/blueprints/listing.py
+"""
+基于 os.scandir 的目录读取引擎。
+
+外部 USB 硬盘上每一次元数据系统调用都很昂贵。这里用 DirEntry 自带的
+d_type / 缓存 stat 一次性取得列表需要的全部字段（是否目录、大小、修改时间、inode），
+供 files.list_files_with_path、shared_with_me_route 以及管理面板的目录遍历共用。
+
+冷缓存时 USB 机械盘上的 stat 是逐个排队、逐个寻道的。对配置了 PARALLEL_STAT_MOUNTS 的挂载点，
+这些 stat 由一个有界线程池并发发出，内核和硬盘可以把多个请求放进队列一起调度（NCQ / 电梯算法）。
+工作线程只负责把 stat 结果预热进 DirEntry 的缓存，ScannedEntry 仍由调用线程按原顺序构造。
+"""
+import base64
+import bisect
+import json
+import os
+import stat
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+
+# 每个条目的原始元数据。size / mtime_ns / inode 在 stat 失败时为 None。
+ScannedEntry = namedtuple('ScannedEntry', ['name', 'abs_path', 'is_dir', 'size', 'mtime_ns', 'inode'])
+
+
+def _entry_from_dirent(entry):
+    """把一个 DirEntry 转成 ScannedEntry；条目在扫描期间消失（或是悬空链接）时返回 None。"""
+    try:
+        is_dir = entry.is_dir()  # 普通文件/目录由 d_type 得出，无需额外系统调用
+        item_stat = entry.stat()  # 每个条目仅此一次 stat，结果由 DirEntry 缓存
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        current_app.logger.warning(f"Could not stat '{entry.path}' during scan: {e}")
+        return ScannedEntry(entry.name, entry.path, False, None, None, None)
+    return ScannedEntry(entry.name, entry.path, is_dir, item_stat.st_size, item_stat.st_mtime_ns, item_stat.st_ino)
+
+
+# --- 并行 stat ---
+
+_stat_pools = {}  # 线程数 -> ThreadPoolExecutor，本进程内共享
+_stat_pools_pid = None
+_stat_pools_lock = threading.Lock()
+
+
+def stat_pool_size(abs_path):
+    """
+    abs_path 所在挂载点配置的并行 stat 线程数；0 表示逐个 stat。
+    PARALLEL_STAT_MOUNTS 是 {挂载点路径: 线程数}，取最长的匹配前缀。
+    """
+    abs_path = os.path.abspath(abs_path)
+    best_prefix, size = "", current_app.config.get('PARALLEL_STAT_DEFAULT_WORKERS', 0)
+    for mount, workers in current_app.config.get('PARALLEL_STAT_MOUNTS', {}).items():
+        mount = os.path.abspath(mount)
+        if (abs_path == mount or abs_path.startswith(mount.rstrip(os.sep) + os.sep)) and len(mount) > len(best_prefix):
+            best_prefix, size = mount, workers
+    return max(0, int(size or 0))
+
+
+def _get_stat_pool(workers):
+    """按线程数取(或创建)共享线程池；fork 出的新 worker 进程不能沿用父进程的线程，需重新创建。"""
+    global _stat_pools_pid
+    with _stat_pools_lock:
+        if _stat_pools_pid != os.getpid():
+            _stat_pools.clear()
+            _stat_pools_pid = os.getpid()
+        pool = _stat_pools.get(workers)
+        if pool is None:
+            pool = _stat_pools[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'stat{workers}')
+        return pool
+
+
+def _warm_dirents(entries):
+    """在工作线程中执行：让 DirEntry 缓存 stat 结果。出错留给调用线程在 _entry_from_dirent 中处理。"""
+    for entry in entries:
+        try:
+            entry.stat()
+        except OSError:
+            pass
+
+
+def _stat_plan(dir_abs):
+    """(线程数, 每批条目数, 启用并行的最少条目数)；线程数为 0 时不并行。"""
+    workers = stat_pool_size(dir_abs)
+    return (workers, current_app.config.get('PARALLEL_STAT_BATCH_SIZE', 512),
+            current_app.config.get('PARALLEL_STAT_MIN_ENTRIES', 32))
+
+
+def iter_directory(dir_abs):
+    """
+    按磁盘(scandir)顺序逐个生成 ScannedEntry，不在内存中保留整个目录。
+    挂载点启用了并行 stat 时按批读取目录项，每批的 stat 由线程池并发完成后再依次生成。
+    目录本身无法读取时抛出 OSError。
+    """
+    workers, batch_size, min_entries = _stat_plan(dir_abs)
+    with os.scandir(dir_abs) as it:
+        if not workers:
+            for entry in it:
+                scanned = _entry_from_dirent(entry)
+                if scanned is not None:
+                    yield scanned
+            return
+        pool = _get_stat_pool(workers)
+        batch = []
+        for entry in it:
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                yield from _scan_batch(batch, pool, workers, min_entries)
+                batch = []
+        yield from _scan_batch(batch, pool, workers, min_entries)
+
+
+def _scan_batch(batch, pool, workers, min_entries):
+    if len(batch) >= min_entries:
+        # 每个线程分到一个交错的切片，任务数等于线程数，不必为每个条目提交一次
+        for _ in pool.map(_warm_dirents, [batch[i::workers] for i in range(workers)]):
+            pass
+    for entry in batch:
+        scanned = _entry_from_dirent(entry)
+        if scanned is not None:
+            yield scanned
+
+
+def scan_directory(dir_abs):
+    """
+    单次遍历读取目录，返回按名称(忽略大小写)排序的 ScannedEntry 列表。
+    目录本身无法读取时抛出 OSError，由调用方决定如何提示用户。
+    """
+    entries = list(iter_directory(dir_abs))
+    entries.sort(key=lambda e: e.name.lower())
+    return entries
+
+
+def list_child_dirs(dir_abs):
+    """
+    目录下的子文件夹 [(名称, has_children)]，按名称(忽略大小写)排序，供侧边栏文件夹树使用。
+    是否目录由 d_type 得出，文件不做 stat；只 stat 子文件夹本身，用 st_nlink 判断它是否还有下级文件夹：
+    nlink > 2 表示有，== 2 表示没有，文件系统不维护目录链接数(btrfs 等报告 1)时为 None(未知)。
+    目录本身无法读取时抛出 OSError。
+    """
+    children = []
+    with os.scandir(dir_abs) as it:
+        for entry in it:
+            try:
+                if not entry.is_dir():
+                    continue
+                nlink = entry.stat().st_nlink
+            except OSError:
+                continue
+            children.append((entry.name, nlink > 2 if nlink >= 2 else None))
+    children.sort(key=lambda child: child[0].lower())
+    return children
+
+
+def stat_path(abs_path, name=None):
+    """
+    对单个路径做一次 os.stat，返回 ScannedEntry；路径不存在或不可访问时返回 None。
+    用于不在同一目录下的零散条目（例如“与我共享”列表），替代 exists + isdir + stat 三连。
+    """
+    try:
+        item_stat = os.stat(abs_path)
+    except OSError:
+        return None
+    return ScannedEntry(
+        name if name is not None else os.path.basename(abs_path),
+        abs_path,
+        stat.S_ISDIR(item_stat.st_mode),
+        item_stat.st_size,
+        item_stat.st_mtime_ns,
+        item_stat.st_ino,
+    )
+
+
+def stat_paths(paths_and_names):
+    """
+    对一组零散路径做 stat_path，返回与输入顺序一致的 ScannedEntry / None 列表。
+    paths_and_names 为 [(abs_path, name), ...]；所在挂载点启用了并行 stat 时由线程池并发完成。
+    """
+    paths_and_names = list(paths_and_names)
+    if not paths_and_names:
+        return []
+    workers = stat_pool_size(paths_and_names[0][0])
+    if not workers or len(paths_and_names) < current_app.config.get('PARALLEL_STAT_MIN_ENTRIES', 32):
+        return [stat_path(abs_path, name) for abs_path, name in paths_and_names]
+    return list(_get_stat_pool(workers).map(lambda pair: stat_path(*pair), paths_and_names))
+
+
+def _read_dir_children(dir_abs):
+    """
+    读取一个目录的 [(名称, 绝对路径, is_dir, is_symlink)]；可在工作线程中执行。
+    出错时返回异常对象，由调用线程记录日志。
+    """
+    children = []
+    try:
+        with os.scandir(dir_abs) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                children.append((entry.name, entry.path, is_dir, is_dir and entry.is_symlink()))
+    except (FileNotFoundError, PermissionError) as e:
+        return e
+    return children
+
+
+def _tree_sort_key(child):
+    name, _, is_dir, _ = child
+    return (not is_dir, name.lower(), name)
+
+
+def _sorted_children_after(dir_abs, after_key=None, children=None):
+    """
+    dir_abs 排好序的子项中排在 after_key 之后的部分（列表）；目录无法读取时返回 None。
+    children 为已经读好的 _read_dir_children(dir_abs) 结果（预读），None 时在这里读取。
+    """
+    if children is None:
+        children = _read_dir_children(dir_abs)
+    if isinstance(children, OSError):
+        current_app.logger.warning(f"Cannot scan '{dir_abs}': {children}")
+        return None
+    children.sort(key=_tree_sort_key)
+    if after_key is None:
+        return children
+    return children[bisect.bisect_right([_tree_sort_key(child) for child in children], after_key):]
+
+
+class _TreeReader:
+    """
+    iter_tree 读取目录的方式。所在挂载点启用了并行 stat 时，每读完一层就在共享线程池中
+    预读这一层接下来要进入的若干个子文件夹（窗口为线程数的两倍），深度优先遍历时磁盘上始终有多个读请求排队；
+    未启用时逐个读取。分页提前结束的遍历最多浪费一个窗口的读取。
+    """
+
+    def __init__(self, root_abs, max_depth):
+        workers = stat_pool_size(root_abs)
+        self._pool = _get_stat_pool(workers) if workers else None
+        self._window = workers * 2
+        self._max_depth = max_depth
+        self._futures = {}  # 子文件夹绝对路径 -> 预读的 Future
+        self._upcoming = {}  # 目录绝对路径 -> 尚未提交预读的子文件夹（按遍历顺序）
+
+    def children_after(self, dir_abs, depth, after_key=None):
+        """dir_abs 中排在 after_key 之后的子项（深度为 depth）的迭代器；目录无法读取时返回 None。"""
+        future = self._futures.pop(dir_abs, None)
+        children = _sorted_children_after(dir_abs, after_key, future.result() if future is not None else None)
+        if self._pool is not None:
+            parent_abs = os.path.dirname(dir_abs)
+            siblings = self._upcoming.get(parent_abs)
+            if siblings and siblings[0] == dir_abs:
+                siblings.popleft()  # 窗口已满、没来得及预读的，已经在上面同步读过了
+            self._prefetch(parent_abs)
+            if children and (self._max_depth is None or depth < self._max_depth):
+                self._upcoming[dir_abs] = deque(
+                    entry_path for _, entry_path, is_dir, is_symlink in children if is_dir and not is_symlink)
+                self._prefetch(dir_abs)
+        return iter(children) if children is not None else None
+
+    def _prefetch(self, dir_abs):
+        upcoming = self._upcoming.get(dir_abs)
+        while upcoming and len(self._futures) < self._window:
+            child_abs = upcoming.popleft()
+            self._futures[child_abs] = self._pool.submit(_read_dir_children, child_abs)
+        if upcoming is not None and not upcoming:
+            del self._upcoming[dir_abs]
+
+
+def iter_tree(root_abs, max_depth=None, resume_after=None):
+    """
+    按 (文件夹在前, 名称) 排序的先序遍历，逐个生成 (相对于 root_abs 的路径, is_dir, 深度)，root_abs 的子项深度为 1。
+    max_depth 限制向下展开的层数。只使用 DirEntry.is_dir()，不对文件做 stat；内存中只保留当前路径上各层目录的子项列表，
+    因此可以配合 itertools.islice 分页读取很大的目录树。所在挂载点启用了并行 stat 时子文件夹由线程池预读（见 _TreeReader）。
+
+    resume_after 为上次生成的最后一项的相对路径（文件夹以 '/' 结尾）：沿着这条路径逐层读取目录，
+    在每层排好序的子项中二分定位到它之后，从那里继续，不必重新走一遍前面的部分。该项已被删除也能正确续上。
+    """
+    root_abs = os.path.abspath(root_abs)  # 预读按 os.path.dirname 找父目录，路径末尾不能有 '/'
+    reader = _TreeReader(root_abs, max_depth)
+    if resume_after is None:
+        children_iter = reader.children_after(root_abs, 1)
+        stack = [(children_iter, "", 1)] if children_iter is not None else []
+    else:
+        stack = _resume_stack(reader, root_abs, resume_after, max_depth)
+    while stack:
+        children_iter, dir_rel, depth = stack[-1]
+        child = next(children_iter, None)
+        if child is None:
+            stack.pop()
+            continue
+        name, entry_path, is_dir, is_symlink = child
+        item_rel = f"{dir_rel}/{name}" if dir_rel else name
+        yield item_rel, is_dir, depth
+        if is_dir and not is_symlink and (max_depth is None or depth < max_depth):
+            grandchildren_iter = reader.children_after(entry_path, depth + 1)
+            if grandchildren_iter is not None:
+                stack.append((grandchildren_iter, item_rel, depth + 1))
+
+
+def _resume_stack(reader, root_abs, resume_after, max_depth):
+    """iter_tree 的续传：重建遍历到 resume_after 时的栈（每层一个从它之后开始的子项迭代器）。"""
+    last_is_dir = resume_after.endswith('/')
+    parts = [part for part in resume_after.split('/') if part]
+    if '..' in parts or '.' in parts:
+        raise ValueError(f"resume_after must stay inside the tree: {resume_after!r}")
+    stack = []
+    dir_abs, dir_rel = root_abs, ""
+    for depth, name in enumerate(parts, start=1):
+        is_dir = depth < len(parts) or last_is_dir
+        children_iter = reader.children_after(dir_abs, depth, (not is_dir, name.lower(), name))
+        if children_iter is None:
+            break
+        stack.append((children_iter, dir_rel, depth))
+        if not is_dir or (max_depth is not None and depth >= max_depth):
+            break
+        dir_abs = os.path.join(dir_abs, name)
+        dir_rel = f"{dir_rel}/{name}" if dir_rel else name
+        # 路径上的文件夹已被删除（或换成了文件、符号链接）时，它剩下的部分也就没有了
+        if os.path.islink(dir_abs) or not os.path.isdir(dir_abs):
+            break
+        if depth == len(parts):
+            # resume_after 本身是文件夹：先序遍历中接下来是它的子项
+            children_iter = reader.children_after(dir_abs, depth + 1)
+            if children_iter is not None:
+                stack.append((children_iter, dir_rel, depth + 1))
+    return stack
+
+
+# --- 排序与分页（供 HTML 列表和 /files/api/list 共用） ---
+
+# 每个列表条目在生成时已带有 sort_name / size_bytes / mtime_ns 等排序键，排序时不再做任何计算或 I/O
+LISTING_SORT_FIELDS = {
+    'name': lambda item: item['sort_name'],
+    'size': lambda item: (item['size_bytes'] or 0, item['sort_name']),
+    'mtime': lambda item: (item['mtime_ns'] or 0, item['sort_name']),
+    'type': lambda item: (item['type_display'], item['sort_name']),
+}
+
+
+def sort_listing_items(items, sort_by='name', descending=False, categories=None):
+    """按 sort_by 排序并按类别过滤，返回新列表（视图）。items 本身保持名称顺序不变。"""
+    if categories:
+        items = [item for item in items if item['category'] in categories]
+    if sort_by == 'name' and not descending:
+        return list(items)  # scan_directory 已按名称排好
+    return sorted(items, key=LISTING_SORT_FIELDS[sort_by], reverse=descending)
+
+
+def encode_cursor(offset, last_name, view_signature):
+    raw = json.dumps([offset, last_name, view_signature], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析分页游标，格式错误时抛出 ValueError。"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        offset, last_name, view_signature = json.loads(raw.decode('utf-8'))
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"invalid cursor: {e}")
+    if not isinstance(offset, int) or offset < 0:
+        raise ValueError("invalid cursor offset")
+    return offset, last_name, view_signature
+
+
+def paginate_view(view, cursor, limit, view_signature):
+    """
+    从排好序的视图中取一页，返回 (本页条目, 下一页游标或 None)。
+    游标记录偏移量和上一页最后一个条目的名称：如果两页之间目录有增删，
+    就按名称重新定位，避免重复或漏掉条目。
+    """
+    start = 0
+    if cursor:
+        offset, last_name, cursor_signature = decode_cursor(cursor)
+        if cursor_signature != view_signature:
+            raise ValueError("cursor does not match the requested sort/filter")
+        start = offset
+        if start > len(view) or (start and view[start - 1]['name'] != last_name):
+            start = next((i + 1 for i, item in enumerate(view) if item['name'] == last_name), min(start, len(view)))
+    page = view[start:start + limit]
+    end = start + len(page)
+    next_cursor = encode_cursor(end, page[-1]['name'], view_signature) if page and end < len(view) else None
+    return page, next_cursor
@@ -0,0 +1,179 @@
+# /home/pi/my_cloud_app/blueprints/listing_cache.py
+"""
+目录列表的进程内 LRU 缓存（每个 gunicorn worker 一份）。
+
+缓存以 (用户名, 目录绝对路径) 为槽位，槽位里保存生成该列表时的校验元组
+(目录 st_mtime_ns, 隐藏文件库版本, 分享库版本, 文件变化代号, ...)。命中时只需对目录做一次 stat
+(版本和代号都是 mmap 中的整数读取) 并比较校验元组；任一分量变化即视为失效并重新扫描。
+
+注意：目录 mtime 只反映直接子项的增删改名，文件内容原地修改不会改变它。
+因此上传、删除、新建文件夹、分享等路由仍需调用 invalidate_*：除了清掉本 worker 的条目，
+还会把被修改路径所属用户的文件变化代号加一 (files_generation，按用户名散列分桶，见 state_snapshot)，
+其他 worker 里只有这个用户（及同桶用户）的缓存随之失效。
+站外 (Samba/rsync) 的修改由维护进程中的 fs_watcher 订阅回调以同样方式发布；
+订阅在 ensure_listing_cache 中完成（每个请求前调用，先于监视器启动），不依赖本进程是否处理过列表请求。
+"""
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+from flask import current_app
+
+from . import fs_watcher
+from .metadata_index import split_storage_path
+from .state_snapshot import get_files_generation_counters
+
+
+class ListingCache:
+    def __init__(self, app, max_listings=256, max_items=200000):
+        self._app = app  # fs_watcher 回调在监视线程中执行，没有应用上下文
+        self.max_listings = max_listings  # 最多缓存多少个目录列表
+        self.max_items = max_items  # 所有列表及其排序/过滤视图的条目总数上限
+        self._entries = OrderedDict()  # (username, dir_abs) -> [validators, items, {view_key: 排序/过滤后的视图}]
+        self._total_items = 0
+        self._lock = threading.Lock()
+
+    def get(self, username, dir_abs, validators):
+        key = (username, dir_abs)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None:
+                return None
+            if cached[0] != validators:
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return cached[1]
+
+    def put(self, username, dir_abs, validators, items):
+        if len(items) > self.max_items:
+            return  # 单个列表就超过上限，缓存它只会把其他条目全部挤掉
+        key = (username, dir_abs)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = [validators, items, {}]
+            self._total_items += len(items)
+            self._evict()
+
+    def get_view(self, username, dir_abs, validators, view_key):
+        """取出某个列表按 view_key(排序/过滤方式) 生成过的视图，视图随列表一起失效。"""
+        with self._lock:
+            cached = self._entries.get((username, dir_abs))
+            if cached is None or cached[0] != validators:
+                return None
+            return cached[2].get(view_key)
+
+    def put_view(self, username, dir_abs, validators, view_key, view):
+        """视图与列表一样计入 max_items，超出时按 LRU 淘汰整个目录（连同它的视图）。"""
+        key = (username, dir_abs)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None or cached[0] != validators or view_key in cached[2]:
+                return
+            if len(cached[1]) + sum(map(len, cached[2].values())) + len(view) > self.max_items:
+                return
+            cached[2][view_key] = view
+            self._total_items += len(view)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def invalidate_path(self, path_abs):
+        """使 path_abs 本身、其父目录以及其下所有子目录的缓存失效（任意用户），并通知其他 worker 中该路径所属用户的缓存。"""
+        self._drop_path(path_abs)
+        located = split_storage_path(path_abs)
+        if located is not None:
+            _publish_files_change([located[0]])
+
+    def invalidate_user(self, username):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == username]:
+                self._drop(key)
+        _publish_files_change([username])
+
+    def handle_fs_changes(self, events):
+        """
+        fs_watcher 订阅回调（只在维护进程中触发）：按变更的路径使缓存失效，每批对涉及的每个用户只发布一次代号。
+        内核丢事件时整体清空，并发布所有用户的代号。
+        """
+        with self._app.app_context():
+            if any(event.kind == 'overflow' for event in events):
+                self.clear()
+                _publish_files_change(current_app.config.get('USERS_DB', {}))
+                return
+            owners = set()
+            for path in {event.path for event in events}:
+                located = split_storage_path(path)
+                if located is None:
+                    continue  # 不在任何用户目录下（如 .uploads 中的分块），不影响列表
+                self._drop_path(path)
+                owners.add(located[0])
+            _publish_files_change(owners)
+
+    def _drop_path(self, path_abs):
+        path_abs = os.path.abspath(path_abs)
+        parent_abs = os.path.dirname(path_abs)
+        prefix = path_abs.rstrip(os.sep) + os.sep
+        with self._lock:
+            for key in [k for k in self._entries if k[1] in (path_abs, parent_abs) or k[1].startswith(prefix)]:
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_items = 0
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_listings or self._total_items > self.max_items):
+            oldest_key = next(iter(self._entries))
+            self._drop(oldest_key)
+
+    def _drop(self, key):
+        _, items, views = self._entries.pop(key)
+        self._total_items -= len(items) + sum(map(len, views.values()))
+
+
+_listing_cache = None
+_listing_cache_lock = threading.Lock()
+
+
+def ensure_listing_cache(app):
+    """
+    每个请求前调用（在 ensure_index_maintainer 之前）：创建本 worker 的 ListingCache 并订阅 fs_watcher。
+    这样无论哪个 worker 成为维护进程，监视器一启动，站外修改就会发布给所有 worker。
+    """
+    global _listing_cache
+    if _listing_cache is None:
+        with _listing_cache_lock:
+            if _listing_cache is None:
+                cache = ListingCache(
+                    app,
+                    max_listings=app.config.get('LISTING_CACHE_MAX_DIRS', 256),
+                    max_items=app.config.get('LISTING_CACHE_MAX_ITEMS', 200000),
+                )
+                fs_watcher.subscribe(cache.handle_fs_changes)  # Samba/rsync 等站外修改也能及时失效
+                _listing_cache = cache
+    return _listing_cache
+
+
+def get_listing_cache():
+    """返回本 worker 的 ListingCache，首次调用时按 app.config 创建。"""
+    return _listing_cache or ensure_listing_cache(current_app._get_current_object())
+
+
+def _files_generation_slot(username):
+    # 稳定的散列（内置 hash 对 str 按进程加盐，各 worker 会算出不同的桶）
+    return zlib.crc32(username.encode('utf-8')) % get_files_generation_counters().slot_count
+
+
+def files_generation(username):
+    """username 的文件在各 worker 间共享的变化代号，放进列表的校验值；只是一次 mmap 整数读取。"""
+    return get_files_generation_counters().read(_files_generation_slot(username))
+
+
+def _publish_files_change(usernames):
+    counters = get_files_generation_counters()
+    for slot in {_files_generation_slot(username) for username in usernames}:
+        counters.bump(slot)
+
@@ -0,0 +1,540 @@
+# /home/pi/my_cloud_app/blueprints/metadata_index.py
+"""
+所有用户主目录的持久化元数据索引（SQLite，位于 DATA_DIR 下）。
+
+每个文件/文件夹一行：所有者、相对主目录的路径、父路径、大小、mtime、inode、类别。
+目录行额外记录 scanned_mtime_ns —— 上次读取其子项时目录的 mtime，
+以及 tree_size / tree_files —— 整个子树中文件的总大小和文件数。后两者在每次写入条目时
+把增量加到所有上级目录上（与写入在同一事务中），定期对账时再整体重算一遍纠正偏差。
+
+增量重扫：目录 mtime 未变时不再读取它的子项列表（子项没有增删改名），
+只沿着索引中已知的子目录继续向下检查；mtime 变化的目录才重新 scandir 并与索引比对。
+注意文件内容原地修改不会改变目录 mtime，这类变化依赖 fs_watcher 事件或路由中的显式更新。
+
+同一时间只有一个进程（持有 DATA_DIR 下的锁文件）负责启动对账和消费 fs_watcher 事件，
+其他 gunicorn worker 只读索引，并在自己的上传/删除等路由中做点更新。
+"""
+import fcntl
+import os
+import queue
+import sqlite3
+import stat
+import threading
+import time
+
+from flask import current_app
+
+from . import fs_watcher
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    rel_path TEXT NOT NULL,
+    parent TEXT,
+    name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    inode INTEGER,
+    category TEXT,
+    scanned_mtime_ns INTEGER,
+    tree_size INTEGER NOT NULL DEFAULT 0,
+    tree_files INTEGER NOT NULL DEFAULT 0
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_entries_owner_path ON entries(owner, rel_path);
+CREATE INDEX IF NOT EXISTS idx_entries_owner_parent ON entries(owner, parent);
+-- 列表页只需要子文件夹的汇总值，部分索引让大目录里的文件行不参与扫描
+CREATE INDEX IF NOT EXISTS idx_entries_owner_parent_dirs ON entries(owner, parent) WHERE is_dir = 1;
+
+-- 文件名三元组倒排索引（供 search.py 做子串/模糊搜索），按所有者分区
+CREATE TABLE IF NOT EXISTS name_trigrams (
+    owner TEXT NOT NULL,
+    trigram TEXT NOT NULL,
+    entry_id INTEGER NOT NULL,
+    PRIMARY KEY (owner, trigram, entry_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_name_trigrams_entry ON name_trigrams(entry_id);
+CREATE TRIGGER IF NOT EXISTS entries_delete_trigrams AFTER DELETE ON entries BEGIN
+    DELETE FROM name_trigrams WHERE entry_id = old.id;
+END;
+"""
+
+# 名称两端的边界标记：让短名称也有三元组，并让模糊匹配对开头/结尾更敏感
+NAME_START, NAME_END = '\x02', '\x03'
+
+
+def name_trigrams(name, padded=True):
+    """
+    名称(小写)的三元组集合。padded=True 时包含边界标记，用于建索引和模糊匹配；
+    带扩展名时把主干(不含扩展名)的结尾也当作一个边界，这样 "holdiay" 也能找到 "holiday.jpg"。
+    """
+    text = name.lower()
+    if not padded:
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+    stem = os.path.splitext(text)[0]
+    text = NAME_START + text + NAME_END
+    grams = {text[i:i + 3] for i in range(len(text) - 2)}
+    if stem and stem != text[1:-1]:
+        grams.add((stem[-2:] if len(stem) >= 2 else NAME_START + stem) + NAME_END)
+    return grams
+
+
+def _parent_of(rel_path):
+    if rel_path == "":
+        return None  # 主目录本身
+    return rel_path.rsplit('/', 1)[0] if '/' in rel_path else ""
+
+
+def _ancestors_of(rel_path):
+    """rel_path 的所有上级目录（不含自身），由近及远，最后是主目录 ''。"""
+    ancestors = []
+    while rel_path:
+        rel_path = _parent_of(rel_path)
+        ancestors.append(rel_path)
+    return ancestors
+
+
+def _subtree_bounds(rel_path):
+    """rel_path 之下所有后代路径的范围 [prefix/, prefix0)，可以直接走 (owner, rel_path) 索引。"""
+    return (rel_path + '/', rel_path + '0') if rel_path else ('', '\U0010ffff')
+
+
+def _default_classify(name, is_dir):
+    from .files import get_display_file_type, get_file_category  # 延迟导入，避免循环依赖
+    return get_file_category(get_display_file_type(None, name, is_dir=is_dir))
+
+
+class MetadataIndex:
+    def __init__(self, db_path, logger):
+        self.db_path = db_path
+        self.logger = logger
+        self._local = threading.local()
+        with self._connect() as conn:
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(entries)")}
+            if columns and 'tree_size' not in columns:
+                # 旧版本建的库：补上汇总列，数值由下一次对账的 recompute_tree_totals 填好
+                conn.execute("ALTER TABLE entries ADD COLUMN tree_size INTEGER NOT NULL DEFAULT 0")
+                conn.execute("ALTER TABLE entries ADD COLUMN tree_files INTEGER NOT NULL DEFAULT 0")
+            conn.executescript(SCHEMA)
+        self.trigrams_ready = self._connect().execute("PRAGMA user_version").fetchone()[0] >= 1
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")  # 多个 worker 同时读，一个写
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # --- 查询 ---
+
+    def get_entry(self, owner, rel_path):
+        return self._connect().execute(
+            "SELECT * FROM entries WHERE owner=? AND rel_path=?", (owner, rel_path)).fetchone()
+
+    def list_children(self, owner, parent_rel):
+        return self._connect().execute(
+            "SELECT * FROM entries WHERE owner=? AND parent=? ORDER BY name COLLATE NOCASE", (owner, parent_rel)).fetchall()
+
+    def get_entries(self, owner, rel_paths):
+        """批量按路径查询，返回 {rel_path: 行}；不在索引中的路径不出现在结果里。"""
+        rel_paths = list(rel_paths)
+        rows = {}
+        for i in range(0, len(rel_paths), 500):  # 不超过 SQLite 的参数个数上限
+            chunk = rel_paths[i:i + 500]
+            for row in self._connect().execute(
+                    f"SELECT * FROM entries WHERE owner=? AND rel_path IN ({','.join('?' * len(chunk))})",
+                    (owner, *chunk)):
+                rows[row['rel_path']] = row
+        return rows
+
+    def has_entries(self, owner):
+        """owner 在索引中是否已有任何条目；走 (owner, rel_path) 唯一索引，找到第一行即返回，不统计总数。"""
+        return self._connect().execute(
+            "SELECT EXISTS(SELECT 1 FROM entries WHERE owner=? LIMIT 1)", (owner,)).fetchone()[0] == 1
+
+    def child_folder_totals(self, owner, parent_rel):
+        """parent_rel 下各子文件夹的 {名称: (子树总大小, 文件数)}。"""
+        return {row['name']: (row['tree_size'], row['tree_files']) for row in self._connect().execute(
+            "SELECT name, tree_size, tree_files FROM entries WHERE owner=? AND parent=? AND is_dir=1", (owner, parent_rel))}
+
+    def query(self, sql, params=()):
+        """只读查询，供 search 等模块在本线程的连接上执行自定义 SQL。"""
+        return self._connect().execute(sql, params).fetchall()
+
+    # --- 写入 ---
+
+    def _row_values(self, owner, rel_path, name, is_dir, item_stat, classify):
+        return (owner, rel_path, _parent_of(rel_path), name, int(is_dir),
+                item_stat.st_size if not is_dir else None, item_stat.st_mtime_ns, item_stat.st_ino,
+                classify(name, is_dir))
+
+    def _upsert(self, conn, values):
+        owner, rel_path, is_dir, size = values[0], values[1], values[4], values[5]
+        ancestors = _ancestors_of(rel_path)
+        if ancestors:
+            # 新值减去旧值(旧行是文件时)，加到所有上级目录的汇总上；子查询看到的是写入前的旧行
+            conn.execute(
+                "UPDATE entries SET "
+                "tree_size = tree_size + ? - COALESCE((SELECT size FROM entries WHERE owner=? AND rel_path=? AND is_dir=0), 0), "
+                "tree_files = tree_files + ? - (SELECT COUNT(*) FROM entries WHERE owner=? AND rel_path=? AND is_dir=0) "
+                f"WHERE owner=? AND rel_path IN ({','.join('?' * len(ancestors))})",
+                (0 if is_dir else size, owner, rel_path, 0 if is_dir else 1, owner, rel_path, owner, *ancestors))
+        conn.execute(
+            "INSERT INTO entries (owner, rel_path, parent, name, is_dir, size, mtime_ns, inode, category) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(owner, rel_path) DO UPDATE SET parent=excluded.parent, name=excluded.name, "
+            "is_dir=excluded.is_dir, size=excluded.size, mtime_ns=excluded.mtime_ns, inode=excluded.inode, "
+            "category=excluded.category, "
+            "scanned_mtime_ns=CASE WHEN excluded.is_dir THEN entries.scanned_mtime_ns ELSE NULL END",
+            values)
+
+    def _index_name(self, conn, owner, rel_path, name):
+        row = conn.execute("SELECT id FROM entries WHERE owner=? AND rel_path=?", (owner, rel_path)).fetchone()
+        if row is not None:
+            conn.executemany("INSERT OR IGNORE INTO name_trigrams (owner, trigram, entry_id) VALUES (?, ?, ?)",
+                             [(owner, gram, row['id']) for gram in name_trigrams(name)])
+
+    def backfill_trigrams(self):
+        """为三元组索引出现之前就已入库的条目补建三元组（只需执行一次）。"""
+        if self.trigrams_ready:
+            return
+        conn = self._connect()
+        started_at = time.monotonic()
+        batch = []
+        for row in conn.execute("SELECT id, owner, name FROM entries").fetchall():
+            batch.extend((row['owner'], gram, row['id']) for gram in name_trigrams(row['name']))
+            if len(batch) >= 50000:
+                with conn:
+                    conn.executemany("INSERT OR IGNORE INTO name_trigrams (owner, trigram, entry_id) VALUES (?, ?, ?)", batch)
+                batch = []
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO name_trigrams (owner, trigram, entry_id) VALUES (?, ?, ?)", batch)
+            conn.execute("PRAGMA user_version = 1")
+        self.trigrams_ready = True
+        self.logger.info(f"MetadataIndex: trigram backfill finished in {time.monotonic() - started_at:.1f}s.")
+
+    def _delete_subtree(self, conn, owner, rel_path):
+        ancestors = _ancestors_of(rel_path)
+        if ancestors:
+            conn.execute(
+                "UPDATE entries SET "
+                "tree_size = tree_size - COALESCE((SELECT CASE WHEN is_dir THEN tree_size ELSE size END "
+                "FROM entries WHERE owner=? AND rel_path=?), 0), "
+                "tree_files = tree_files - COALESCE((SELECT CASE WHEN is_dir THEN tree_files ELSE 1 END "
+                "FROM entries WHERE owner=? AND rel_path=?), 0) "
+                f"WHERE owner=? AND rel_path IN ({','.join('?' * len(ancestors))})",
+                (owner, rel_path, owner, rel_path, owner, *ancestors))
+        low, high = _subtree_bounds(rel_path)
+        conn.execute("DELETE FROM entries WHERE owner=? AND (rel_path=? OR (rel_path>=? AND rel_path<?))",
+                     (owner, rel_path, low, high))
+
+    def remove_path(self, owner, rel_path):
+        """路径（及其全部后代）已被删除。"""
+        conn = self._connect()
+        with conn:
+            self._delete_subtree(conn, owner, rel_path)
+
+    def upsert_path(self, owner, home_abs, rel_path, classify=None, recursive=False):
+        """
+        按磁盘现状更新单个路径；路径已不存在时从索引删除。
+        recursive=True 且路径是目录时，顺带重扫其整个子树（用于新建/移入的目录）。
+        """
+        classify = classify or _default_classify
+        abs_path = os.path.join(home_abs, rel_path) if rel_path else home_abs
+        try:
+            item_stat = os.stat(abs_path)
+        except OSError:
+            self.remove_path(owner, rel_path)
+            return
+        is_dir = stat.S_ISDIR(item_stat.st_mode)
+        name = rel_path.rsplit('/', 1)[-1] if rel_path else owner
+        conn = self._connect()
+        with conn:
+            if not is_dir:
+                self._delete_subtree(conn, owner, rel_path)  # 原来可能是同名目录
+            self._upsert(conn, self._row_values(owner, rel_path, name, is_dir, item_stat, classify))
+            self._index_name(conn, owner, rel_path, name)
+        if is_dir and recursive:
+            self.rescan_user(owner, home_abs, classify, start_rel=rel_path)
+
+    def recompute_tree_totals(self, owner):
+        """
+        由文件行从下往上重算 owner 所有目录的 tree_size / tree_files，只改写有偏差的行，返回改写行数。
+        整个过程在一个写事务里完成，期间路由的增量写入会等待，不会与重算结果交错。
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            stored = {row['rel_path']: (row['tree_size'], row['tree_files']) for row in conn.execute(
+                "SELECT rel_path, tree_size, tree_files FROM entries WHERE owner=? AND is_dir=1", (owner,))}
+            totals = {rel_path: [0, 0] for rel_path in stored}
+            for row in conn.execute("SELECT parent, SUM(size) AS s, COUNT(*) AS c FROM entries "
+                                    "WHERE owner=? AND is_dir=0 GROUP BY parent", (owner,)):
+                if row['parent'] in totals:
+                    totals[row['parent']][0] += row['s'] or 0
+                    totals[row['parent']][1] += row['c']
+            for dir_rel in sorted(totals, key=lambda p: p.count('/') + 1 if p else 0, reverse=True):
+                parent = _parent_of(dir_rel)
+                if parent is not None and parent in totals:
+                    totals[parent][0] += totals[dir_rel][0]
+                    totals[parent][1] += totals[dir_rel][1]
+            stale = [(size, files, owner, rel_path) for rel_path, (size, files) in totals.items()
+                     if stored[rel_path] != (size, files)]
+            conn.executemany("UPDATE entries SET tree_size=?, tree_files=? WHERE owner=? AND rel_path=?", stale)
+        return len(stale)
+
+    # --- 增量重扫 ---
+
+    def rescan_user(self, owner, home_abs, classify=None, start_rel=""):
+        """
+        增量重扫 owner 的主目录（或其中 start_rel 子树）。
+        返回统计 {'dirs_checked', 'dirs_read', 'upserted', 'removed'}。
+        """
+        classify = classify or _default_classify
+        conn = self._connect()
+        stats = {'dirs_checked': 0, 'dirs_read': 0, 'upserted': 0, 'removed': 0}
+
+        start_abs = os.path.join(home_abs, start_rel) if start_rel else home_abs
+        try:
+            start_stat = os.stat(start_abs)
+        except OSError:
+            self.remove_path(owner, start_rel)
+            return stats
+        if not stat.S_ISDIR(start_stat.st_mode):
+            self.upsert_path(owner, home_abs, start_rel, classify)
+            return stats
+        start_name = start_rel.rsplit('/', 1)[-1] if start_rel else owner
+        with conn:
+            self._upsert(conn, self._row_values(owner, start_rel, start_name, True, start_stat, classify))
+            self._index_name(conn, owner, start_rel, start_name)
+
+        pending = [(start_rel, start_abs)]
+        while pending:
+            dir_rel, dir_abs = pending.pop()
+            stats['dirs_checked'] += 1
+            try:
+                dir_mtime_ns = os.stat(dir_abs).st_mtime_ns
+            except OSError:
+                with conn:
+                    self._delete_subtree(conn, owner, dir_rel)
+                stats['removed'] += 1
+                continue
+
+            row = conn.execute("SELECT scanned_mtime_ns FROM entries WHERE owner=? AND rel_path=?",
+                               (owner, dir_rel)).fetchone()
+            if row is not None and row['scanned_mtime_ns'] == dir_mtime_ns:
+                # 子项列表没变：不读目录，只沿已知子目录继续向下
+                for child in conn.execute("SELECT rel_path FROM entries WHERE owner=? AND parent=? AND is_dir=1",
+                                          (owner, dir_rel)):
+                    pending.append((child['rel_path'], os.path.join(home_abs, child['rel_path'])))
+                continue
+
+            stats['dirs_read'] += 1
+            try:
+                with os.scandir(dir_abs) as it:
+                    children = list(it)
+            except OSError as e:
+                self.logger.warning(f"MetadataIndex: cannot read {dir_abs}: {e}")
+                continue
+
+            known = {r['name']: r for r in conn.execute(
+                "SELECT name, is_dir, size, mtime_ns, inode FROM entries WHERE owner=? AND parent=?", (owner, dir_rel))}
+            with conn:
+                for entry in children:
+                    child_rel = f"{dir_rel}/{entry.name}" if dir_rel else entry.name
+                    try:
+                        is_dir = entry.is_dir()
+                        child_stat = entry.stat()
+                    except OSError:
+                        continue
+                    old = known.pop(entry.name, None)
+                    if old is None or old['is_dir'] != int(is_dir) or old['mtime_ns'] != child_stat.st_mtime_ns \
+                            or old['inode'] != child_stat.st_ino or (not is_dir and old['size'] != child_stat.st_size):
+                        replaced = old is not None and old['is_dir'] and not is_dir
+                        if replaced:
+                            self._delete_subtree(conn, owner, child_rel)
+                        self._upsert(conn, self._row_values(owner, child_rel, entry.name, is_dir, child_stat, classify))
+                        if old is None or replaced:
+                            self._index_name(conn, owner, child_rel, entry.name)
+                        stats['upserted'] += 1
+                    if is_dir and not entry.is_symlink():
+                        pending.append((child_rel, entry.path))
+                for vanished_name in known:
+                    self._delete_subtree(conn, owner, f"{dir_rel}/{vanished_name}" if dir_rel else vanished_name)
+                    stats['removed'] += 1
+                conn.execute("UPDATE entries SET scanned_mtime_ns=? WHERE owner=? AND rel_path=?",
+                             (dir_mtime_ns, owner, dir_rel))
+        return stats
+
+
+# --- 单例与后台维护 ---
+
+_metadata_index = None
+_metadata_index_lock = threading.Lock()
+
+
+def get_metadata_index():
+    """返回本进程的 MetadataIndex（按 app.config 中的 METADATA_INDEX_PATH 打开）。"""
+    global _metadata_index
+    if _metadata_index is None:
+        with _metadata_index_lock:
+            if _metadata_index is None:
+                _metadata_index = MetadataIndex(current_app.config['METADATA_INDEX_PATH'], current_app.logger)
+    return _metadata_index
+
+
+def split_storage_path(abs_path):
+    """USER_FILES_BASE_DIR 下的绝对路径 -> (所有者, 相对主目录路径)；不属于任何用户主目录时返回 None。"""
+    base_abs = os.path.abspath(current_app.config['USER_FILES_BASE_DIR'])
+    rel = os.path.relpath(os.path.abspath(abs_path), base_abs).replace("\\", "/")
+    if rel == "." or rel.startswith(".."):
+        return None
+    owner, _, rel_path = rel.partition('/')
+    if owner not in current_app.config.get('USERS_DB', {}):
+        return None
+    return owner, rel_path
+
+
+def user_home_abs(owner):
+    return os.path.abspath(os.path.join(current_app.config['USER_FILES_BASE_DIR'], owner))
+
+
+def note_path_changed(abs_path, recursive=False):
+    """供路由调用：上传、新建文件夹等操作后立即更新索引中的对应条目。"""
+    located = split_storage_path(abs_path)
+    if located is None:
+        return
+    owner, rel_path = located
+    try:
+        get_metadata_index().upsert_path(owner, user_home_abs(owner), rel_path, recursive=recursive)
+    except sqlite3.Error as e:
+        current_app.logger.error(f"MetadataIndex: failed to record change of {abs_path}: {e}")
+
+
+def note_path_removed(abs_path):
+    """供路由调用：删除文件/文件夹后立即从索引移除。"""
+    located = split_storage_path(abs_path)
+    if located is None:
+        return
+    owner, rel_path = located
+    try:
+        get_metadata_index().remove_path(owner, rel_path)
+    except sqlite3.Error as e:
+        current_app.logger.error(f"MetadataIndex: failed to record removal of {abs_path}: {e}")
+
+
+class _IndexMaintainer:
+    """持有锁文件的进程里运行：启动时全量增量对账，之后消费 fs_watcher 事件并定期对账。"""
+
+    def __init__(self, app, lock_file):
+        self.app = app
+        self.lock_file = lock_file
+        self.pid = os.getpid()
+        self.events = queue.Queue()
+        self.reconciled = threading.Event()  # 首次对账完成后置位，供 content_index 等依赖索引的后台任务等待
+        self.thread = threading.Thread(target=self._run, name='metadata-index', daemon=True)
+
+    def on_fs_changes(self, events):
+        self.events.put(events)  # 在监视线程中只入队，写库放到维护线程
+
+    def _reconcile_all(self):
+        index = get_metadata_index()
+        index.backfill_trigrams()
+        started_at = time.monotonic()
+        for owner in self.app.config.get('USERS_DB', {}):
+            home_abs = user_home_abs(owner)
+            if os.path.isdir(home_abs):
+                stats = index.rescan_user(owner, home_abs)
+                stats['totals_fixed'] = index.recompute_tree_totals(owner)
+                self.app.logger.info(f"MetadataIndex: reconciled '{owner}': {stats}")
+        self.app.logger.info(f"MetadataIndex: reconciliation finished in {time.monotonic() - started_at:.1f}s.")
+        self.reconciled.set()
+
+    def _apply(self, events):
+        index = get_metadata_index()
+        for event in events:
+            if event.kind == 'overflow':
+                self._reconcile_all()
+                return
+            located = split_storage_path(event.path)
+            if located is None:
+                continue
+            owner, rel_path = located
+            home_abs = user_home_abs(owner)
+            if event.kind in ('deleted', 'moved_from'):
+                index.remove_path(owner, rel_path)
+            elif event.kind == 'rescan':
+                index.rescan_user(owner, home_abs, start_rel=rel_path)
+            else:
+                index.upsert_path(owner, home_abs, rel_path, recursive=(event.is_dir and event.kind == 'moved_to'))
+
+    def _run(self):
+        interval = self.app.config.get('METADATA_INDEX_RECONCILE_INTERVAL', 6 * 3600)
+        with self.app.app_context():
+            try:
+                self._reconcile_all()
+            except Exception as e:
+                self.app.logger.error(f"MetadataIndex: startup reconciliation failed: {e}", exc_info=True)
+                self.reconciled.set()  # 不让等待者永远阻塞；之后的定期对账会补齐
+            next_reconcile = time.monotonic() + interval
+            while True:
+                timeout = max(1.0, next_reconcile - time.monotonic())
+                try:
+                    events = self.events.get(timeout=timeout)
+                except queue.Empty:
+                    events = None
+                try:
+                    if events is not None:
+                        self._apply(events)
+                    if time.monotonic() >= next_reconcile:
+                        self._reconcile_all()
+                        next_reconcile = time.monotonic() + interval
+                except Exception as e:
+                    self.app.logger.error(f"MetadataIndex: maintenance error: {e}", exc_info=True)
+
+
+_maintainer = None
+_maintainer_next_attempt = 0.0
+
+
+def is_index_maintainer():
+    """本进程是否持有维护锁（只有维护进程才运行写索引的后台任务）。"""
+    return _maintainer is not None and _maintainer.pid == os.getpid()
+
+
+def wait_for_reconciliation(timeout=None):
+    """在维护进程中阻塞到首次对账完成；返回是否已完成。"""
+    return is_index_maintainer() and _maintainer.reconciled.wait(timeout)
+
+
+def ensure_index_maintainer(app):
+    """
+    每个请求前调用：尝试(非阻塞)获取维护锁，拿到锁的进程启动维护线程。
+    没拿到锁的 worker 每分钟重试一次，以便在原维护进程退出后接手。
+    """
+    global _maintainer, _maintainer_next_attempt
+    if not app.config.get('METADATA_INDEX_ENABLED', True):
+        return
+    if _maintainer is not None and _maintainer.pid == os.getpid():
+        return
+    now = time.monotonic()
+    if now < _maintainer_next_attempt:
+        return
+    _maintainer_next_attempt = now + 60
+    lock_file = open(app.config['METADATA_INDEX_PATH'] + '.lock', 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return
+    maintainer = _IndexMaintainer(app, lock_file)
+    fs_watcher.subscribe(maintainer.on_fs_changes)
+    fs_watcher.ensure_fs_watcher_started(app)  # 监视器只在维护进程中运行，见 fs_watcher 模块说明
+    maintainer.thread.start()
+    _maintainer = maintainer
+    app.logger.info(f"MetadataIndex: process {maintainer.pid} is now the index maintainer.")
@@ -0,0 +1,107 @@
+# /home/pi/my_cloud_app/blueprints/public_links.py
+"""
+公开链接：/s/<令牌>，不需要登录。
+
+链接由所有者在文件列表中创建（files.create_public_link_action），可以设置过期时间和下载次数上限；
+文件夹链接可以浏览并下载其下的任何内容 (/s/<令牌>/<子路径>)。
+
+这条路由是刻意做得很轻的匿名快速通道，一个链接被发到群里几十人同时打开时，每次下载只做：
+一次 mmap 代号比较 + 一次字典查找 (resolve_public_link 按分享代号缓存)、一次隐藏索引查找、一次 stat，
+然后由 send_file 直接流式发送文件（gunicorn 下走 sendfile）。不解析也不写回会话 cookie
+（见 PublicLinkSessionInterface），也不渲染模板；
+错误页面是纯文本，不经过 app 的 404/500 模板。只有设置了次数上限的链接才写一次数据库计数
+（这类链接的每个 GET 都计数，不支持 Range 续传）。
+"""
+import html
+import os
+import stat
+import time
+
+from flask import Blueprint, Response, request, send_file, url_for
+from flask.sessions import SecureCookieSessionInterface
+
+from .files import get_human_readable_size
+from .hidden_index import get_hidden_index
+from .listing import scan_directory
+from .share_store import get_share_store, resolve_public_link, split_share_path
+from .utils import get_absolute_path
+
+
+PUBLIC_LINK_PREFIX = '/s'
+
+public_bp = Blueprint('public', __name__)
+
+
+class PublicLinkSessionInterface(SecureCookieSessionInterface):
+    """公开链接的请求不需要会话：不校验会话 cookie 的签名，响应中也不会写回 Set-Cookie。"""
+
+    def open_session(self, app, request):
+        if request.path.startswith(PUBLIC_LINK_PREFIX + '/'):
+            return self.make_null_session(app)
+        return super().open_session(app, request)
+
+
+def _plain(message, status_code):
+    return Response(message + "\n", status=status_code, mimetype='text/plain')
+
+
+def _folder_page(token, link, dir_abs, rel_path, sub_parts):
+    """文件夹链接的目录页：直接拼出一个最简单的 HTML 列表，不走模板。"""
+    hidden_names = get_hidden_index().hidden_children(link['owner'], rel_path) or frozenset()
+    try:
+        entries = [entry for entry in scan_directory(dir_abs) if entry.name not in hidden_names]
+    except OSError:
+        return _plain("文件夹无法读取。", 404)
+    entries.sort(key=lambda entry: not entry.is_dir)  # 稳定排序：文件夹在前，各自仍按名称
+
+    title = html.escape('/'.join([os.path.basename(link['rel_path'])] + sub_parts))
+    rows = []
+    if sub_parts:
+        parent_url = url_for('.public_link', token=token, subpath='/'.join(sub_parts[:-1]))
+        rows.append(f'<li><a href="{html.escape(parent_url)}">../</a></li>')
+    for entry in entries:
+        entry_url = url_for('.public_link', token=token, subpath='/'.join(sub_parts + [entry.name]))
+        label = html.escape(entry.name) + ('/' if entry.is_dir else '')
+        size = '' if entry.is_dir else f' <small>({get_human_readable_size(entry.size)})</small>'
+        rows.append(f'<li><a href="{html.escape(entry_url)}">{label}</a>{size}</li>')
+    page = (f'<!doctype html><html><head><meta charset="utf-8"><meta name="viewport" content="width=device-width, initial-scale=1">'
+            f'<title>{title}</title></head><body><h3>{title}</h3><ul>{"".join(rows) or "<li>（空文件夹）</li>"}</ul></body></html>')
+    return Response(page, mimetype='text/html')
+
+
+@public_bp.route('/<token>', defaults={'subpath': ''})
+@public_bp.route('/<token>/<path:subpath>')
+def public_link(token, subpath):
+    link = resolve_public_link(token)
+    if link is None:
+        return _plain("链接不存在或已被撤销。", 404)
+    if link['expires_at'] is not None and time.time() >= link['expires_at']:
+        return _plain("链接已过期。", 410)
+
+    sub_parts = split_share_path(subpath)
+    if sub_parts is None or (sub_parts and not link['is_dir']):
+        return _plain("文件不存在。", 404)
+    owner = link['owner']
+    rel_path = '/'.join([link['rel_path']] + sub_parts)
+    target_abs = get_absolute_path(owner, rel_path)
+    # 被管理员隐藏的内容（或位于被隐藏的文件夹中）按不存在处理
+    if not target_abs or get_hidden_index().is_hidden(owner, rel_path):
+        return _plain("文件不存在。", 404)
+    try:
+        target_stat = os.stat(target_abs)
+    except OSError:
+        return _plain("文件不存在或已被所有者删除。", 404)
+
+    if stat.S_ISDIR(target_stat.st_mode):
+        if not link['is_dir']:
+            return _plain("文件不存在。", 404)
+        return _folder_page(token, link, target_abs, rel_path, sub_parts)
+
+    limited = link['max_downloads'] is not None
+    # 有次数上限的链接每个 GET 都计一次下载，并且忽略 Range / 条件请求、总是发送完整文件：
+    # 否则可以用不从 0 开始的 Range 请求分段取走文件而不计数。这类链接因此不支持断点续传。
+    # 计数是一条原子的条件 UPDATE，并发下载不会超出上限；不限次数的链接完全不写数据库。
+    if limited and request.method != 'HEAD' and not get_share_store().consume_public_download(token):
+        return _plain("此链接的下载次数已用完。", 410)
+    return send_file(target_abs, as_attachment=True, download_name=os.path.basename(target_abs),
+                     last_modified=target_stat.st_mtime, conditional=not limited)
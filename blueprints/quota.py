@@ -0,0 +1,68 @@
+# /home/pi/my_cloud_app/blueprints/quota.py
+"""
+用户存储配额。
+
+配额在 config.USERS_DB 中按用户配置 ('quota_bytes'，None 表示不限)，未配置时使用 DEFAULT_USER_QUOTA_BYTES。
+已用空间直接读取元数据索引中主目录那一行的 tree_size：上传/删除后 note_path_changed / note_path_removed
+在同一个写事务里更新各级目录的汇总，后台对账时 recompute_tree_totals 再按磁盘现状校正，
+所以这里只是一次主键查询，不需要遍历主目录。
+索引被禁用 (METADATA_INDEX_ENABLED) 或者维护进程还没有建好这个主目录时，用量记为未知 (None)，
+此时不限制上传（放行），绝不在请求线程里现场遍历主目录；不限配额的用户根本不查用量。
+
+上传在读取请求体之前按 Content-Length 检查（见 files.check_upload_quota），
+保存之后再按实际用量复核一次，兜住并发上传和没有 Content-Length 的请求。
+"""
+import sqlite3
+
+from flask import current_app
+
+from .metadata_index import get_metadata_index
+
+
+def get_user_quota(username):
+    """用户的配额字节数；None 表示不限。"""
+    user_data = current_app.config.get('USERS_DB', {}).get(username) or {}
+    if 'quota_bytes' in user_data:
+        return user_data['quota_bytes']
+    return current_app.config.get('DEFAULT_USER_QUOTA_BYTES')
+
+
+def get_user_usage(username):
+    """用户主目录当前占用的字节数（来自索引中的汇总，O(1)）；索引不可用或尚未建好该主目录时返回 None。"""
+    if not current_app.config.get('METADATA_INDEX_ENABLED', True):
+        return None
+    try:
+        row = get_metadata_index().get_entry(username, '')
+    except sqlite3.Error as e:
+        current_app.logger.error(f"Quota: could not read usage of '{username}' from index: {e}")
+        return None
+    return row['tree_size'] if row is not None else None
+
+
+def get_quota_status(username):
+    """
+    {'quota': 字节数或 None, 'used': 字节数或 None, 'remaining': 字节数或 None}
+    不限配额时不查询用量 (used 为 None)；用量未知时 remaining 为 None，调用方据此不做限制。
+    """
+    quota = get_user_quota(username)
+    used = None if quota is None else get_user_usage(username)
+    remaining = None if quota is None or used is None else max(0, quota - used)
+    return {'quota': quota, 'used': used, 'remaining': remaining}
+
+
+def is_over_quota(status):
+    """保存之后复核用：用量已知且超出配额时返回 True。"""
+    return status['quota'] is not None and status['used'] is not None and status['used'] > status['quota']
+
+
+def upload_exceeds_quota(username, content_length):
+    """
+    按请求的 Content-Length 判断上传是否会超出配额；返回 (是否超出, 配额状态)。
+    Content-Length 包含 multipart 的边界和其他表单字段，允许 QUOTA_UPLOAD_OVERHEAD_BYTES 的余量。
+    """
+    status = get_quota_status(username)
+    if status['remaining'] is None or content_length is None:
+        return False, status
+    overhead = current_app.config.get('QUOTA_UPLOAD_OVERHEAD_BYTES', 64 * 1024)
+    return content_length > status['remaining'] + overhead, status
+
@@ -0,0 +1,138 @@
+# /home/pi/my_cloud_app/blueprints/search.py
+"""
+文件名搜索：基于 metadata_index 中的三元组倒排表 (name_trigrams)。
+
+- 子串搜索：取查询串中最稀有的几个三元组求交集得到候选，再逐个校验是否真的包含查询串。
+- 模糊搜索：子串结果不足时，按共享三元组数量(Dice 系数)给候选打分，容忍拼写错误。
+- 少于 3 个字符的查询没有三元组可用，退化为在该用户的条目中逐行匹配。
+"""
+import math
+import os
+import time
+
+from .metadata_index import get_metadata_index, name_trigrams
+
+
+FUZZY_MIN_SCORE = 0.35
+FUZZY_WHEN_FEWER_THAN = 5  # 子串结果少于这么多条时才补充模糊匹配
+
+
+def _dice(query_grams, name):
+    # 同时和完整名称、去掉扩展名的主干比较，取较高者：用户搜索时通常不输入扩展名
+    best = 0.0
+    for text in {name, os.path.splitext(name)[0]}:
+        grams = name_trigrams(text)
+        if grams:
+            best = max(best, 2.0 * len(query_grams & grams) / (len(query_grams) + len(grams)))
+    return best
+
+
+def match_name(query, name):
+    """
+    对单个名称打分（用于不在索引里的条目，例如别人分享给我的文件）。
+    返回 (类别, 分数)；不匹配时返回 None。类别为 'substring' 或 'fuzzy'。
+    """
+    query_lower = query.lower()
+    name_lower = name.lower()
+    if query_lower in name_lower:
+        return 'substring', _substring_score(query_lower, name_lower)
+    if len(query_lower) >= 3:
+        score = _dice(name_trigrams(query_lower), name)
+        if score >= FUZZY_MIN_SCORE:
+            return 'fuzzy', score
+    return None
+
+
+def _substring_score(query_lower, name_lower):
+    # 完全相同 > 前缀 > 其他位置；同级里名称越短越靠前
+    if name_lower == query_lower:
+        rank = 3.0
+    elif name_lower.startswith(query_lower):
+        rank = 2.0
+    else:
+        rank = 1.0
+    return rank + len(query_lower) / len(name_lower)
+
+
+def _result(row, match, score):
+    return {
+        'owner': row['owner'],
+        'rel_path': row['rel_path'],
+        'name': row['name'],
+        'is_dir': bool(row['is_dir']),
+        'size': row['size'],
+        'mtime_ns': row['mtime_ns'],
+        'category': row['category'],
+        'match': match,
+        'score': score,
+    }
+
+
+def search_user_files(owner, query, limit=50, is_hidden=None, max_candidates=20000, fuzzy_max_postings=50000):
+    """
+    在 owner 的主目录中按文件名搜索，返回 (结果列表, 统计信息)。
+    is_hidden(rel_path) 返回 True 的条目（含被隐藏文件夹下的内容）不会出现在结果中。
+    """
+    index = get_metadata_index()
+    started_at = time.monotonic()
+    query_lower = query.strip().lower()
+    stats = {'candidates': 0, 'truncated': False}
+    if not query_lower:
+        return [], stats
+
+    results = {}
+    substring_grams = name_trigrams(query_lower, padded=False)
+    if not substring_grams:
+        rows = index.query(
+            "SELECT * FROM entries WHERE owner=? AND rel_path != '' AND instr(lower(name), ?) > 0 LIMIT ?",
+            (owner, query_lower, max_candidates + 1))
+    else:
+        gram_counts = sorted(
+            (index.query("SELECT COUNT(*) AS c FROM name_trigrams WHERE owner=? AND trigram=?", (owner, gram))[0]['c'], gram)
+            for gram in substring_grams)
+        if gram_counts[0][0] == 0:
+            rows = []  # 有一个三元组从未出现过，不可能有子串匹配
+        else:
+            rarest = [gram for _, gram in gram_counts[:3]]
+            intersect_sql = " INTERSECT ".join(
+                ["SELECT entry_id FROM name_trigrams WHERE owner=? AND trigram=?"] * len(rarest))
+            params = [p for gram in rarest for p in (owner, gram)]
+            rows = index.query(
+                f"SELECT e.* FROM entries e WHERE e.id IN ({intersect_sql}) LIMIT ?",
+                (*params, max_candidates + 1))
+
+    if len(rows) > max_candidates:
+        stats['truncated'] = True
+        rows = rows[:max_candidates]
+    stats['candidates'] += len(rows)
+    for row in rows:
+        if not row['rel_path']:
+            continue  # 主目录本身
+        name_lower = row['name'].lower()
+        if query_lower in name_lower and not (is_hidden and is_hidden(row['rel_path'])):
+            results[row['id']] = _result(row, 'substring', _substring_score(query_lower, name_lower))
+
+    if len(results) < min(limit, FUZZY_WHEN_FEWER_THAN) and len(query_lower) >= 3:
+        query_grams = name_trigrams(query_lower)
+        usable = [gram for gram in query_grams if index.query(
+            "SELECT COUNT(*) AS c FROM name_trigrams WHERE owner=? AND trigram=?", (owner, gram))[0]['c'] <= fuzzy_max_postings]
+        if usable:
+            min_shared = max(1, math.ceil(len(query_grams) * FUZZY_MIN_SCORE / 2))
+            placeholders = ",".join("?" * len(usable))
+            candidates = index.query(
+                f"SELECT e.*, c.shared FROM (SELECT entry_id, COUNT(*) AS shared FROM name_trigrams "
+                f"WHERE owner=? AND trigram IN ({placeholders}) GROUP BY entry_id HAVING shared >= ? "
+                f"ORDER BY shared DESC LIMIT ?) c JOIN entries e ON e.id = c.entry_id",
+                (owner, *usable, min_shared, limit * 10))
+            stats['candidates'] += len(candidates)
+            for row in candidates:
+                if row['id'] in results or not row['rel_path']:
+                    continue
+                score = _dice(query_grams, row['name'])
+                if score >= FUZZY_MIN_SCORE and not (is_hidden and is_hidden(row['rel_path'])):
+                    results[row['id']] = _result(row, 'fuzzy', score)
+
+    # 子串匹配总是排在模糊匹配前面
+    ordered = sorted(results.values(), key=lambda r: (r['match'] != 'substring', -r['score'], r['rel_path']))
+    stats['took_ms'] = round((time.monotonic() - started_at) * 1000, 1)
+    return ordered[:limit], stats
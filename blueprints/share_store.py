@@ -0,0 +1,492 @@
+# /home/pi/my_cloud_app/blueprints/share_store.py
+"""
+文件分享记录（SQLite，位于 DATA_DIR 下），取代原来的 shares.json。
+
+shares 表每个被分享的条目一行，按 (owner, rel_path) 唯一索引，另有 (owner, parent) 索引供列表页
+只取当前目录下的分享；share_recipients 表每个 (分享, 接收者) 一行，按接收者建索引，
+"分享给我的" 不再需要遍历所有人的分享。每次分享/取消分享都是一个小事务里的几次点写，
+WAL 模式下多个 gunicorn worker 可以同时读、依次写，不会互相覆盖。
+
+同一 worker 中并发到达的写操作由 data_store.GroupCommitter 合并成一个事务 (每个操作一个 SAVEPOINT，
+单个操作失败不影响同批其他操作)，成批分享时只有一次提交。
+
+meta 表中的 generation 在每个写事务里加一；提交后再把 state_snapshot 中 SLOT_SHARES 槽位的代号加一，
+其他 worker 的列表 ETag / 缓存比较这个 mmap 中的整数即可判断分享是否变化，不需要查询数据库。
+
+文件夹也可以分享 (is_dir = 1)：接收者可以浏览、下载该文件夹下的任何内容，而不需要为其中每个文件各建一条记录。
+所有文件夹分享在每个进程内编译成 FolderShareIndex 前缀树（按所有者、路径分量组织），分享代号变化时重建；
+判断某个路径是否落在分享给请求者的文件夹下只需沿树走 depth 步，取最长匹配的上级（longest_share）。
+
+下载/预览/浏览 shared/<所有者>/<路径> 时的权限判断由 check_share_access 完成：先查精确的分享记录，
+再查文件夹分享前缀树。结果按 (请求者, 所有者, 路径) 缓存在进程内，分享代号变化时整体失效；
+稳定状态下一次判断只是一次 mmap 整数比较和一次字典查找。
+
+public_links 表保存公开链接：随机令牌 -> (所有者, 路径, 是否文件夹, 过期时间, 下载次数上限)。
+创建/撤销链接和分享一样经组提交并使代号加一，resolve_public_link 的结果因此也可以按代号缓存；
+下载计数只在设置了次数上限时才写，是一条不经组提交、不改代号的条件 UPDATE（见 consume_public_download），
+多个 worker 同时下载也不会超出上限。
+
+首次打开时如果库是空的而旧的 shares.json 存在，就把它导入（在写事务内检查，多个 worker 只会导入一次），
+导入后原文件改名为 shares.json.migrated 留作备份。
+"""
+import json
+import os
+import secrets
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import current_app
+
+from .data_store import GroupCommitter
+from .state_snapshot import SLOT_SHARES, get_generation_counters
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shares (
+    id INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    rel_path TEXT NOT NULL,
+    parent TEXT NOT NULL,
+    display_name TEXT NOT NULL,
+    shared_on TEXT,
+    last_modified_share TEXT,
+    is_dir INTEGER NOT NULL DEFAULT 0
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_shares_owner_path ON shares(owner, rel_path);
+CREATE INDEX IF NOT EXISTS idx_shares_owner_parent ON shares(owner, parent);
+CREATE INDEX IF NOT EXISTS idx_shares_folders ON shares(owner) WHERE is_dir = 1;
+
+CREATE TABLE IF NOT EXISTS share_recipients (
+    share_id INTEGER NOT NULL REFERENCES shares(id) ON DELETE CASCADE,
+    recipient TEXT NOT NULL,
+    PRIMARY KEY (share_id, recipient)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_share_recipients_recipient ON share_recipients(recipient);
+
+CREATE TABLE IF NOT EXISTS public_links (
+    token TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    rel_path TEXT NOT NULL,
+    is_dir INTEGER NOT NULL DEFAULT 0,
+    created_on TEXT,
+    expires_at REAL,
+    max_downloads INTEGER,
+    download_count INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_public_links_owner_path ON public_links(owner, rel_path);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0);
+"""
+
+
+_SHARE = None  # 前缀树节点中存放 "以此路径为根的文件夹分享" 的键；路径分量都是非空字符串，不会与之冲突
+
+
+def split_share_path(rel_path):
+    """相对主目录的路径 -> 路径分量列表；含 '..' 时返回 None（不能借文件夹分享访问分享范围以外的内容）。"""
+    parts = [part for part in (rel_path or '').replace("\\", "/").split('/') if part and part != '.']
+    return None if '..' in parts else parts
+
+
+def _parent_of(rel_path):
+    return rel_path.rsplit('/', 1)[0] if '/' in rel_path else ""
+
+
+def _utcnow():
+    return datetime.utcnow().isoformat()
+
+
+class ShareStore:
+    def __init__(self, db_path, logger, group_commit_seconds=0.0):
+        self.db_path = db_path
+        self.logger = logger
+        self._local = threading.local()
+        self._committer = GroupCommitter(self._commit_batch, group_commit_seconds)
+        with self._connect() as conn:
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(shares)")}
+            if columns and 'is_dir' not in columns:
+                # 旧版本建的库里只有文件分享
+                conn.execute("ALTER TABLE shares ADD COLUMN is_dir INTEGER NOT NULL DEFAULT 0")
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")  # 多个 worker 同时读，一个写
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, func):
+        """在写事务中执行 func(conn) 并返回其结果；并发的写操作经组提交合并到同一个事务。"""
+        return self._committer.submit(func)
+
+    def _commit_batch(self, funcs):
+        """在一个 BEGIN IMMEDIATE 事务中依次执行 funcs，并把 generation 加一；返回每个操作的 (结果, 异常)。"""
+        conn = self._connect()
+        outcomes = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for func in funcs:
+                conn.execute("SAVEPOINT share_op")
+                try:
+                    outcomes.append((func(conn), None))
+                except sqlite3.Error as e:
+                    conn.execute("ROLLBACK TO share_op")
+                    outcomes.append((None, e))
+                conn.execute("RELEASE share_op")
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        get_generation_counters().bump(SLOT_SHARES)
+        return outcomes
+
+    # --- 查询 ---
+
+    def generation(self):
+        return self._connect().execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+
+    def _rows_to_infos(self, rows):
+        """(shares 行 + 以 \\x1f 分隔的接收者) -> {rel_path: 与旧 shares.json 相同结构的 share_info}"""
+        infos = {}
+        for row in rows:
+            infos[row['rel_path']] = {
+                'shared_with': sorted(row['recipients'].split('\x1f')) if row['recipients'] else [],
+                'display_name': row['display_name'],
+                'shared_on': row['shared_on'],
+                'last_modified_share': row['last_modified_share'],
+                'is_dir': bool(row['is_dir']),
+            }
+        return infos
+
+    _SELECT_WITH_RECIPIENTS = """
+        SELECT s.rel_path, s.display_name, s.shared_on, s.last_modified_share, s.is_dir,
+               (SELECT group_concat(recipient, char(31)) FROM share_recipients r WHERE r.share_id = s.id) AS recipients
+        FROM shares s
+    """
+
+    def get_share(self, owner, rel_path):
+        """某个条目的分享信息 {'shared_with', 'display_name', 'shared_on', 'last_modified_share', 'is_dir'}；未分享时返回 None。"""
+        rows = self._connect().execute(self._SELECT_WITH_RECIPIENTS + " WHERE s.owner = ? AND s.rel_path = ?",
+                                       (owner, rel_path)).fetchall()
+        return self._rows_to_infos(rows).get(rel_path)
+
+    def shares_in_dir(self, owner, dir_rel):
+        """owner 在 dir_rel 目录下直接分享出去的条目 {名称所在的相对路径: share_info}。"""
+        rows = self._connect().execute(self._SELECT_WITH_RECIPIENTS + " WHERE s.owner = ? AND s.parent = ?",
+                                       (owner, dir_rel)).fetchall()
+        return self._rows_to_infos(rows)
+
+    def shared_with(self, recipient):
+        """分享给 recipient 的所有条目 [(owner, rel_path, share_info)]，按所有者和路径排序。"""
+        rows = self._connect().execute("""
+            SELECT s.owner, s.rel_path, s.display_name, s.shared_on, s.last_modified_share, s.is_dir,
+                   (SELECT group_concat(recipient, char(31)) FROM share_recipients r2 WHERE r2.share_id = s.id) AS recipients
+            FROM share_recipients r JOIN shares s ON s.id = r.share_id
+            WHERE r.recipient = ?
+            ORDER BY s.owner, s.rel_path
+        """, (recipient,)).fetchall()
+        return [(row['owner'], row['rel_path'], self._rows_to_infos([row])[row['rel_path']]) for row in rows]
+
+    def folder_shares(self):
+        """所有文件夹分享 [(owner, rel_path, display_name, 接收者列表)]，供编译 FolderShareIndex。"""
+        rows = self._connect().execute("""
+            SELECT s.owner, s.rel_path, s.display_name,
+                   (SELECT group_concat(recipient, char(31)) FROM share_recipients r WHERE r.share_id = s.id) AS recipients
+            FROM shares s WHERE s.is_dir = 1
+        """).fetchall()
+        return [(row['owner'], row['rel_path'], row['display_name'],
+                 row['recipients'].split('\x1f') if row['recipients'] else []) for row in rows]
+
+    # --- 修改 ---
+
+    def add_recipient(self, owner, rel_path, recipient, display_name=None, is_dir=False):
+        """把 rel_path (is_dir 为真时是文件夹) 分享给 recipient；返回 (是否新增, share_info)。已分享过时不做修改。"""
+        def apply(conn):
+            now = _utcnow()
+            conn.execute("""
+                INSERT OR IGNORE INTO shares (owner, rel_path, parent, display_name, shared_on, is_dir)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (owner, rel_path, _parent_of(rel_path), display_name or os.path.basename(rel_path), now, int(bool(is_dir))))
+            share_id = conn.execute("SELECT id FROM shares WHERE owner = ? AND rel_path = ?",
+                                    (owner, rel_path)).fetchone()[0]
+            added = conn.execute("INSERT OR IGNORE INTO share_recipients (share_id, recipient) VALUES (?, ?)",
+                                 (share_id, recipient)).rowcount == 1
+            if added:
+                conn.execute("UPDATE shares SET last_modified_share = ? WHERE id = ?", (now, share_id))
+            return added
+
+        added = self._write(apply)
+        return added, self.get_share(owner, rel_path)
+
+    def remove_recipient(self, owner, rel_path, recipient):
+        """
+        取消 rel_path 对 recipient 的分享，没有接收者时删除整条分享记录。
+        返回 'removed'、'not_shared'（该用户本来就不在接收者中）或 'no_share'（条目没有分享记录）。
+        """
+        def apply(conn):
+            row = conn.execute("SELECT id FROM shares WHERE owner = ? AND rel_path = ?", (owner, rel_path)).fetchone()
+            if row is None:
+                return 'no_share'
+            if conn.execute("DELETE FROM share_recipients WHERE share_id = ? AND recipient = ?",
+                            (row['id'], recipient)).rowcount == 0:
+                return 'not_shared'
+            if conn.execute("SELECT 1 FROM share_recipients WHERE share_id = ? LIMIT 1", (row['id'],)).fetchone():
+                conn.execute("UPDATE shares SET last_modified_share = ? WHERE id = ?", (_utcnow(), row['id']))
+            else:
+                conn.execute("DELETE FROM shares WHERE id = ?", (row['id'],))
+            return 'removed'
+
+        return self._write(apply)
+
+    def remove_path(self, owner, rel_path):
+        """条目被删除时调用：删除它以及（文件夹时）其下所有条目的分享记录和公开链接，返回删除的分享条数。"""
+        def apply(conn):
+            conn.execute("""
+                DELETE FROM public_links WHERE owner = ? AND (rel_path = ? OR (rel_path >= ? AND rel_path < ?))
+            """, (owner, rel_path, rel_path + '/', rel_path + '0'))
+            return conn.execute("""
+                DELETE FROM shares WHERE owner = ? AND (rel_path = ? OR (rel_path >= ? AND rel_path < ?))
+            """, (owner, rel_path, rel_path + '/', rel_path + '0')).rowcount
+
+        return self._write(apply)
+
+    # --- 公开链接 ---
+
+    def create_public_link(self, owner, rel_path, is_dir=False, expires_at=None, max_downloads=None):
+        """为 rel_path 创建一个公开链接，返回其信息 (见 get_public_link)。expires_at 为 Unix 时间，None 表示不限。"""
+        token = secrets.token_urlsafe(16)  # 128 位随机数，不可猜测
+
+        def apply(conn):
+            conn.execute("""
+                INSERT INTO public_links (token, owner, rel_path, is_dir, created_on, expires_at, max_downloads)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (token, owner, rel_path, int(bool(is_dir)), _utcnow(), expires_at, max_downloads))
+
+        self._write(apply)
+        return self.get_public_link(token)
+
+    def revoke_public_link(self, owner, token):
+        """撤销 owner 的一个公开链接；链接不存在或不属于 owner 时返回 False。"""
+        def apply(conn):
+            return conn.execute("DELETE FROM public_links WHERE token = ? AND owner = ?", (token, owner)).rowcount == 1
+
+        return self._write(apply)
+
+    @staticmethod
+    def _link_to_info(row):
+        info = {key: row[key] for key in ('token', 'owner', 'rel_path', 'created_on', 'expires_at', 'max_downloads', 'download_count')}
+        info['is_dir'] = bool(row['is_dir'])
+        return info
+
+    def get_public_link(self, token):
+        """令牌对应的链接 {'token', 'owner', 'rel_path', 'is_dir', 'created_on', 'expires_at', 'max_downloads', 'download_count'}；不存在时返回 None。"""
+        row = self._connect().execute("SELECT * FROM public_links WHERE token = ?", (token,)).fetchone()
+        return self._link_to_info(row) if row else None
+
+    def public_links_for(self, owner, rel_path):
+        """owner 为 rel_path 创建的所有公开链接，按创建时间排序。"""
+        rows = self._connect().execute("SELECT * FROM public_links WHERE owner = ? AND rel_path = ? ORDER BY created_on",
+                                       (owner, rel_path)).fetchall()
+        return [self._link_to_info(row) for row in rows]
+
+    def consume_public_download(self, token):
+        """
+        有次数上限的链接被下载一次时调用：未达上限则计数加一并返回 True，否则返回 False。
+        单条条件 UPDATE 在 SQLite 中是原子的，并发下载不会超出上限；不经组提交，也不改分享代号（不影响各种缓存）。
+        """
+        return self._connect().execute("""
+            UPDATE public_links SET download_count = download_count + 1
+            WHERE token = ? AND (max_downloads IS NULL OR download_count < max_downloads)
+        """, (token,)).rowcount == 1
+
+    # --- 从 shares.json 迁移 ---
+
+    def migrate_from_json(self, json_path):
+        """库为空且 json_path 存在时导入旧的分享记录；返回导入的条目数（不需要导入时为 0）。"""
+        if not json_path or not os.path.isfile(json_path):
+            return 0
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                content = f.read().strip()
+            legacy = json.loads(content) if content else {}
+        except (OSError, ValueError) as e:
+            self.logger.error(f"ShareStore: could not read legacy shares DB {json_path}: {e}")
+            return 0
+
+        def apply(conn):
+            if conn.execute("SELECT 1 FROM shares LIMIT 1").fetchone():
+                return 0  # 其他 worker 已经导入过
+            imported = 0
+            for owner, owner_shares in (legacy if isinstance(legacy, dict) else {}).items():
+                for rel_path, info in (owner_shares if isinstance(owner_shares, dict) else {}).items():
+                    recipients = [r for r in info.get('shared_with', []) if isinstance(r, str)]
+                    if not recipients:
+                        continue
+                    cursor = conn.execute("""
+                        INSERT OR IGNORE INTO shares (owner, rel_path, parent, display_name, shared_on, last_modified_share)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    """, (owner, rel_path, _parent_of(rel_path), info.get('display_name') or os.path.basename(rel_path),
+                          info.get('shared_on'), info.get('last_modified_share')))
+                    if cursor.rowcount != 1:
+                        continue
+                    conn.executemany("INSERT OR IGNORE INTO share_recipients (share_id, recipient) VALUES (?, ?)",
+                                     [(cursor.lastrowid, r) for r in recipients])
+                    imported += 1
+            return imported
+
+        imported = self._write(apply)
+        try:
+            os.replace(json_path, json_path + '.migrated')
+        except FileNotFoundError:
+            pass  # 另一个 worker 刚刚改过名
+        except OSError as e:
+            self.logger.warning(f"ShareStore: could not rename legacy shares DB {json_path}: {e}")
+        if imported:
+            self.logger.info(f"ShareStore: imported {imported} shares from {json_path}.")
+        return imported
+
+
+_share_store = None
+_share_store_lock = threading.Lock()
+
+
+def get_share_store():
+    """返回本进程的 ShareStore（按 app.config 中的 SHARES_STORE_PATH 打开，首次打开时迁移 shares.json）。"""
+    global _share_store
+    if _share_store is None:
+        with _share_store_lock:
+            if _share_store is None:
+                store = ShareStore(current_app.config['SHARES_STORE_PATH'], current_app.logger,
+                                   current_app.config.get('DATA_STORE_GROUP_COMMIT_MS', 0) / 1000)
+                store.migrate_from_json(current_app.config.get('SHARES_DB_PATH'))
+                _share_store = store
+    return _share_store
+
+
+class FolderShareIndex:
+    """
+    某一代分享数据中所有文件夹分享编译出的只读前缀树 {所有者: 树}。树节点以路径分量为键，
+    文件夹分享的根节点在 _SHARE 键下存 (显示名称, 接收者集合)。generation 是编译时 SLOT_SHARES 槽位的值。
+    """
+
+    def __init__(self, folder_shares, generation):
+        self.generation = generation
+        self._tries = {}
+        for owner, rel_path, display_name, recipients in folder_shares:
+            parts = split_share_path(rel_path)
+            if not parts:
+                continue
+            node = self._tries.setdefault(owner, {})
+            for part in parts:
+                node = node.setdefault(part, {})
+            node[_SHARE] = (display_name, frozenset(recipients))
+
+    def longest_share(self, requester, owner, rel_path):
+        """
+        rel_path 自身或其最近的、分享给了 requester 的上级文件夹，返回 (分享根路径, 显示名称)；
+        没有这样的文件夹分享时返回 None。O(路径深度)。
+        """
+        node = self._tries.get(owner)
+        parts = split_share_path(rel_path)
+        if node is None or not parts:
+            return None
+        best = None
+        for depth, part in enumerate(parts, 1):
+            node = node.get(part)
+            if node is None:
+                break
+            share = node.get(_SHARE)
+            if share is not None and requester in share[1]:
+                best = ('/'.join(parts[:depth]), share[0])
+        return best
+
+
+_folder_index = None
+_folder_index_lock = threading.Lock()
+
+
+def get_folder_share_index():
+    """返回当前分享代号的 FolderShareIndex；代号未变时只是一次 mmap 整数比较。"""
+    global _folder_index
+    generation = get_generation_counters().read(SLOT_SHARES)
+    index = _folder_index
+    if index is not None and index.generation == generation:
+        return index
+    with _folder_index_lock:
+        if _folder_index is None or _folder_index.generation != generation:
+            # 先读代号再查询：查询期间又有提交的话，下次调用会看到更大的代号并重建
+            _folder_index = FolderShareIndex(get_share_store().folder_shares(), generation)
+        return _folder_index
+
+
+class _GenerationCache:
+    """进程内的 LRU 缓存，SLOT_SHARES 代号变化时整体失效（任何分享、链接的增删都会使代号加一）。"""
+
+    def __init__(self):
+        self._data = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        """返回 key 的缓存结果；没有时调用 compute() 计算。计算期间代号变了的话结果可能已过期，不写入缓存。"""
+        generation = get_generation_counters().read(SLOT_SHARES)
+        with self._lock:
+            if self._generation != generation:
+                self._data.clear()
+                self._generation = generation
+            elif key in self._data:
+                self._data.move_to_end(key)
+                return self._data[key]
+
+        result = compute()
+
+        with self._lock:
+            if self._generation == generation:
+                self._data[key] = result
+                if len(self._data) > current_app.config.get('SHARE_ACCESS_CACHE_SIZE', 4096):
+                    self._data.popitem(last=False)
+        return result
+
+
+_access_cache = _GenerationCache()  # (请求者, 所有者, 路径) -> (是否允许, 显示名称或 None, 分享根路径或 None)
+_public_link_cache = _GenerationCache()  # 令牌 -> 链接信息或 None
+
+
+def check_share_access(requester, owner, rel_path):
+    """
+    requester 能否访问 owner 分享出的 rel_path，返回 (是否允许, 显示名称或 None, 分享根路径或 None)。
+    rel_path 本身被分享时显示名称是分享记录中的名称、分享根路径就是它自己；
+    经由上级文件夹分享获得访问权时显示名称为 None (调用方用文件名)，分享根路径是最近的那个被分享的上级。
+    结果按 SLOT_SHARES 代号缓存：任何分享/取消分享/删除都会使代号加一，缓存随之整体失效。
+    """
+    def compute():
+        parts = split_share_path(rel_path)
+        share_info = get_share_store().get_share(owner, rel_path) if parts else None
+        if requester == owner:
+            return True, share_info['display_name'] if share_info else None, rel_path
+        if share_info is not None and requester in share_info['shared_with']:
+            return True, share_info['display_name'], rel_path
+        folder_share = get_folder_share_index().longest_share(requester, owner, rel_path) if parts else None
+        return (True, None, folder_share[0]) if folder_share else (False, None, None)
+
+    return _access_cache.get((requester, owner, rel_path), compute)
+
+
+def resolve_public_link(token):
+    """
+    令牌对应的公开链接信息 (见 ShareStore.get_public_link)，不存在时返回 None。按分享代号缓存，
+    同一链接被很多人同时打开时不重复查询；过期时间由调用方判断，下载计数不在缓存中 (见 consume_public_download)。
+    """
+    return _public_link_cache.get(token, lambda: get_share_store().get_public_link(token))
@@ -0,0 +1,118 @@
+# /home/pi/my_cloud_app/blueprints/state_snapshot.py
+"""
+跨 gunicorn worker 共享的状态代号 (generation) 和快照。
+
+DATA_DIR 下的 state_generations.bin 是一个很小的定长文件，每个槽位一个 64 位计数器，
+所有 worker 以 MAP_SHARED 方式 mmap 它：写入方修改数据后把对应槽位加一，
+其他 worker 在每个请求里读一次整数，与自己缓存时记下的值比较即可知道是否需要重新加载，
+不需要 stat 数据文件，更不需要解析 JSON。计数器在文件创建时以当前时间 (ns) 为初值，
+重启或删除文件后也不会回到旧值，可以直接放进 ETag。
+用户文件的变化另有一个按用户名散列分桶的计数器文件 (files_generations.bin，见 get_files_generation_counters)，
+某个用户的改动只会让同一个桶里的用户的缓存失效。
+
+需要整体重建的状态（隐藏文件）另外发布一份快照：按代号用 marshal 序列化，经 data_store.atomic_write 原子替换，
+然后才更新计数器；读者看到新代号时读到的一定是完整的新快照。
+"""
+import fcntl
+import marshal
+import mmap
+import os
+import struct
+import threading
+import time
+
+from flask import current_app
+
+from .data_store import atomic_write
+
+
+SLOT_HIDDEN_FILES = 0
+SLOT_SHARES = 1
+_SLOT_COUNT = 8  # 预留槽位，文件大小固定为 64 字节
+_SLOT = struct.Struct('<Q')
+
+
+class GenerationCounters:
+    """mmap 映射的一组计数器。flock 锁的是打开的文件描述，fork 之后必须在子进程里重新打开（见 get_generation_counters）。"""
+
+    def __init__(self, path, slot_count=_SLOT_COUNT):
+        self.path = path
+        self.pid = os.getpid()
+        self.slot_count = slot_count
+        file_size = slot_count * _SLOT.size
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            size = os.fstat(self._fd).st_size
+            if size < file_size:
+                # 只补齐缺少的槽位（例如调大了桶数），已有槽位的代号保持不变
+                seed = time.time_ns()
+                missing = (file_size - size) // _SLOT.size
+                os.pwrite(self._fd, b''.join(_SLOT.pack(seed) for _ in range(missing)), size - size % _SLOT.size)
+                os.fsync(self._fd)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, file_size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+
+    def read(self, slot):
+        """槽位当前的代号；只是一次内存读取。"""
+        return _SLOT.unpack_from(self._map, slot * _SLOT.size)[0]
+
+    def bump(self, slot, before_publish=None):
+        """
+        槽位加一并返回新代号。before_publish(新代号) 在持有锁、新值对其他进程可见之前调用，
+        用于先写好与新代号对应的快照。
+        """
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            generation = self.read(slot) + 1
+            if before_publish is not None:
+                before_publish(generation)
+            _SLOT.pack_into(self._map, slot * _SLOT.size, generation)
+            return generation
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+_counters = {}  # app.config 中的路径键 -> 本进程的 GenerationCounters
+_counters_lock = threading.Lock()
+
+
+def _open_counters(config_key, slot_count=_SLOT_COUNT):
+    counters = _counters.get(config_key)
+    if counters is not None and counters.pid == os.getpid():
+        return counters
+    with _counters_lock:
+        counters = _counters.get(config_key)
+        if counters is None or counters.pid != os.getpid():
+            counters = _counters[config_key] = GenerationCounters(current_app.config[config_key], slot_count)
+        return counters
+
+
+def get_generation_counters():
+    """返回本进程的 GenerationCounters（按 app.config 中的 STATE_GENERATIONS_PATH 打开）。"""
+    return _open_counters('STATE_GENERATIONS_PATH')
+
+
+def get_files_generation_counters():
+    """按用户散列分桶的文件变化计数器（FILES_GENERATIONS_PATH，FILES_GENERATION_BUCKETS 个槽位），见 listing_cache.files_generation。"""
+    return _open_counters('FILES_GENERATIONS_PATH', current_app.config.get('FILES_GENERATION_BUCKETS', 256))
+
+
+def write_snapshot(path, generation, payload):
+    """把 (generation, payload) 用 marshal 原子写入 path，读者不会看到写了一半的快照。"""
+    atomic_write(path, lambda f: marshal.dump((generation, payload), f), binary=True)
+
+
+def read_snapshot(path):
+    """读取快照，返回 (generation, payload)；文件不存在或已损坏时返回 (None, None)。"""
+    try:
+        with open(path, 'rb') as f:
+            generation, payload = marshal.load(f)
+        return generation, payload
+    except FileNotFoundError:
+        return None, None
+    except (OSError, EOFError, ValueError, TypeError) as e:
+        current_app.logger.warning(f"Could not read state snapshot {path}: {e}")
+        return None, None
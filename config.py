@@ -6,8 +6,14 @@ USER_FILES_BASE_DIR = '/mnt/mydisk/my_cloud_storage' # 确保这是你外部硬
 USER_FILES_ROOT = USER_FILES_BASE_DIR
 SECRET_KEY = 'your_very_secret_key_for_sessions_CHANGE_ME_PLEASE' # !!!务必修改!!!
 DATA_DIR = os.path.join(APP_ROOT, 'data')
-SHARES_DB_PATH = os.path.join(DATA_DIR, 'shares.json') # 用于文件分享
+SHARES_DB_PATH = os.path.join(DATA_DIR, 'shares.json') # 旧的文件分享记录，首次启动时导入 SHARES_STORE_PATH
+SHARES_STORE_PATH = os.path.join(DATA_DIR, 'shares.sqlite3') # 文件分享记录 (SQLite)
 HIDDEN_FILES_PATH = os.path.join(DATA_DIR, 'hidden_files.json') # 用于隐藏文件
+STATE_GENERATIONS_PATH = os.path.join(DATA_DIR, 'state_generations.bin') # 各 worker mmap 共享的状态代号 (见 state_snapshot)
+FILES_GENERATIONS_PATH = os.path.join(DATA_DIR, 'files_generations.bin') # 按用户分桶的文件变化代号，列表缓存据此跨 worker 失效
+FILES_GENERATION_BUCKETS = 256 # 分桶数；同一桶里的用户互相影响缓存命中，但不影响正确性
+METADATA_INDEX_PATH = os.path.join(DATA_DIR, 'metadata_index.sqlite3') # 所有用户文件的元数据索引
+CONTENT_INDEX_PATH = os.path.join(DATA_DIR, 'content_index.sqlite3') # 文本/代码文件的全文索引
 if not os.path.exists(DATA_DIR):
     try:
         os.makedirs(DATA_DIR)
@@ -17,11 +23,83 @@ if not os.path.exists(DATA_DIR):
 # 用户数据库 (示例，实际中你可能有更复杂的管理方式)
 USERS_DB = {
     'admin': {'password': 'admin_password', 'role': 'admin', 'home_dir': os.path.join(USER_FILES_BASE_DIR, 'admin')},
-    'user1': {'password': 'user1_password', 'role': 'user', 'home_dir': os.path.join(USER_FILES_BASE_DIR, 'user1')},
-    'user2': {'password': 'user2_password', 'role': 'user', 'home_dir': os.path.join(USER_FILES_BASE_DIR, 'user2')},
+    'user1': {'password': 'user1_password', 'role': 'user', 'home_dir': os.path.join(USER_FILES_BASE_DIR, 'user1'),
+              'quota_bytes': 50 * 1024**3},
+    'user2': {'password': 'user2_password', 'role': 'user', 'home_dir': os.path.join(USER_FILES_BASE_DIR, 'user2'),
+              'quota_bytes': 50 * 1024**3},
     # 添加更多用户...
 }
 
+# 存储配额：USERS_DB 中未设置 'quota_bytes' 的用户使用此默认值 (None 表示不限)。
+# 上传前按 Content-Length 检查，允许 multipart 边界等额外开销的余量
+DEFAULT_USER_QUOTA_BYTES = None
+QUOTA_UPLOAD_OVERHEAD_BYTES = 64 * 1024
+
+# 可续传的分块上传 (见 blueprints/chunked_upload.py)：暂存目录应与用户文件在同一文件系统上，完成时只需 rename；
+# 前端每个分块的字节数；未完成的会话多少秒没有新分块后被清理，以及维护进程检查清理的间隔(秒)
+CHUNKED_UPLOAD_DIR = os.path.join(USER_FILES_BASE_DIR, '.uploads')
+CHUNKED_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+CHUNKED_UPLOAD_EXPIRE_SECONDS = 24 * 3600
+CHUNKED_UPLOAD_GC_INTERVAL = 600
+
+# 目录列表缓存 (每个 worker 一份): 最多缓存的目录数，以及所有缓存列表的条目总数上限
+LISTING_CACHE_MAX_DIRS = 256
+LISTING_CACHE_MAX_ITEMS = 200000
+
+# 目录列表分页：HTML 首屏渲染条数，以及 /files/api/list 单页上限
+LISTING_PAGE_SIZE = 200
+LISTING_API_MAX_PAGE_SIZE = 1000
+
+# DATA_DIR 数据文件的组提交：同一 worker 中并发的小修改 (分享/隐藏设置) 等待该毫秒数后合并成一次写入；
+# 0 表示不额外等待，只合并上一次提交进行期间排队的修改
+DATA_STORE_GROUP_COMMIT_MS = 0
+
+# 共享文件访问权限判断的缓存条数 (每个 worker 一份，分享变化时整体失效)
+SHARE_ACCESS_CACHE_SIZE = 4096
+
+# 手工编辑 hidden_files.json 后最多这么多秒被发现 (正常修改通过 state_snapshot 的代号立即生效)
+HIDDEN_FILES_RECHECK_SECONDS = 5
+
+# 管理面板文件树：每次按文件夹加载的条数上限，以及一次请求最多向下展开的层数
+ADMIN_TREE_PAGE_SIZE = 500
+ADMIN_TREE_MAX_DEPTH = 8
+
+# 流式列表：目录文件本身(st_size)超过该字节数时自动按磁盘顺序边读边输出，0 表示只在 ?mode=stream 时启用
+LISTING_STREAM_DIR_BYTES = 1024 * 1024
+LISTING_STREAM_BUFFER_SIZE = 500  # 每次向客户端写出前累积的模板片段数 (约十几行)
+
+# 并行 stat：{挂载点: 线程数}，按最长前缀匹配；未匹配的路径使用默认值 (0 表示逐个 stat)。
+# 机械硬盘冷缓存时并发发出的 stat 可以由内核/硬盘排队合并寻道；SSD/SD 卡上通常不需要。
+# 效果可用 bench_parallel_stat.py 在实际硬盘上测量后再调整。
+PARALLEL_STAT_MOUNTS = {}  # 例如 {USER_FILES_BASE_DIR: 8}
+PARALLEL_STAT_DEFAULT_WORKERS = 0
+PARALLEL_STAT_BATCH_SIZE = 512   # 流式读取目录时每批并发 stat 的条目数
+PARALLEL_STAT_MIN_ENTRIES = 32   # 条目少于此数时逐个 stat，省去线程切换
+
+# 元数据索引：由一个 worker 在后台维护；除 inotify 事件外，每隔这么多秒再做一次增量对账
+METADATA_INDEX_ENABLED = True
+METADATA_INDEX_RECONCILE_INTERVAL = 6 * 3600
+
+# 文件名搜索 (/files/search)：默认/最大返回条数，以及单次查询最多校验的候选条目数
+SEARCH_RESULT_LIMIT = 100
+SEARCH_MAX_RESULT_LIMIT = 500
+SEARCH_MAX_CANDIDATES = 20000
+
+# 全文检索：后台建索引线程最多占用的 CPU 比例、单个文件最多读取的字节数、与元数据索引全量比对的间隔(秒)
+CONTENT_INDEX_ENABLED = True
+CONTENT_INDEX_CPU_SHARE = 0.25
+CONTENT_INDEX_MAX_FILE_BYTES = 4 * 1024 * 1024
+CONTENT_INDEX_SYNC_INTERVAL = 6 * 3600
+CONTENT_SEARCH_RESULT_LIMIT = 20
+
+# 文件类型识别：无扩展名的文件是否读取文件头(magic bytes)判断类型，以及识别结果缓存的条目数
+FILE_TYPE_SNIFF_EXTENSIONLESS = True
+FILE_TYPE_SNIFF_CACHE_SIZE = 20000
+
+# inotify 文件系统监视 (Linux，只在索引维护进程中运行，需要 METADATA_INDEX_ENABLED)：变更日志保留的事件条数
+FS_WATCHER_ENABLED = True
+FS_WATCHER_JOURNAL_SIZE = 20000
+
 # 隐藏文件配置的持久化路径
 print(f"DEBUG: config.py - SHARES_DB_PATH defined as: {SHARES_DB_PATH}")
 # 确保基础用户目录存在 (为所有在 USERS_DB 中的用户创建家目录)
@@ -0,0 +1,62 @@
+"""
+上传配额检查必须在读取请求体之前完成（见 files.check_upload_quota）。
+
+用法: python -m unittest tests.test_upload_quota   （在项目根目录执行，使用 config.py 中的配置）
+"""
+import io
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app  # noqa: E402
+from blueprints import quota  # noqa: E402
+
+
+class _UnreadableBody:
+    """wsgi.input：只要有人读取（解析表单、取 csrf_token 字段等）就让测试失败。"""
+
+    def read(self, *args):
+        raise AssertionError("request body was read before the quota check")
+
+    readline = read
+
+
+class UploadQuotaTest(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 'user1'
+            sess['username'] = 'user1'
+
+    def _post_upload(self, content_length):
+        return self.client.post(
+            '/files/upload?path=', headers={'Accept': 'application/json'},
+            content_type='multipart/form-data; boundary=x',
+            environ_overrides={'wsgi.input': _UnreadableBody(), 'CONTENT_LENGTH': str(content_length)})
+
+    def test_over_quota_upload_rejected_without_reading_body(self):
+        with mock.patch.dict(app.config['USERS_DB']['user1'], {'quota_bytes': 1024 * 1024}), \
+                mock.patch.object(quota, 'get_user_usage', return_value=0):
+            response = self._post_upload(10 * 1024 ** 3)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.get_json()['quota'], 1024 * 1024)
+
+    def test_csrf_still_checked_within_quota(self):
+        # 配额以内时照常校验 CSRF（这次可以读取请求体）：缺少 token 的上传被拒绝，文件不会保存
+        filename = 'csrf_probe_upload.txt'
+        target = os.path.join(app.config['USER_FILES_BASE_DIR'], 'user1', filename)
+        with mock.patch.dict(app.config, {'WTF_CSRF_ENABLED': True}), \
+                mock.patch.dict(app.config['USERS_DB']['user1'], {'quota_bytes': None}):
+            response = self.client.post('/files/upload?path=', data={'file_to_upload': (io.BytesIO(b'x'), filename)},
+                                        content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(os.path.exists(target))
+        with self.client.session_transaction() as sess:
+            self.assertIn('CSRF', ' '.join(message for _, message in sess.get('_flashes', [])))
+
+
+if __name__ == '__main__':
+    unittest.main()